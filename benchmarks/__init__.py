@@ -0,0 +1,5 @@
+"""
+Benchmark suite for api, parser and maps hot paths.
+
+Run it with: python -m benchmarks.run --output results.json
+"""
@@ -0,0 +1,259 @@
+"""
+Synthetic fixtures for benchmarks.
+
+- GTFS-like schedule rows (Trip, Route, StopTime, Stop) with realtime
+  information, shaped like DBQuerier/ResultsSet results.
+- SNCF api (Navitia) answers pages, shaped like recorded disruptions and
+  route_schedules answers.
+
+All fixtures are generated from a seeded random generator, so that runs are
+reproducible.
+"""
+
+import json
+import random
+from datetime import datetime, timedelta
+
+SEED = 42
+
+LINES = ['C', 'D', 'E', 'H', 'J', 'K', 'N', 'P', 'U']
+
+
+class Row:
+    """ Plain attributes object.
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class ResultRow(Row):
+    """ Result row, as returned by DBQuerier (level 3) then ResultsSet.
+    """
+
+    def has_realtime(self):
+        return getattr(self, "RealTime", None) is not None
+
+
+def _time(seconds):
+    return "%02d:%02d:%02d" % (
+        seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+
+def stations(n_stations=500, rng=None):
+    rng = rng or random.Random(SEED)
+    return [
+        Row(
+            stop_id="StopPoint:DUA87%05d" % i,
+            stop_name="Station %d" % i,
+            stop_lat="%.6f" % (48.5 + rng.random()),
+            stop_lon="%.6f" % (1.8 + rng.random()),
+            location_type="0",
+            parent_station="StopArea:DUA87%05d" % i,
+        )
+        for i in range(n_stations)
+    ]
+
+
+def trips_results(n_trips=500, stops_per_trip=20, seed=SEED):
+    """ Returns (trips rows, stoptimes rows), with realtime information on
+    roughly half of passed stoptimes.
+    """
+    rng = random.Random(seed)
+    all_stations = stations(rng=rng)
+    trips = []
+    stoptimes = []
+    for t in range(n_trips):
+        line = LINES[t % len(LINES)]
+        trip = Row(
+            trip_id="DUASN%06dF0100%d-1_%d" % (t, t % 10, 400000 + t),
+            route_id="DUA8008%s" % line,
+            service_id="%d" % (t % 50),
+            trip_headsign="%06d" % (100000 + t),
+            direction_id=str(t % 2),
+            block_id="",
+        )
+        route = Row(
+            route_id=trip.route_id,
+            agency_id="DUA847",
+            route_short_name=line,
+            route_long_name="Ligne %s" % line,
+            route_type="2",
+        )
+        trips.append(ResultRow(Trip=trip, Route=route))
+
+        departure = 5 * 3600 + rng.randint(0, 18 * 3600)
+        delay = 0
+        for sequence in range(stops_per_trip):
+            stop = all_stations[rng.randrange(len(all_stations))]
+            departure += rng.randint(90, 300)
+            stoptime = Row(
+                trip_id=trip.trip_id,
+                arrival_time=_time(departure),
+                departure_time=_time(departure),
+                stop_id=stop.stop_id,
+                stop_sequence=str(sequence),
+                pickup_type="0",
+                drop_off_type="0",
+            )
+            row = ResultRow(Trip=trip, Route=route, StopTime=stoptime,
+                            Stop=stop)
+            passed = sequence < stops_per_trip // 2
+            if passed and rng.random() < 0.5:
+                delay = max(0, delay + rng.randint(-60, 120))
+                row.RealTime = Row(
+                    expected_passage_time=_time(departure + delay),
+                    data_freshness="realtime",
+                    train_num=trip.trip_headsign,
+                    station_8d=stop.stop_id[-8:],
+                )
+                row.StopTimeState = Row(
+                    delay=str(delay),
+                    passed_schedule="True",
+                    passed_realtime="True",
+                )
+            stoptimes.append(row)
+    return trips, stoptimes
+
+
+def prediction_rows(stoptimes_rows):
+    """ StopTimePredictor-like rows, from stoptimes rows of one trip.
+    """
+    rows = []
+    for row in stoptimes_rows:
+        rows.append(ResultRow(
+            StopTime=row.StopTime,
+            Stop=row.Stop,
+            RealTime=getattr(row, "RealTime", None),
+            StopTimeState=getattr(row, "StopTimeState", None),
+            at_datetime="20170301T120000",
+            scheduled_day="20170301",
+            next_stop_passed_realtime="False",
+            to_predict=str(not row.has_realtime()),
+            prediction="1.5",
+        ))
+    return rows
+
+
+def _navitia_time(dt):
+    return dt.strftime('%Y%m%dT%H%M%S')
+
+
+def _coord(rng):
+    return {"lon": "%.6f" % (-1 + 8 * rng.random()),
+            "lat": "%.6f" % (43 + 6 * rng.random())}
+
+
+def disruption(i, rng, now=None):
+    now = now or datetime.now()
+    severity = "trip canceled" if rng.random() < 0.2 else "trip delayed"
+    impacted_stops = []
+    base = rng.randint(5 * 3600, 22 * 3600)
+    for s in range(rng.randint(3, 15)):
+        base += rng.randint(120, 600)
+        amended = base + rng.randint(0, 1800)
+        impacted_stops.append({
+            "stop_point": {
+                "id": "stop_point:OCE:SP:Train-87%06d" % rng.randint(0, 999999),
+                "name": "Stop %d" % s,
+                "coord": _coord(rng),
+            },
+            "base_arrival_time": _time(base % 86400).replace(":", ""),
+            "amended_arrival_time": _time(amended % 86400).replace(":", ""),
+            "base_departure_time": _time(base % 86400).replace(":", ""),
+            "amended_departure_time": _time(amended % 86400).replace(":", ""),
+            "cause": rng.choice(["", "Incident technique", "Accident"]),
+            "stop_time_effect": "delayed",
+        })
+    trip_id = "OCE:SN:%06dF01001-1_%d" % (i, 400000 + i)
+    return {
+        "id": "disruption-%d" % i,
+        "disruption_id": "disruption-%d" % i,
+        "impact_id": "impact-%d" % i,
+        "status": "active",
+        "updated_at": _navitia_time(now - timedelta(minutes=i % 60)),
+        "severity": {"name": severity, "effect": "SIGNIFICANT_DELAYS",
+                     "priority": 42, "color": "#000000"},
+        "application_periods": [{
+            "begin": _navitia_time(now - timedelta(hours=1)),
+            "end": _navitia_time(now + timedelta(hours=12)),
+        }],
+        "messages": [{"text": "Retard", "channel": {"name": "web"}}],
+        "impacted_objects": [{
+            "pt_object": {
+                "id": trip_id,
+                "name": trip_id,
+                "embedded_type": "trip",
+                "quality": 0,
+                "trip": {"id": trip_id, "name": "%06d" % i},
+            },
+            "impacted_stops": impacted_stops,
+        }],
+    }
+
+
+def disruptions_pages(n_pages=10, per_page=50, seed=SEED):
+    """ Returns {page: response} like navitia_client multipage answers.
+    """
+    rng = random.Random(seed)
+    total = n_pages * per_page
+    pages = {}
+    for page in range(n_pages):
+        items = [disruption(page * per_page + i, rng)
+                 for i in range(per_page)]
+        pages[page] = FakeResponse({
+            "disruptions": items,
+            "pagination": {"total_result": total, "start_page": page,
+                           "items_per_page": per_page,
+                           "items_on_page": per_page},
+            "links": [{"href": "https://api.sncf.com/v1/coverage/sncf/"
+                       "disruptions", "type": "disruptions",
+                       "templated": False}],
+        })
+    return pages
+
+
+def route_schedule(trip_id, n_stops=20, seed=SEED):
+    rng = random.Random(seed)
+    rows = []
+    for s in range(n_stops):
+        rows.append({
+            "stop_point": {
+                "id": "stop_point:OCE:SP:Train-87%06d" % s,
+                "name": "Stop %d" % s,
+                "label": "Stop %d" % s,
+                "coord": _coord(rng),
+            },
+            "date_times": [{"date_time": "20170301T%02d%02d00"
+                            % (8 + s // 6, (s * 10) % 60),
+                            "data_freshness": "base_schedule"}],
+        })
+    return {
+        "display_informations": {
+            "label": "TER %s" % trip_id[-6:],
+            "network": "SNCF",
+            "direction": "Stop %d" % (n_stops - 1),
+            "commercial_mode": "TER",
+        },
+        "table": {"rows": rows, "headers": []},
+        "additional_informations": None,
+    }
+
+
+def route_schedules_page(trip_id, n_stops=20):
+    return {0: FakeResponse({
+        "route_schedules": [route_schedule(trip_id, n_stops)],
+        "pagination": {"total_result": 1, "start_page": 0,
+                       "items_per_page": 10, "items_on_page": 1},
+        "links": [],
+        "disruptions": [],
+    })}
+
+
+class FakeResponse:
+    """ Recorded http answer, as used by RequestParser.
+    """
+
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.text = json.dumps(payload)
@@ -0,0 +1,307 @@
+"""
+Benchmarks runner.
+
+Usage:
+    python -m benchmarks.run [--repeat 5] [--only parser] [--output results.json]
+                             [--compare previous.json] [--threshold 0.2]
+
+External services are replaced by local stand-ins: Mongo by mongomock,
+DynamoDB by moto (if installed), the SNCF api by recorded-like pages, and
+schedule/realtime queriers by synthetic GTFS-like fixtures. Results (timings
+in seconds) are written as JSON, and can be compared to a previous run to
+detect regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from unittest import mock
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+os.environ.setdefault("MONGO_DB_NAME", "benchmarks")
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmarks")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmarks")
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """ Registers a benchmark. Decorated function does the setup, and returns
+    the function to time.
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def start_stand_ins():
+    """ Replaces Mongo and DynamoDB by in-process stand-ins.
+    """
+    try:
+        import moto
+        mock_aws = getattr(moto, "mock_aws", None) or moto.mock_dynamodb
+        mock_aws().start()
+    except ImportError:
+        print("moto not installed: DynamoDB is not mocked.")
+
+    import mongomock
+    from monitoring import utils_mongo
+    utils_mongo._shared_client = mongomock.MongoClient()
+
+
+# FIXTURES, shared between benchmarks and built once
+
+_fixtures = {}
+
+
+def trips_fixture():
+    if "trips" not in _fixtures:
+        from benchmarks import fixtures
+        _fixtures["trips"] = fixtures.trips_results(
+            n_trips=500, stops_per_trip=20)
+    return _fixtures["trips"]
+
+
+class FakeQuerier:
+    """ DBQuerier stand-in, serving synthetic fixtures.
+    """
+
+    def services(self, **kwargs):
+        return []
+
+    def trips(self, **kwargs):
+        return trips_fixture()[0][:kwargs.get("limit", 10000)]
+
+    def stoptimes(self, **kwargs):
+        stoptimes = trips_fixture()[1]
+        trip_id = kwargs.get("trip_id_filter")
+        if trip_id:
+            stoptimes = [row for row in stoptimes
+                         if row.StopTime.trip_id == trip_id]
+        return stoptimes[:kwargs.get("limit", 10000)]
+
+
+class FakeResultsSet:
+    """ ResultsSet stand-in: fixtures already hold realtime information.
+    """
+
+    def __init__(self, results, scheduled_day=None):
+        self.results = results
+
+    def batch_realtime_query(self, scheduled_day=None):
+        pass
+
+    def compute_stoptimes_states(self):
+        pass
+
+
+class FakeTripPredictor:
+    """ TripPredictor stand-in.
+    """
+
+    def __init__(self, trip_id):
+        from benchmarks import fixtures
+        stoptimes = FakeQuerier().stoptimes(trip_id_filter=trip_id)
+        self._stoptime_predictors = OrderedDict(
+            (i, row) for i, row in
+            enumerate(fixtures.prediction_rows(stoptimes)))
+
+
+# BENCHMARKS
+
+@benchmark("parser.RequestParser.parse")
+def bench_request_parser():
+    from benchmarks import fixtures
+    from maps.parser import RequestParser
+    pages = fixtures.disruptions_pages(n_pages=10, per_page=50)
+
+    def run():
+        RequestParser(pages, "disruptions").parse()
+    return run
+
+
+@benchmark("parser.flatten_dataframe")
+def bench_flatten_dataframe():
+    import pandas as pd
+    from benchmarks import fixtures
+    from maps.parser import flatten_dataframe
+    pages = fixtures.disruptions_pages(n_pages=10, per_page=50)
+    items = []
+    for page in pages.values():
+        items += json.loads(page.text)["disruptions"]
+    df = pd.DataFrame(items)
+
+    def run():
+        flatten_dataframe(df.copy(), drop=True, max_depth=5)
+    return run
+
+
+@benchmark("maps.disruption_to_geojsons")
+def bench_disruption_to_geojsons():
+    from benchmarks import fixtures
+    from maps import utils
+    pages = fixtures.disruptions_pages(n_pages=4, per_page=50)
+    disruptions = []
+    for page in pages.values():
+        disruptions += json.loads(page.text)["disruptions"]
+    # schedules are warm in Mongo
+    for disruption in disruptions:
+        object_id = disruption["impacted_objects"][0]["pt_object"]["id"]
+        utils.save_mongo_schedule(
+            object_id, fixtures.route_schedule(object_id))
+
+    def run():
+        for disruption in disruptions:
+            utils.disruption_to_geojsons(disruption)
+    return run
+
+
+@benchmark("serializers.NestedSerializer.10k")
+def bench_nested_serializer():
+    from project_api.serializers import NestedSerializer
+    rows = trips_fixture()[1][:10000]
+
+    def run():
+        NestedSerializer(rows, many=True).data
+    return run
+
+
+def _api_benchmark(url, params):
+    from django.test import Client
+    client = Client()
+
+    def run():
+        with mock.patch("project_api.views.DBQuerier", FakeQuerier), \
+                mock.patch("project_api.versions.DBQuerier", FakeQuerier), \
+                mock.patch("project_api.views.ResultsSet", FakeResultsSet), \
+                mock.patch("project_api.views.TripPredictor",
+                           FakeTripPredictor):
+            response = client.get(url, params)
+        assert response.status_code == 200, response.status_code
+    return run
+
+
+@benchmark("api.stoptimes.realtime")
+def bench_api_stoptimes():
+    return _api_benchmark("/api/stoptimes/", {
+        "realtime": "true", "level": 3, "limit": 500,
+        "active_at_time": "false", "on_day": "false",
+    })
+
+
+@benchmark("api.trips.level3")
+def bench_api_trips():
+    return _api_benchmark("/api/trips/", {"level": 3, "limit": 500})
+
+
+@benchmark("api.trip_prediction")
+def bench_api_trip_prediction():
+    trip_id = trips_fixture()[0][0].Trip.trip_id
+    return _api_benchmark(
+        "/api/trip-prediction/", {"trip_id": trip_id, "limit": 50})
+
+
+# RUNNER
+
+def time_function(function, repeat, warmup=1):
+    for _ in range(warmup):
+        function()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return {
+        "repeat": repeat,
+        "min": durations[0],
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+        "p95": durations[min(len(durations) - 1,
+                             int(round(0.95 * (len(durations) - 1))))],
+        "max": durations[-1],
+        "stdev": statistics.stdev(durations) if repeat > 1 else 0.,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, previous, threshold):
+    """ Prints median change against previous run, returns names of
+    benchmarks slower by more than threshold (ratio).
+    """
+    regressions = []
+    for name, result in results.items():
+        before = previous.get("results", {}).get(name)
+        if not before:
+            continue
+        change = result["median"] / before["median"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("%-40s %+7.1f%%%s" % (name, change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", default=None,
+                        help="run benchmarks whose name contains this")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    import django
+    django.setup()
+    start_stand_ins()
+
+    results = OrderedDict()
+    for name, setup in BENCHMARKS.items():
+        if args.only and args.only not in name:
+            continue
+        function = setup()
+        results[name] = time_function(function, args.repeat)
+        print("%-40s median %8.2f ms  (min %8.2f ms)" % (
+            name, results[name]["median"] * 1000, results[name]["min"] * 1000))
+
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(results, previous, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
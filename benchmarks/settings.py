@@ -0,0 +1,40 @@
+"""
+Settings used by benchmarks: no external database, no cache, no background
+jobs, so that timings only measure project code.
+"""
+
+from sncfweb.settings.base import *
+
+DEBUG = False
+
+SECRET_KEY = SECRET_KEY or "benchmarks"
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+}
+CACHE_POLICIES = []
+
+PREDICTION_SNAPSHOT_INTERVAL = None
+MONITORING_COLLECTOR_INTERVAL = None
+PROFILE_SAMPLE_RATE = 0
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': True,
+    'loggers': {
+        'django': {
+            'handlers': [],
+            'level': 'ERROR',
+            'propagate': False,
+        },
+    },
+}
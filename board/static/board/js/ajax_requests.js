@@ -1,5 +1,33 @@
 (function(global){
 
+    // Last version received per table, to only ask for changes when
+    // polling the same line or trip again
+    var versions = {trips: {}, stoptimes: {}};
+
+    function tripKey(row){
+        return row.Trip.trip_id;
+    }
+
+    function stopTimeKey(row){
+        return row.StopTime.trip_id + ":" + row.StopTime.stop_sequence;
+    }
+    global.stopTimeKey = stopTimeKey;
+
+    function withVersion(state, subject, data, table, key){
+        if (state.subject === subject && state.version){
+            data.since = state.version;
+        }
+        return function(response){
+            state.subject = subject;
+            state.version = response.version || null;
+            if (response.delta){
+                global.applyTableDelta(table, response, key);
+            } else {
+                global.updateTableData(table, response);
+            }
+        };
+    }
+
     // Ajax update Trips on selected Line
     global.ajaxCallTrips = function(selectedLine){
         console.log("Ajax call for datatable.")
@@ -9,7 +37,8 @@
             limit:500,
             on_route_short_name: selectedLine
         };
-        var success = global.updateTableData.bind(this,global.tripDatatable);
+        var success = withVersion(
+            versions.trips, selectedLine, data, global.tripDatatable, tripKey);
 
         $.get(url, data, success)
     }
@@ -23,12 +52,15 @@
             realtime: true,
             trip_id_filter: selectedTrip,
             limit:50, // max number of elements (for pagination)
-            level: 3, // to get StopTime, Stop
-            active_at_time: false,
-            on_day: false
+            level: 3 // to get StopTime, Stop
+            // selected trips come from the active trips table: default
+            // active_at_time/on_day (active now) keep this poll covered by
+            // the change log (since=<version>)
         };
 
-        var success = global.updateTableData.bind(this, global.focusedTripPredictionDatatable);
+        var success = withVersion(
+            versions.stoptimes, selectedTrip, data,
+            global.focusedTripPredictionDatatable, stopTimeKey);
 
         $.get(url, data, success)
     }
@@ -47,4 +79,10 @@
         $.get(url, data, success)
     }
 
-}(window))
\ No newline at end of file
+    // Forget versions: next calls reload whole tables
+    global.resetVersions = function(){
+        versions.trips = {};
+        versions.stoptimes = {};
+    }
+
+}(window))
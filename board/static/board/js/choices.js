@@ -20,6 +20,7 @@
         refreshLineChoiceText();
         // empty table
         global.updateTableData(global.tripDatatable);
+        global.resetVersions();
         // gets data in table
         ajaxCallTrips(line);
     }
@@ -64,6 +65,18 @@
         // send ajax call to update stoptimes of trip
         global.ajaxCallStopTimes(data.Trip.trip_id);
         global.ajaxCallPredictionStopTimes(data.Trip.trip_id);
+        // then receive its updates, if pushed
+        global.subscribeTrip(data.Trip.trip_id);
+    }
+
+    // Poll changes of selected line and trip
+    function pollChanges(){
+        if (global.selectedLine){
+            ajaxCallTrips(global.selectedLine);
+        }
+        if (global.focusedTripData && !global.pushActive){
+            global.ajaxCallStopTimes(global.focusedTripData.Trip.trip_id);
+        }
     }
 
     function emptyTables(){
@@ -84,5 +97,7 @@
     global.initDatatables();
     // Interaction
     tripTableInteractionInit();
+    // Polling
+    setInterval(pollChanges, 30000);
 
 }(window))
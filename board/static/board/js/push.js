@@ -0,0 +1,36 @@
+(function(global){
+
+    // Server-sent events subscription of focused trip, when site is served
+    // by the ASGI application (sncfweb/asgi.py)
+    var source = null;
+    global.pushActive = false;
+
+    global.subscribeTrip = function(tripId){
+        global.unsubscribeTrip();
+        if (!global.EventSource){return;}
+        var table = global.focusedTripPredictionDatatable;
+        source = new EventSource("/stream/?trip_id=" + encodeURIComponent(tripId));
+        source.addEventListener("update", function(event){
+            global.pushActive = true;
+            var data = JSON.parse(event.data);
+            if (data.delta){
+                global.applyTableDelta(table, data, global.stopTimeKey);
+            } else {
+                global.updateTableData(table, data);
+            }
+        });
+        source.onerror = function(){
+            // no push endpoint: keep polling instead
+            if (!global.pushActive){global.unsubscribeTrip();}
+        };
+    };
+
+    global.unsubscribeTrip = function(){
+        if (source){
+            source.close();
+            source = null;
+        }
+        global.pushActive = false;
+    };
+
+}(window))
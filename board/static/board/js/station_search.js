@@ -0,0 +1,46 @@
+(function(global){
+
+    // Stations are searched on server side while typing, instead of loading
+    // whole stations list in browser.
+    var lastQuery = null;
+    var timer = null;
+
+    function searchStations(query){
+        lastQuery = query;
+        if (!query){
+            displayResults([]);
+            return;
+        }
+        $.get(global.stationSearchUrl, {q: query, limit: 10}, function(data){
+            // ignore answers of outdated queries
+            if (query !== lastQuery){return;}
+            displayResults(data);
+        });
+    }
+
+    function displayResults(stations){
+        var items = d3.select("#station-search-results")
+            .selectAll(".station-result").data(stations, function(d){return d.uic8;});
+        items.exit().remove();
+        items.enter()
+            .append("li")
+                .classed("list-group-item station-result", true)
+                .text(function(d){return d.label + " (" + d.city + ")";})
+                .on("click", selectStation);
+    }
+
+    function selectStation(station){
+        console.log("Station "+station.uic8+" is selected.");
+        global.selectedStation = station;
+        $("#chosen-station-text").text("You chose " + station.label + ", UIC " + station.uic8 + ".");
+        displayResults([]);
+    }
+
+    // INIT
+    $("#station-search-input").on("input", function(){
+        var query = $(this).val();
+        clearTimeout(timer);
+        timer = setTimeout(function(){searchStations(query);}, 150);
+    });
+
+}(window))
@@ -87,4 +87,19 @@
         table.draw();
 
     };
+
+    global.applyTableDelta = function(table, data, key){
+        // replace changed rows, remove deleted ones, keep others
+        var changed = {};
+        data.results.forEach(function(row){changed[key(row)] = row;});
+        var removed = {};
+        data.deleted.forEach(function(rowKey){removed[rowKey] = true;});
+
+        table.rows(function(index, row){
+            var rowKey = key(row);
+            return removed[rowKey] || changed.hasOwnProperty(rowKey);
+        }).remove();
+        table.rows.add(data.results);
+        table.draw(false);
+    };
 }(window))
\ No newline at end of file
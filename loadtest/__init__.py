@@ -0,0 +1,5 @@
+"""
+Load testing harness reproducing the site real traffic mix.
+
+See loadtest/run.py for usage.
+"""
@@ -0,0 +1,194 @@
+"""
+Load test runner.
+
+Usage:
+    python -m loadtest.run --url http://localhost:8080 --users 50 \
+        --duration 60 [--output report.json]
+
+Virtual users run on one asyncio event loop, each with its own keep-alive
+connection, sending requests of the traffic mix (loadtest/scenario.py) back
+to back (optionally with --think-time seconds between requests). Report
+gives, per endpoint, requests per second, errors and p50/p95/p99 latencies.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict, OrderedDict
+from urllib.parse import urlencode, urlsplit
+
+from loadtest.scenario import Scenario
+
+
+class HttpConnection:
+    """ Minimal HTTP/1.1 keep-alive client on asyncio streams.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        """ Returns (status, body bytes).
+        """
+        if self.writer is None:
+            await self.connect()
+        self.writer.write((
+            "GET %s HTTP/1.1\r\nHost: %s\r\nAccept-Encoding: identity\r\n"
+            "Connection: keep-alive\r\n\r\n" % (path, self.host)
+        ).encode("latin-1"))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            body = await self.reader.readexactly(
+                int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            body = b""
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                body += await self.reader.readexactly(size)
+                await self.reader.readline()
+        else:
+            body = await self.reader.read()
+            self.close()
+
+        if headers.get("connection") == "close":
+            self.close()
+        return status, body
+
+
+class Stats:
+    """ Latencies and errors per endpoint.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def report(self, duration):
+        report = OrderedDict()
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies[name])
+            report[name] = {
+                "requests": len(latencies),
+                "errors": self.errors[name],
+                "rps": len(latencies) / duration,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+            }
+        return report
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1,
+                int(round(q / 100. * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def virtual_user(base, scenario, stats, deadline, think_time):
+    connection = HttpConnection(base.hostname, base.port or 80)
+    while time.time() < deadline:
+        name, path, params = scenario.next_request()
+        url = base.path.rstrip("/") + path
+        if params:
+            url += "?" + urlencode(params)
+        start = time.time()
+        try:
+            status, body = await connection.get(url)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            connection.close()
+            stats.errors[name] += 1
+            continue
+        latency = time.time() - start
+        if status >= 400:
+            stats.errors[name] += 1
+        else:
+            stats.latencies[name].append(latency)
+            if name == "trips":
+                try:
+                    scenario.record_trips(json.loads(body.decode("utf-8")))
+                except ValueError:
+                    pass
+        if think_time:
+            await asyncio.sleep(think_time)
+    connection.close()
+
+
+async def run_load(url, users, duration, think_time, seed):
+    base = urlsplit(url)
+    scenario = Scenario(seed=seed)
+    stats = Stats()
+    start = time.time()
+    deadline = start + duration
+    await asyncio.gather(*[
+        virtual_user(base, scenario, stats, deadline, think_time)
+        for _ in range(users)
+    ])
+    return stats.report(time.time() - start)
+
+
+def print_report(report):
+    print("%-18s %9s %7s %8s %9s %9s %9s" % (
+        "endpoint", "requests", "errors", "rps", "p50 ms", "p95 ms", "p99 ms"))
+    for name, line in report.items():
+        print("%-18s %9d %7d %8.1f %9s %9s %9s" % (
+            name, line["requests"], line["errors"], line["rps"],
+            *("%.1f" % (line[q] * 1000) if line[q] is not None else "-"
+              for q in ("p50", "p95", "p99"))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=60.)
+    parser.add_argument("--think-time", type=float, default=0.)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(run_load(
+        args.url, args.users, args.duration, args.think_time, args.seed))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"url": args.url, "users": args.users,
+                       "duration": args.duration, "endpoints": report},
+                      f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
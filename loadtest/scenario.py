@@ -0,0 +1,89 @@
+"""
+Traffic mix of the site.
+
+Each endpoint has a weight (relative frequency of requests) and a function
+building request parameters. Board users poll trips of a line, then
+stoptimes and predictions of a focused trip; map users load stop points of
+their view and active disruptions.
+"""
+
+import random
+from collections import OrderedDict
+
+LINES = ['C', 'D', 'E', 'H', 'J', 'K', 'N', 'P', 'U']
+
+# Ile-de-France views, as min_lng, min_lat, max_lng, max_lat
+MAP_VIEWS = [
+    (2.2, 48.8, 2.5, 48.95),
+    (1.9, 48.6, 2.8, 49.1),
+    (1.4, 48.3, 3.3, 49.3),
+    (-5., 42., 8., 51.),
+]
+
+
+class Scenario:
+    """ Weighted endpoints, with parameters generators.
+
+    trip_ids are discovered from /api/trips/ answers while the test runs, so
+    that trip focused endpoints query real trips.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.trip_ids = []
+        self.endpoints = OrderedDict([
+            ("trips", (30, self.trips)),
+            ("stoptimes", (25, self.stoptimes)),
+            ("trip_prediction", (25, self.trip_prediction)),
+            ("stop_points", (10, self.stop_points)),
+            ("disruptions", (10, self.disruptions)),
+        ])
+        self._names = list(self.endpoints.keys())
+        self._weights = [weight for weight, _ in self.endpoints.values()]
+
+    def next_request(self):
+        """ Returns (endpoint name, path, params).
+        """
+        name = self.rng.choices(self._names, weights=self._weights)[0]
+        path, params = self.endpoints[name][1]()
+        return name, path, params
+
+    def record_trips(self, payload):
+        """ Collects trip_ids from a /api/trips/ answer.
+        """
+        for result in payload.get("results", []):
+            trip = result.get("Trip") or result
+            trip_id = trip.get("trip_id")
+            if trip_id and trip_id not in self.trip_ids:
+                self.trip_ids.append(trip_id)
+        del self.trip_ids[:-1000]
+
+    def _trip_id(self):
+        if not self.trip_ids:
+            return ""
+        return self.rng.choice(self.trip_ids)
+
+    def trips(self):
+        return "/api/trips/", {
+            "level": 3, "limit": 500,
+            "on_route_short_name": self.rng.choice(LINES),
+        }
+
+    def stoptimes(self):
+        return "/api/stoptimes/", {
+            "realtime": "true", "trip_id_filter": self._trip_id(),
+            "limit": 50, "level": 3,
+            "active_at_time": "false", "on_day": "false",
+        }
+
+    def trip_prediction(self):
+        return "/api/trip-prediction/", {
+            "trip_id": self._trip_id(), "limit": 50,
+        }
+
+    def stop_points(self):
+        view = self.rng.choice(MAP_VIEWS)
+        return "/maps/stop_points", {"bbox": ",".join(map(str, view))}
+
+    def disruptions(self):
+        return "/maps/disruptions", {}
@@ -0,0 +1,50 @@
+"""
+Seeds local Mongo stand-in with data needed by maps endpoints:
+- stop_points, from maps/static/maps/fr_stop_points.geojson
+- active disruptions and their warm route_schedules, from benchmark fixtures
+
+Usage (with loadtest/local.env variables exported):
+    python -m loadtest.seed
+
+Schedule (Postgres) and realtime (DynamoDB) data are loaded by the ETL
+application (Transilien-Api-ETL, in lib folder), pointed to the same local
+services.
+"""
+
+import json
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sncfweb.settings.dev")
+
+
+def main():
+    import django
+    django.setup()
+
+    from benchmarks import fixtures
+    from maps import utils
+    from maps.indexes import ensure_indexes
+    from maps.spatial_index import STOP_POINTS_GEOJSON
+
+    with open(STOP_POINTS_GEOJSON, encoding="utf-8-sig") as f:
+        stop_points = json.load(f)["features"]
+    collection = utils.get_collection("stop_points")
+    collection.delete_many({})
+    collection.insert_many(stop_points)
+    ensure_indexes(collection.database)
+    print("Inserted %d stop points." % len(stop_points))
+
+    pages = fixtures.disruptions_pages(n_pages=6, per_page=50)
+    count = 0
+    for page in pages.values():
+        for disruption in json.loads(page.text)["disruptions"]:
+            utils.insert_disruption_mongo(disruption)
+            object_id = disruption["impacted_objects"][0]["pt_object"]["id"]
+            utils.save_mongo_schedule(
+                object_id, fixtures.route_schedule(object_id))
+            count += 1
+    print("Inserted %d disruptions and their schedules." % count)
+
+
+if __name__ == "__main__":
+    main()
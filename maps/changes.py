@@ -0,0 +1,94 @@
+"""
+Change feed of disruptions ingestion.
+
+Each ingestion run compares disruptions content hashes with stored ones,
+only writes new or updated disruptions, and publishes the run changes: new,
+updated and closed (no longer in SNCF api answer) disruption_ids.
+
+Changes are stored in disruption_changes collection (for consumers in other
+processes, with changes_since), and passed to in-process listeners
+registered with on_disruption_changes (GeoJSON layer, caches).
+"""
+
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger("django")
+
+CHANGES_COLLECTION = "disruption_changes"
+# Changes are kept one day (TTL index on run_at)
+CHANGES_TTL_SECONDS = 24 * 3600
+
+# Fields not part of disruption content
+HASH_EXCLUDED_FIELDS = ("_id", "content_hash", "closed_at")
+
+
+def disruption_hash(disruption):
+    """ Hash of canonical JSON of disruption content.
+    """
+    content = {key: value for key, value in disruption.items()
+               if key not in HASH_EXCLUDED_FIELDS}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"),
+                           default=str)
+    return hashlib.md5(canonical.encode("utf-8")).hexdigest()
+
+
+class DisruptionChanges:
+    """ Changes of one ingestion run.
+    """
+
+    def __init__(self, run_at, new=(), updated=(), closed=()):
+        self.run_at = run_at
+        self.new = list(new)
+        self.updated = list(updated)
+        self.closed = list(closed)
+
+    def __bool__(self):
+        return bool(self.new or self.updated or self.closed)
+
+    def __repr__(self):
+        return "<DisruptionChanges %s: %d new, %d updated, %d closed>" % (
+            self.run_at, len(self.new), len(self.updated), len(self.closed))
+
+    def as_document(self):
+        return {"run_at": self.run_at, "new": self.new,
+                "updated": self.updated, "closed": self.closed}
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(document["run_at"], document.get("new", ()),
+                   document.get("updated", ()), document.get("closed", ()))
+
+
+_listeners = []
+
+
+def on_disruption_changes(listener):
+    """ Registers listener, called with DisruptionChanges after each run
+    with changes. Usable as decorator.
+    """
+    _listeners.append(listener)
+    return listener
+
+
+def publish_changes(collection, changes):
+    """ Stores changes in changes collection, and notifies listeners.
+    """
+    if not changes:
+        return
+    collection.insert_one(changes.as_document())
+    for listener in _listeners:
+        try:
+            listener(changes)
+        except Exception as e:
+            logger.warning("Disruption changes listener %s failed: %s"
+                           % (getattr(listener, "__name__", listener), e))
+
+
+def changes_since(collection, run_at=None):
+    """ Changes of runs after run_at (all kept runs if None), oldest first.
+    """
+    query = {"run_at": {"$gt": run_at}} if run_at else {}
+    return [DisruptionChanges.from_document(document)
+            for document in collection.find(query).sort("run_at", 1)]
@@ -0,0 +1,224 @@
+"""
+Trip geometries, built from local GTFS stop sequences.
+
+Drawing a disruption only needs coordinates of the stops of its trip: instead
+of fetching a full SNCF api route_schedules document, they are read from a
+precomputed store built from GTFS stoptimes (DBQuerier) and stations dataset
+coordinates (GTFS stops coordinates if station is unknown):
+
+- stops coordinates of each distinct stop sequence (path) are concatenated
+  in one float32 (n, 2) array of [lon, lat], zero coordinates filtered,
+  with offsets of each path;
+- trips are keyed by normalized trip id, and by train number (trip
+  headsign, which is the SNCF api trip name), in a sorted array searched by
+  bisection, pointing to their path.
+
+The store is saved as .npz by `manage.py build_trip_geometries`, loaded at
+startup, and reloaded by each process when the file changes (modification
+time, checked every GEOMETRIES_CHECK_SECONDS). Trips missing from store
+(outside of GTFS coverage) are drawn from their route schedule.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from project_api.stations_dataset import get_stations_dataset
+
+logger = logging.getLogger("django")
+
+TRIP_GEOMETRIES = os.path.join(settings.BASE_DIR, "data", "trip_geometries.npz")
+
+TRAIN_KEY_PREFIX = "train:"
+
+# Store file is checked for a new build at most every N seconds
+GEOMETRIES_CHECK_SECONDS = 60
+
+
+def trip_key(trip_id):
+    """ Part of trip id shared by GTFS and SNCF api ids:
+    "DUASN124705F01001-1_408286" and "OCE:SN:124705F01001-1_408286" both
+    give "124705F01001-1_408286".
+    """
+    return re.sub(r"^[A-Za-z]*", "", trip_id.rsplit(":", 1)[-1])
+
+
+def train_key(train_num):
+    return TRAIN_KEY_PREFIX + str(train_num)
+
+
+def stop_uic(stop_id):
+    """ UIC code in GTFS stop id ("StopPoint:DUA8727103" -> "8727103"), or
+    None.
+    """
+    match = re.search(r"(\d{7,8})$", stop_id or "")
+    return match.group(1) if match else None
+
+
+def is_zero(lon, lat):
+    return not (lon and lat) or np.isnan(lon) or np.isnan(lat)
+
+
+class StopCoordinates:
+    """ Stop id -> (lon, lat), from stations dataset, or GTFS stop row.
+    """
+
+    def __init__(self, stations=None):
+        self.stations = stations or get_stations_dataset()
+        self._cache = {}
+
+    def get(self, stop):
+        stop_id = stop.stop_id
+        if stop_id not in self._cache:
+            coords = None
+            row = self.stations.row(stop_uic(stop_id))
+            if row is not None:
+                entry = self.stations.table[row]
+                coords = (float(entry["lon"]), float(entry["lat"]))
+            if coords is None or is_zero(*coords):
+                try:
+                    coords = (float(stop.stop_lon), float(stop.stop_lat))
+                except (AttributeError, TypeError, ValueError):
+                    coords = None
+            if coords is not None and is_zero(*coords):
+                coords = None
+            self._cache[stop_id] = coords
+        return self._cache[stop_id]
+
+
+def build_trip_geometries(trips_stops, stations=None):
+    """
+    Builds store arrays from iterable of (trip_id, train_num, stops), stops
+    being GTFS stop rows in sequence order. Returns dictionary of arrays.
+    """
+    stop_coordinates = StopCoordinates(stations)
+    paths = {}
+    coords = []
+    offsets = [0]
+    key_path = {}
+    for trip_id, train_num, stops in trips_stops:
+        path = tuple(stop.stop_id for stop in stops)
+        path_index = paths.get(path)
+        if path_index is None:
+            path_coords = [c for c in map(stop_coordinates.get, stops)
+                           if c is not None]
+            if len(path_coords) < 2:
+                # not enough to draw a line
+                continue
+            path_index = paths[path] = len(offsets) - 1
+            coords.extend(path_coords)
+            offsets.append(len(coords))
+        key_path.setdefault(trip_key(trip_id), path_index)
+        if train_num:
+            key_path.setdefault(train_key(train_num), path_index)
+
+    keys = sorted(key_path)
+    return {
+        "keys": np.array([key.encode("utf-8") for key in keys],
+                         dtype="S%d" % max([1] + [len(key) for key in keys])),
+        "key_path": np.array([key_path[key] for key in keys], dtype=np.int32),
+        "offsets": np.array(offsets, dtype=np.int32),
+        "coords": np.array(coords, dtype=np.float32).reshape(-1, 2),
+    }
+
+
+def save_trip_geometries(arrays, path=TRIP_GEOMETRIES):
+    """ Writes store in a temporary file first, so that processes reloading
+    it never read a partially written store.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+class TripGeometries:
+    """ Trip key -> coordinates of its stops, as [[lon, lat], ...].
+    """
+
+    def __init__(self, keys, key_path, offsets, coords):
+        self.keys = keys
+        self.key_path = key_path
+        self.offsets = offsets
+        self.coords = coords
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _path(self, key):
+        key = key.encode("utf-8")
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(self.key_path[i])
+        return None
+
+    def path_coordinates(self, path):
+        start, end = self.offsets[path], self.offsets[path + 1]
+        # float32 values, rounded to avoid spurious decimals in JSON
+        return np.around(
+            self.coords[start:end].astype(np.float64), 6).tolist()
+
+    def coordinates(self, trip_id, train_num=None):
+        """ Coordinates of trip, found by id, else by train number. None if
+        trip is unknown.
+        """
+        path = self._path(trip_key(trip_id))
+        if path is None and train_num:
+            path = self._path(train_key(train_num))
+        if path is None:
+            return None
+        return self.path_coordinates(path)
+
+
+def load_trip_geometries(path=TRIP_GEOMETRIES):
+    """ Loads store if it was built, else returns an empty store.
+    """
+    if not os.path.exists(path):
+        logger.warning(
+            "%s not found, disruptions are drawn from route schedules: run "
+            "'manage.py build_trip_geometries' to build it." % path)
+        return TripGeometries(
+            np.zeros(0, dtype="S1"), np.zeros(0, dtype=np.int32),
+            np.zeros(1, dtype=np.int32), np.zeros((0, 2), dtype=np.float32))
+    with np.load(path, allow_pickle=False) as arrays:
+        return TripGeometries(**{name: arrays[name] for name in arrays.files})
+
+
+def _modified_at(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+# (file modification time, store) of loaded store
+_geometries = None
+_geometries_checked_at = 0
+_geometries_lock = threading.Lock()
+
+
+def get_trip_geometries():
+    """ Returns trip geometries store, loaded on first call, and reloaded
+    when store file was modified since (rebuilt by build_trip_geometries).
+    """
+    global _geometries, _geometries_checked_at
+    if _geometries is not None and \
+            time.time() - _geometries_checked_at < GEOMETRIES_CHECK_SECONDS:
+        return _geometries[1]
+    with _geometries_lock:
+        if _geometries is None or \
+                time.time() - _geometries_checked_at >= \
+                GEOMETRIES_CHECK_SECONDS:
+            modified_at = _modified_at(TRIP_GEOMETRIES)
+            if _geometries is None or modified_at != _geometries[0]:
+                if _geometries is not None:
+                    logger.info("Reloading %s." % TRIP_GEOMETRIES)
+                _geometries = (
+                    modified_at, load_trip_geometries(TRIP_GEOMETRIES))
+            _geometries_checked_at = time.time()
+    return _geometries[1]
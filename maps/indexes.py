@@ -0,0 +1,200 @@
+"""
+Mongo indexes needed by maps queries.
+
+- route_schedules: point read by object_id, and TTL index on updated_time
+  (a real datetime), so that stale schedules expire inside Mongo.
+- disruptions: upserts and content hashes lookups by disruption_id, active
+  disruptions filter on application_periods.end, last update sort on
+  updated_at (ingestion lag).
+- disruption_changes: last run sort on run_at, and TTL index on run_at.
+- stop_points: 2dsphere index for $near queries.
+- delay_rollups: stats queries by day, dimension and key (hours sorted);
+  delay_observations: TTL index on updated_at.
+- change_log: capped collection (project_api/changelog.py), entries read by
+  sequence number.
+
+Indexes are created by `python manage.py mongo_indexes`, and checked at
+startup. Explain plans of the main queries are checked to use an index.
+"""
+
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE
+from pymongo.errors import CollectionInvalid
+
+from .changes import CHANGES_COLLECTION, CHANGES_TTL_SECONDS
+
+logger = logging.getLogger("django")
+
+# Schedules older than this are removed by Mongo (TTL monitor runs every
+# minute), and ignored by lookups meanwhile.
+SCHEDULE_TTL_SECONDS = 3 * 3600
+
+# Delay observations are only needed while their source can still change
+DELAY_OBSERVATIONS_TTL_SECONDS = 24 * 3600
+
+# Change log entries kept (project_api/changelog.py), of at most 4KB each
+CHANGELOG_SIZE = getattr(settings, "CHANGELOG_SIZE", 50000)
+
+# collection -> (max size in bytes, max number of documents), for capped
+# collections (created before their indexes)
+CAPPED_COLLECTIONS = OrderedDict([
+    ("change_log", (CHANGELOG_SIZE * 4096, CHANGELOG_SIZE)),
+])
+
+# collection -> list of (keys, options)
+MONGO_INDEXES = OrderedDict([
+    ("route_schedules", [
+        ([("object_id", ASCENDING), ("updated_time", DESCENDING)], {}),
+        ([("updated_time", ASCENDING)],
+         {"expireAfterSeconds": SCHEDULE_TTL_SECONDS}),
+    ]),
+    ("disruptions", [
+        ([("disruption_id", ASCENDING)], {}),
+        ([("application_periods.end", ASCENDING)], {}),
+        ([("updated_at", DESCENDING)], {}),
+    ]),
+    (CHANGES_COLLECTION, [
+        ([("run_at", ASCENDING)], {"expireAfterSeconds": CHANGES_TTL_SECONDS}),
+    ]),
+    ("stop_points", [
+        ([("geometry", GEOSPHERE)], {}),
+    ]),
+    ("delay_rollups", [
+        ([("day", ASCENDING), ("dimension", ASCENDING), ("key", ASCENDING),
+          ("hour", ASCENDING)], {}),
+    ]),
+    ("delay_observations", [
+        ([("updated_at", ASCENDING)],
+         {"expireAfterSeconds": DELAY_OBSERVATIONS_TTL_SECONDS}),
+    ]),
+    ("change_log", [
+        ([("seq", ASCENDING)], {}),
+    ]),
+])
+
+
+def ensure_capped_collection(database, name, size, max_documents):
+    """ Creates capped collection if it doesn't exist. An existing
+    collection is left as is, with a warning if it is not capped.
+    """
+    try:
+        database.create_collection(
+            name, capped=True, size=size, max=max_documents)
+    except CollectionInvalid:
+        if not database[name].options().get("capped"):
+            logger.warning("%s collection exists and is not capped." % name)
+
+
+def explain_queries():
+    """ Main maps queries, as name -> (collection, filter, sort).
+    """
+    now = datetime.utcnow()
+    return OrderedDict([
+        ("schedule lookup", ("route_schedules", {
+            "object_id": "OCE:SN:000000F01001-1_400000",
+            "updated_time": {"$gte": now}}, None)),
+        ("active disruptions", ("disruptions", {
+            "application_periods.end": {"$gte": now.strftime('%Y%m%dT%H%M%S')},
+            "closed_at": {"$exists": False}}, None)),
+        ("disruption upsert", ("disruptions", {
+            "disruption_id": "disruption-0"}, None)),
+        ("last disruption update", ("disruptions", {}, [("updated_at", -1)])),
+        ("last disruption change", (CHANGES_COLLECTION, {},
+                                    [("run_at", -1)])),
+        ("changes since", ("change_log", {"seq": {"$gt": 0}},
+                           [("seq", 1)])),
+        ("line stats", ("delay_rollups", {
+            "day": now.strftime('%Y%m%d'), "dimension": "line"},
+            [("key", 1), ("hour", 1)])),
+        ("near stations", ("stop_points", {"geometry": {"$near": {
+            "$geometry": {"type": "Point", "coordinates": [2.35, 48.85]},
+            "$maxDistance": 1000}}}, None)),
+    ])
+
+
+def ensure_indexes(database):
+    """ Creates missing indexes, returns names of indexes (existing indexes
+    are left untouched by Mongo).
+    """
+    for collection_name, (size, max_documents) in CAPPED_COLLECTIONS.items():
+        ensure_capped_collection(database, collection_name, size, max_documents)
+    names = []
+    for collection_name, indexes in MONGO_INDEXES.items():
+        collection = database[collection_name]
+        for keys, options in indexes:
+            names.append(collection.create_index(keys, **options))
+    return names
+
+
+def verify_indexes(database):
+    """ Returns list of problems: missing indexes, or wrong TTL.
+    """
+    problems = []
+    for collection_name, indexes in MONGO_INDEXES.items():
+        existing = database[collection_name].index_information()
+        by_keys = {tuple(tuple(key) for key in info["key"]): info
+                   for info in existing.values()}
+        for keys, options in indexes:
+            info = by_keys.get(tuple((name, direction)
+                                     for name, direction in keys))
+            if info is None:
+                problems.append("%s: missing index on %s" % (
+                    collection_name, ", ".join(name for name, _ in keys)))
+            elif "expireAfterSeconds" in options and \
+                    info.get("expireAfterSeconds") != \
+                    options["expireAfterSeconds"]:
+                problems.append("%s: index on %s has TTL %s instead of %s" % (
+                    collection_name, ", ".join(name for name, _ in keys),
+                    info.get("expireAfterSeconds"),
+                    options["expireAfterSeconds"]))
+    return problems
+
+
+def plan_stages(plan):
+    """ Yields stage names of an explain plan tree.
+    """
+    yield plan.get("stage")
+    children = list(plan.get("inputStages", []))
+    if "inputStage" in plan:
+        children.append(plan["inputStage"])
+    for child in children:
+        for stage in plan_stages(child):
+            yield stage
+
+
+def verify_explain_plans(database):
+    """ Returns list of problems: queries whose winning plan scans whole
+    collection instead of using an index.
+    """
+    problems = []
+    for name, (collection_name, query, sort) in explain_queries().items():
+        cursor = database[collection_name].find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = set(plan_stages(plan))
+        if "COLLSCAN" in stages or not stages & {
+                "IXSCAN", "GEO_NEAR_2DSPHERE", "EOF"}:
+            problems.append("%s: query plan does not use an index (%s)" % (
+                name, ", ".join(sorted(s for s in stages if s))))
+    return problems
+
+
+def check_mongo_indexes(database):
+    """ Startup check: logs missing indexes, without creating them (index
+    builds can be long, they are run by mongo_indexes command).
+    """
+    try:
+        problems = verify_indexes(database)
+    except Exception as e:
+        logger.warning("Mongo indexes check failed: %s" % e)
+        return None
+    for problem in problems:
+        logger.warning(
+            "Mongo index problem, run 'manage.py mongo_indexes': %s"
+            % problem)
+    return problems
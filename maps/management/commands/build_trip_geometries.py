@@ -0,0 +1,48 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+
+from lib.api_etl.querier_schedule import DBQuerier
+
+from maps.geometries import (
+    build_trip_geometries, save_trip_geometries, TRIP_GEOMETRIES
+)
+from project_api.export import iter_line_rows
+from project_api.versions import schedule_day
+
+
+def _sequence(row):
+    return int(row.StopTime.stop_sequence)
+
+
+def iter_trips_stops(day):
+    """ Yields (trip_id, train_num, stops) of trips of day, line by line.
+    """
+    for _, rows in iter_line_rows(DBQuerier(), day):
+        rows = sorted(rows, key=lambda row: (row.StopTime.trip_id,
+                                             _sequence(row)))
+        for trip_id, trip_rows in groupby(
+                rows, key=lambda row: row.StopTime.trip_id):
+            trip_rows = list(trip_rows)
+            train_num = getattr(trip_rows[0].Trip, "trip_headsign", None)
+            yield trip_id, train_num, [row.Stop for row in trip_rows]
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds trip geometries store (stops coordinates of each trip) from "
+        "GTFS stoptimes of a day and stations dataset.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--day", default=None, help="yyyymmdd, today "
+                            "if not provided")
+        parser.add_argument("--output", default=TRIP_GEOMETRIES)
+
+    def handle(self, *args, **options):
+        arrays = build_trip_geometries(
+            iter_trips_stops(schedule_day(options["day"])))
+        save_trip_geometries(arrays, options["output"])
+        self.stdout.write(
+            "Saved %d trip keys, %d paths (%d bytes of coordinates) in %s."
+            % (len(arrays["keys"]), len(arrays["offsets"]) - 1,
+               arrays["coords"].nbytes, options["output"]))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from maps.indexes import ensure_indexes, verify_indexes, verify_explain_plans
+from maps.utils import get_collection
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates Mongo indexes of maps collections, then verifies them and "
+        "explain plans of maps queries.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true",
+            help="only verify indexes and explain plans, don't create")
+
+    def handle(self, *args, **options):
+        database = get_collection("route_schedules").database
+
+        if not options["check"]:
+            names = ensure_indexes(database)
+            self.stdout.write("Indexes: %s." % ", ".join(names))
+            # schedules saved with string dates would never expire
+            deleted = database["route_schedules"].delete_many(
+                {"updated_time": {"$type": "string"}}).deleted_count
+            if deleted:
+                self.stdout.write(
+                    "Deleted %d schedules with string dates." % deleted)
+
+        problems = verify_indexes(database) + verify_explain_plans(database)
+        for problem in problems:
+            self.stderr.write(problem)
+        if problems:
+            raise CommandError("%d Mongo index problems." % len(problems))
+        self.stdout.write("Indexes and query plans are fine.")
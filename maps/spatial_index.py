@@ -0,0 +1,194 @@
+"""
+In-memory spatial index over stop points.
+
+Stop points don't change between deployments, so instead of running a Mongo
+$near query for each map load, they are loaded once in memory and indexed on
+a regular latitude/longitude grid.
+
+- bbox queries only scan grid cells overlapping the asked bounding box.
+- k-nearest queries compute haversine distances on coordinates arrays (a few
+  thousands points) with numpy, and partially sort them.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from maps.utils import query_mongo_all_stop_points
+
+logger = logging.getLogger("django")
+
+STOP_POINTS_GEOJSON = os.path.join(
+    settings.BASE_DIR, "maps", "static", "maps", "fr_stop_points.geojson")
+# Ile-de-France stations of the transilien map
+TRANSILIEN_STATIONS_GEOJSON = os.path.join(
+    settings.BASE_DIR, "maps", "static", "maps", "stations.geojson")
+
+EARTH_RADIUS_KM = 6371.0
+
+# Maximum number of features returned by a stop points query
+MAX_FEATURES = 10000
+
+
+class GridSpatialIndex:
+    """ Spatial index of point features on a regular lat/lng grid.
+
+    Points are sorted by grid cell, so that each cell is a contiguous slice
+    of coordinates arrays.
+    """
+
+    def __init__(self, features, cell_size=0.25):
+        self.cell_size = cell_size
+        self.built_at = timezone.now()
+        coords = np.array(
+            [feature["geometry"]["coordinates"][:2] for feature in features],
+            dtype=np.float64).reshape(-1, 2)
+        cells = self._cell_ids(coords[:, 0], coords[:, 1])
+        order = np.argsort(cells, kind="mergesort")
+
+        self.features = [features[i] for i in order]
+        self.lngs = coords[order, 0]
+        self.lats = coords[order, 1]
+        sorted_cells = cells[order]
+
+        # cell id -> (start, end) slice in sorted arrays
+        self.cells = {}
+        unique_cells, starts = np.unique(sorted_cells, return_index=True)
+        ends = np.append(starts[1:], len(sorted_cells))
+        for cell, start, end in zip(unique_cells, starts, ends):
+            self.cells[int(cell)] = (int(start), int(end))
+
+    def __len__(self):
+        return len(self.features)
+
+    def _cell_coords(self, lngs, lats):
+        i = np.floor((np.asarray(lngs) + 180.) / self.cell_size).astype(np.int64)
+        j = np.floor((np.asarray(lats) + 90.) / self.cell_size).astype(np.int64)
+        return i, j
+
+    def _cell_ids(self, lngs, lats):
+        i, j = self._cell_coords(lngs, lats)
+        return i * 100000 + j
+
+    def bbox(self, min_lng, min_lat, max_lng, max_lat, limit=None):
+        """ Returns features inside bounding box. Raises ValueError if
+        bounds are not finite.
+        """
+        bounds = np.array([min_lng, min_lat, max_lng, max_lat], dtype=float)
+        if not np.isfinite(bounds).all():
+            raise ValueError("bbox bounds must be finite")
+        min_lng, max_lng = np.clip(bounds[[0, 2]], -180., 180.)
+        min_lat, max_lat = np.clip(bounds[[1, 3]], -90., 90.)
+        (i_min, i_max), (j_min, j_max) = self._cell_coords(
+            [min_lng, max_lng], [min_lat, max_lat])
+
+        slices = []
+        n_cells = (int(i_max) - int(i_min) + 1) * (int(j_max) - int(j_min) + 1)
+        if n_cells > len(self.cells):
+            # large box: scan occupied cells instead of box cells
+            for cell, cell_slice in sorted(self.cells.items()):
+                i, j = divmod(cell, 100000)
+                if i_min <= i <= i_max and j_min <= j <= j_max:
+                    slices.append(np.arange(*cell_slice))
+        else:
+            for i in range(int(i_min), int(i_max) + 1):
+                for j in range(int(j_min), int(j_max) + 1):
+                    cell_slice = self.cells.get(i * 100000 + j)
+                    if cell_slice:
+                        slices.append(np.arange(*cell_slice))
+        if not slices:
+            return []
+        candidates = np.concatenate(slices)
+
+        lngs = self.lngs[candidates]
+        lats = self.lats[candidates]
+        inside = (
+            (lngs >= min_lng) & (lngs <= max_lng) &
+            (lats >= min_lat) & (lats <= max_lat)
+        )
+        selected = candidates[inside]
+        if limit:
+            selected = selected[:limit]
+        return [self.features[i] for i in selected]
+
+    def nearest(self, lat, lng, k=10, max_distance=None):
+        """ Returns k nearest features, sorted by distance.
+
+        max_distance is in meters, as for Mongo $near queries.
+        """
+        if not len(self.features) or k <= 0:
+            return []
+        distances = haversine_km(lat, lng, self.lats, self.lngs)
+        k = min(k, len(distances))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind="mergesort")]
+        if max_distance is not None:
+            nearest = nearest[distances[nearest] * 1000. <= max_distance]
+        return [self.features[i] for i in nearest]
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """ Vectorized haversine distance, in kilometers, between one point and
+    coordinates arrays.
+    """
+    lat, lng = np.radians(lat), np.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2.) ** 2 + \
+        np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2.) ** 2
+    return 2. * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def load_stop_points_features():
+    """ Loads stop points from Mongo, or from static geojson file if Mongo
+    is not reachable.
+    """
+    try:
+        features = query_mongo_all_stop_points()
+        if features:
+            return features
+    except Exception as e:
+        logger.warning("Cannot load stop points from Mongo: %s" % e)
+
+    logger.info("Loading stop points from %s" % STOP_POINTS_GEOJSON)
+    with open(STOP_POINTS_GEOJSON, encoding="utf-8-sig") as f:
+        return json.load(f)["features"]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_stop_points_index():
+    """ Returns stop points index, built on first call.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = GridSpatialIndex(load_stop_points_features())
+                logger.info("Stop points index built with %d points."
+                            % len(_index))
+    return _index
+
+
+_transilien_index = None
+
+
+def get_transilien_stations_index():
+    """ Returns index of transilien stations (static geojson file), built on
+    first call.
+    """
+    global _transilien_index
+    if _transilien_index is None:
+        with _index_lock:
+            if _transilien_index is None:
+                with open(TRANSILIEN_STATIONS_GEOJSON,
+                          encoding="utf-8-sig") as f:
+                    features = json.load(f)["features"]
+                _transilien_index = GridSpatialIndex(features)
+    return _transilien_index
@@ -45,13 +45,17 @@ function pointToLayer(feature, latlng) {
     return L.circleMarker(latlng, stationStyle);
 }
 
+// Bounding box of current view, as expected by stop points view
+function currentBbox() {
+    return map.getBounds().toBBoxString();
+}
+
 // We download the GeoJSON file
 // Do this in the same scope as the actualiseGeoJSON function,
 // so it can read the variable
 $.getJSON(ajaxsationsurl, // ajax view url
     {
-        lat: 46.5,
-        lng: 2.5,
+        bbox: currentBbox()
     },
     initialLoad);
 
@@ -96,13 +100,11 @@ function initialLoadDisruptions(data){
 
 }
 
-function refreshGeoJsonLayer(latlng) {
-    // Then get data, and add it back to the layer
-    // TODO query MongoDB with parameter in bounds
+function refreshGeoJsonLayer() {
+    // Then get data in current view bounds, and add it back to the layer
     $.getJSON(ajaxsationsurl, // ajax view url
         {
-            lat: latlng.lat,
-            lng: latlng.lng,
+            bbox: currentBbox(),
             map: mapname // so the ajax knows what to send
         },
         function (data) {
@@ -126,10 +128,11 @@ function refreshDisruptions(){
 }
 
 function onMapDoubleClick(e) {
-    var latlng = e.latlng;
-    refreshGeoJsonLayer(latlng);
+    refreshGeoJsonLayer();
     refreshDisruptions();
 }
 
 // Datas are modified if
 map.on('dblclick', onMapDoubleClick);
+// Only stop points on screen are loaded, so reload them when view changes
+map.on('moveend', refreshGeoJsonLayer);
@@ -0,0 +1,56 @@
+// GridLayer loading GeoJSON tiles from /maps/tiles/{z}/{x}/{y}
+// Each tile answer contains several FeatureCollections (stations, delayed,
+// canceled): features of each one are added in the matching L.geoJson layer,
+// and removed when tile is unloaded.
+
+L.GridLayer.GeoJSONTiles = L.GridLayer.extend({
+
+    initialize: function (url, layers, options) {
+        // layers: {collectionName: L.geoJson layer}
+        this._url = url;
+        this._collectionsLayers = layers;
+        this._tilesFeatures = {};
+        L.GridLayer.prototype.initialize.call(this, options);
+        this.on('tileunload', this._onTileUnload, this);
+    },
+
+    createTile: function (coords, done) {
+        var tile = document.createElement('div');
+        var key = this._tileCoordsToKey(coords);
+        var url = L.Util.template(this._url, coords);
+        var self = this;
+
+        $.getJSON(url, function (data) {
+            var added = [];
+            for (var name in self._collectionsLayers) {
+                if (!data[name]) {continue;}
+                var layer = self._collectionsLayers[name];
+                var before = layer.getLayers().length;
+                layer.addData(data[name]);
+                added.push([layer, layer.getLayers().slice(before)]);
+            }
+            self._tilesFeatures[key] = added;
+            done(null, tile);
+        }).fail(function () {
+            done(null, tile);
+        });
+        return tile;
+    },
+
+    _onTileUnload: function (e) {
+        var key = this._tileCoordsToKey(e.coords);
+        var added = this._tilesFeatures[key] || [];
+        for (var i = 0; i < added.length; i++) {
+            var layer = added[i][0];
+            var features = added[i][1];
+            for (var j = 0; j < features.length; j++) {
+                layer.removeLayer(features[j]);
+            }
+        }
+        delete this._tilesFeatures[key];
+    }
+});
+
+L.gridLayer.geoJSONTiles = function (url, layers, options) {
+    return new L.GridLayer.GeoJSONTiles(url, layers, options);
+};
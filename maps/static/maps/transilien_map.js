@@ -41,33 +41,31 @@ function pointToLayer(feature, latlng) {
     return L.circleMarker(latlng, stationStyle);
 }
 
-// We download the GeoJSON file
-// Do this in the same scope as the actualiseGeoJSON function,
-// so it can read the variable
-$.getJSON(stations_json_url, // ajax view url
-    {},
-    initialLoad);
+function onEachFeatureDisruption(feature, layer) {
+    layer.bindPopup(function (layer) {
+        return layer.feature.properties.label;
+    });
+}
 
-$.getJSON(ajaxdisruptionsurl, // ajax view url
-    {
-        map: mapname
-    },
-    initialLoadDisruptions);
+// Stations and disruptions are loaded by tiles, only for visible area
+map.stopPointsLayer = L.geoJson(null,
+    {onEachFeature: onEachFeature,
+    pointToLayer: pointToLayer}
+);
+map.delayLayer = L.geoJson(null, {onEachFeature: onEachFeatureDisruption});
+map.canceledLayer = L.geoJson(null, {onEachFeature: onEachFeatureDisruption, style: setStyle});
 
-function initialLoad(data){
-    map.stopPointsLayer = L.geoJson(data,
-        {onEachFeature: onEachFeature,
-        pointToLayer: pointToLayer}
-        )
-    ;
-    // CHECK
-    map.markers = L.markerClusterGroup({
-    //spiderfyOnMaxZoom: false,
-    //showCoverageOnHover: false,
-    //zoomToBoundsOnClick: false
+map.dataTiles = L.gridLayer.geoJSONTiles(tiles_url, {
+    stations: map.stopPointsLayer,
+    delayed: map.delayLayer,
+    canceled: map.canceledLayer
 });
-    map.markers.addLayer(map.stopPointsLayer);
-    map.addLayer(map.markers);
-    // Add overlay to control panel
-    control.addOverlay(map.markers, "Gares");
-}
+
+map.addLayer(map.dataTiles);
+map.addLayer(map.stopPointsLayer);
+map.addLayer(map.delayLayer);
+map.addLayer(map.canceledLayer);
+// Add overlay to control panel
+control.addOverlay(map.stopPointsLayer, "Gares");
+control.addOverlay(map.delayLayer, "Perturbations: retards");
+control.addOverlay(map.canceledLayer, "Perturbations: annulations");
@@ -1,3 +1,109 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from maps.changes import disruption_hash
+from maps.spatial_index import GridSpatialIndex
+from maps.tiles import clip_linestring, quantizer, simplify
+from maps.utils import navitia_delay_minutes
+
+
+def point(lng, lat, name):
+    return {"type": "Feature", "properties": {"name": name},
+            "geometry": {"type": "Point", "coordinates": [lng, lat]}}
+
+
+class GridSpatialIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.index = GridSpatialIndex([
+            point(2.35, 48.85, "paris"),
+            point(2.30, 48.80, "sceaux"),
+            point(5.37, 43.30, "marseille"),
+            point(-1.55, 47.22, "nantes"),
+        ])
+
+    def names(self, features):
+        return sorted(feature["properties"]["name"] for feature in features)
+
+    def test_bbox(self):
+        self.assertEqual(
+            self.names(self.index.bbox(2., 48.5, 3., 49.)),
+            ["paris", "sceaux"])
+        self.assertEqual(self.index.bbox(10., 10., 11., 11.), [])
+
+    def test_bbox_large_box(self):
+        self.assertEqual(len(self.index.bbox(-180., -90., 180., 90.)), 4)
+        self.assertEqual(len(self.index.bbox(-1000., -90., 1000., 90.)), 4)
+
+    def test_bbox_limit(self):
+        self.assertEqual(len(self.index.bbox(-180., -90., 180., 90., 2)), 2)
+
+    def test_bbox_nan(self):
+        # regression: NaN bounds used to scan every cell of the grid
+        with self.assertRaises(ValueError):
+            self.index.bbox(float("nan"), 48., 3., 49.)
+        with self.assertRaises(ValueError):
+            self.index.bbox(2., 48., float("inf"), 49.)
+
+    def test_nearest(self):
+        nearest = self.index.nearest(48.86, 2.36, k=2)
+        self.assertEqual([feature["properties"]["name"]
+                          for feature in nearest], ["paris", "sceaux"])
+        self.assertEqual(
+            len(self.index.nearest(48.86, 2.36, k=10, max_distance=20000)), 2)
+        self.assertEqual(self.index.nearest(48.86, 2.36, k=0), [])
+
+
+class TileGeometryTest(SimpleTestCase):
+
+    def test_quantizer(self):
+        quantize = quantizer((0., 0., 1., 1.), extent=10)
+        self.assertEqual(quantize([0.12, 0.56]), [0.1, 0.6])
+
+    def test_simplify(self):
+        line = [[0., 0.], [1., 0.01], [2., 0.], [3., 1.]]
+        self.assertEqual(simplify(line, 0.1), [[0., 0.], [2., 0.], [3., 1.]])
+        self.assertEqual(simplify(line, 0.), line)
+        self.assertEqual(simplify(line[:2], 1.), line[:2])
+
+    def test_clip_linestring(self):
+        bounds = (0., 0., 10., 10.)
+        self.assertEqual(
+            clip_linestring([[-5., 5.], [5., 5.]], bounds),
+            [[[0., 5.], [5., 5.]]])
+        # exits then enters again: two parts
+        parts = clip_linestring(
+            [[5., 5.], [15., 5.], [15., 8.], [5., 8.]], bounds)
+        self.assertEqual(parts, [[[5., 5.], [10., 5.]], [[10., 8.], [5., 8.]]])
+        self.assertEqual(
+            clip_linestring([[20., 20.], [30., 30.]], bounds), [])
+
+
+class DisruptionHashTest(SimpleTestCase):
+
+    def test_disruption_hash(self):
+        disruption = {"disruption_id": "d1", "severity": {"name": "late"}}
+        stored = dict(disruption, _id="x", content_hash="h",
+                      closed_at="20170101T000000")
+        self.assertEqual(disruption_hash(disruption), disruption_hash(stored))
+        self.assertEqual(
+            disruption_hash({"severity": {"name": "late"},
+                             "disruption_id": "d1"}),
+            disruption_hash(disruption))
+        self.assertNotEqual(
+            disruption_hash(dict(disruption, severity={"name": "canceled"})),
+            disruption_hash(disruption))
+
+
+class NavitiaDelayTest(SimpleTestCase):
+
+    def test_delay(self):
+        self.assertEqual(navitia_delay_minutes("081500", "080500"), 10)
+        self.assertEqual(navitia_delay_minutes("080500", "080500"), 0)
+
+    def test_early(self):
+        # regression: timedelta.seconds wrapped negative delays to ~24 hours
+        self.assertEqual(navitia_delay_minutes("080400", "080500"), -1)
+
+    def test_across_midnight(self):
+        self.assertEqual(navitia_delay_minutes("000500", "235500"), 10)
+        self.assertEqual(navitia_delay_minutes("235500", "000500"), -10)
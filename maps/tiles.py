@@ -0,0 +1,260 @@
+"""
+GeoJSON tiles for stations and disruptions.
+
+Tiles follow the usual web mercator z/x/y scheme. Each tile only contains
+features visible in it:
+- transilien stations inside tile, with a reduced set of properties; below
+  STATIONS_FULL_ZOOM, at most one station per STATION_MIN_PIXELS square.
+- disruptions LineStrings clipped to tile (with a small buffer so that lines
+  join seamlessly between tiles), simplified to one pixel at tile zoom level.
+
+Coordinates are quantized to TILE_EXTENT steps per tile side, which is enough
+precision for display and keeps tiles small.
+"""
+
+import hashlib
+import math
+
+from maps.spatial_index import get_transilien_stations_index, MAX_FEATURES
+from maps.utils import get_disruptions_geojsons
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 1. / 16
+TILE_PIXELS = 256
+
+# Station id is a feature member in stations.geojson, copied as such
+STATION_PROPERTIES = ["uic7", "Nom Gare"]
+
+# Stations are thinned at lower zoom levels: closer stations than this
+# number of pixels are dropped
+STATIONS_FULL_ZOOM = 11
+STATION_MIN_PIXELS = 8
+
+
+def tile_bounds(z, x, y):
+    """ Returns (min_lng, min_lat, max_lng, max_lat) of tile.
+    """
+    n = 2. ** z
+
+    def lng(x):
+        return x / n * 360. - 180.
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return lng(x), lat(y + 1), lng(x + 1), lat(y)
+
+
+def buffered_bounds(bounds, buffer=TILE_BUFFER):
+    min_lng, min_lat, max_lng, max_lat = bounds
+    d_lng = (max_lng - min_lng) * buffer
+    d_lat = (max_lat - min_lat) * buffer
+    return min_lng - d_lng, min_lat - d_lat, max_lng + d_lng, max_lat + d_lat
+
+
+def quantizer(bounds, extent=TILE_EXTENT):
+    """ Returns function rounding [lng, lat] to 1/extent of tile side.
+    """
+    min_lng, min_lat, max_lng, max_lat = bounds
+    step = min(max_lng - min_lng, max_lat - min_lat) / extent
+    digits = max(0, int(math.ceil(-math.log10(step)))) if step > 0 else 6
+
+    def quantize(coord):
+        return [
+            round(round(coord[0] / step) * step, digits),
+            round(round(coord[1] / step) * step, digits),
+        ]
+    return quantize
+
+
+def simplify(coords, tolerance):
+    """ Douglas-Peucker simplification of a list of [lng, lat].
+    """
+    if len(coords) < 3:
+        return coords
+    keep = [False] * len(coords)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        start, end = stack.pop()
+        (x1, y1), (x2, y2) = coords[start], coords[end]
+        dx, dy = x2 - x1, y2 - y1
+        norm = math.hypot(dx, dy)
+        max_dist, max_index = 0., None
+        for i in range(start + 1, end):
+            x, y = coords[i]
+            if norm:
+                dist = abs(dy * x - dx * y + x2 * y1 - y2 * x1) / norm
+            else:
+                dist = math.hypot(x - x1, y - y1)
+            if dist > max_dist:
+                max_dist, max_index = dist, i
+        if max_index is not None and max_dist > tolerance:
+            keep[max_index] = True
+            stack.append((start, max_index))
+            stack.append((max_index, end))
+    return [coord for coord, kept in zip(coords, keep) if kept]
+
+
+def clip_segment(p1, p2, bounds):
+    """ Liang-Barsky clipping of segment to bounds.
+
+    Returns None if segment is outside bounds, else (start, end, t0, t1),
+    t0 > 0 meaning segment enters bounds, and t1 < 1 that it exits them.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    (x1, y1), (x2, y2) = p1, p2
+    dx, dy = x2 - x1, y2 - y1
+    t0, t1 = 0., 1.
+    for p, q in ((-dx, x1 - min_x), (dx, max_x - x1),
+                 (-dy, y1 - min_y), (dy, max_y - y1)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            if t > t1:
+                return None
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return None
+            t1 = min(t1, t)
+    start = [x1 + t0 * dx, y1 + t0 * dy]
+    end = [x1 + t1 * dx, y1 + t1 * dy]
+    return start, end, t0, t1
+
+
+def clip_linestring(coords, bounds):
+    """ Clips a line to bounds. Returns list of lines (a line can enter and
+    exit tile several times).
+    """
+    parts = []
+    current = []
+    for p1, p2 in zip(coords[:-1], coords[1:]):
+        clipped = clip_segment(p1, p2, bounds)
+        if clipped is None:
+            continue
+        start, end, t0, t1 = clipped
+        if t0 > 0 or not current:
+            if len(current) > 1:
+                parts.append(current)
+            current = [start]
+        current.append(end)
+        if t1 < 1:
+            parts.append(current)
+            current = []
+    if len(current) > 1:
+        parts.append(current)
+    return parts
+
+
+def station_features(bounds, quantize, z=STATIONS_FULL_ZOOM):
+    features = []
+    cells = set()
+    grid = TILE_PIXELS // STATION_MIN_PIXELS
+    min_lng, min_lat, max_lng, max_lat = bounds
+    stations = get_transilien_stations_index().bbox(
+        *bounds, limit=MAX_FEATURES)
+    for feature in stations:
+        lng, lat = feature["geometry"]["coordinates"][:2]
+        if z < STATIONS_FULL_ZOOM:
+            cell = (int((lng - min_lng) / (max_lng - min_lng) * grid),
+                    int((lat - min_lat) / (max_lat - min_lat) * grid))
+            if cell in cells:
+                continue
+            cells.add(cell)
+        properties = feature.get("properties", {})
+        station = {
+            "type": "Feature",
+            "properties": {
+                key: properties[key] for key in STATION_PROPERTIES
+                if key in properties
+            },
+            "geometry": {
+                "type": "Point",
+                "coordinates": quantize(feature["geometry"]["coordinates"]),
+            },
+        }
+        if "id" in feature:
+            station["id"] = feature["id"]
+        features.append(station)
+    return features
+
+
+def disruption_features(geoobjects, bounds, quantize, tolerance):
+    features = []
+    for geoobject in geoobjects:
+        coords = [[float(lng), float(lat)]
+                  for lng, lat in geoobject["geometry"]["coordinates"]]
+        parts = []
+        for part in clip_linestring(coords, bounds):
+            part = simplify(part, tolerance)
+            # remove consecutive duplicates created by quantization
+            quantized = []
+            for coord in map(quantize, part):
+                if not quantized or quantized[-1] != coord:
+                    quantized.append(coord)
+            if len(quantized) > 1:
+                parts.append(quantized)
+        if not parts:
+            continue
+        properties = geoobject["properties"]
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "severity": {"name": properties["severity"]["name"]},
+                "delay": properties["delay"],
+                "label": properties["label"],
+            },
+            "geometry": {
+                "type": "MultiLineString",
+                "coordinates": parts,
+            },
+        })
+    return features
+
+
+def build_tile(z, x, y):
+    """ Returns dictionary of geojson FeatureCollections (stations, delayed,
+    canceled) for tile z/x/y.
+    """
+    bounds = tile_bounds(z, x, y)
+    clip_bounds = buffered_bounds(bounds)
+    quantize = quantizer(bounds)
+    # one pixel at this zoom level
+    tolerance = (bounds[2] - bounds[0]) / TILE_PIXELS
+
+    delayed, canceled, _, _ = get_disruptions_geojsons()
+    return {
+        "stations": {
+            "type": "FeatureCollection",
+            "features": station_features(bounds, quantize, z),
+        },
+        "delayed": {
+            "type": "FeatureCollection",
+            "features": disruption_features(
+                delayed, clip_bounds, quantize, tolerance),
+        },
+        "canceled": {
+            "type": "FeatureCollection",
+            "features": disruption_features(
+                canceled, clip_bounds, quantize, tolerance),
+        },
+    }
+
+
+def tile_last_modified():
+    """ Last time data served in tiles changed.
+    """
+    _, _, disruptions_time, _ = get_disruptions_geojsons()
+    return max(get_transilien_stations_index().built_at, disruptions_time)
+
+
+def tile_etag(z, x, y):
+    _, _, _, disruptions = get_disruptions_geojsons()
+    version = "%s/%s/%s-%s-%s" % (
+        z, x, y, get_transilien_stations_index().built_at.isoformat(),
+        disruptions)
+    return hashlib.md5(version.encode("utf-8")).hexdigest()
@@ -9,5 +9,7 @@ urlpatterns = [
     url(r'^update_disruptions$', views.update_disruptions,
         name='update_disruptions'),
     url(r'^transilien$', views.transilien_map, name='transilien'),
+    url(r'^tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)$', views.tile,
+        name='tile'),
 
 ]
@@ -1,20 +1,30 @@
 
 from . import parser
-import os
-from monitoring.utils_mongo import connect_mongoclient
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from monitoring.utils_mongo import get_mongoclient
 from datetime import datetime, timedelta
-from pymongo import MongoClient
+from django.utils import timezone
+from pymongo import MongoClient, ReplaceOne, UpdateMany
 from navitia_client import Client
-import pandas as pd
 from sncfweb.settings.secrets import get_secret
-from multiprocessing.dummy import Pool
+from monitoring.instrumentation import stage
+from monitoring.utils_cache import ttl_cache
+from .indexes import SCHEDULE_TTL_SECONDS
+from .geometries import get_trip_geometries
+from .changes import CHANGES_COLLECTION, DisruptionChanges, \
+    disruption_hash, on_disruption_changes, publish_changes
 
 MONGO_DB_NAME = get_secret("MONGO_DB_NAME")
 SNCF_API_USER = get_secret("SNCF_API_USER")
 
+logger = logging.getLogger("django")
+
 
 def get_collection(collection):
-    c = connect_mongoclient()
+    c = get_mongoclient()
     db = c[MONGO_DB_NAME]
     collection = db[collection]
     return collection
@@ -22,20 +32,20 @@ def get_collection(collection):
 
 def request_mongo_schedule(object_id):
     collection = get_collection("route_schedules")
-    # search for max 3 hours old information
-    update_time = datetime.now() - timedelta(hours=3)
-    update_time = update_time.strftime('%Y%m%dT%H%M%S')
+    # search for information not expired yet (TTL monitor may be late)
+    update_time = datetime.utcnow() - \
+        timedelta(seconds=SCHEDULE_TTL_SECONDS)
     findquery = {"object_id": object_id, "updated_time": {"$gte": update_time}}
     result = collection.find_one(findquery)
     return result
 
 
 def save_mongo_schedule(object_id, schedule):
+    # updated_time is a UTC datetime, so that TTL index expires schedules
     collection = get_collection("route_schedules")
-    now = datetime.now().strftime('%Y%m%dT%H%M%S')
     mongoobject = {"object_id": object_id,
-                   "schedule": schedule, "updated_time": now}
-    collection.insert(mongoobject)
+                   "schedule": schedule, "updated_time": datetime.utcnow()}
+    collection.replace_one({"object_id": object_id}, mongoobject, upsert=True)
 
 
 def request_sncf_api_schedule(object_id):
@@ -44,41 +54,113 @@ def request_sncf_api_schedule(object_id):
 
     client = Client(core_url="https://api.sncf.com/v1/",
                     user=SNCF_API_USER, region="sncf")
-    response = client.raw(query_path, verbose=True)
+    with stage("sncf_api"):
+        response = client.raw(query_path, verbose=True)
     routeparser = parser.RequestParser({0: response}, "route_schedules")
     routeparser.parse()
     schedule = routeparser.nested_items["route_schedules"][0]
     return schedule
 
 
-def id_to_schedule(object_id):
-    # status if query fails or success
-    status = False
+def request_mongo_schedules(object_ids, max_age=SCHEDULE_TTL_SECONDS):
+    """ Schedules of object_ids updated less than max_age seconds ago, as
+    object_id -> schedule, in one query.
+    """
+    collection = get_collection("route_schedules")
+    update_time = datetime.utcnow() - timedelta(seconds=max_age)
+    findquery = {"object_id": {"$in": list(object_ids)},
+                 "updated_time": {"$gte": update_time}}
+    return {result["object_id"]: result["schedule"]
+            for result in collection.find(findquery)}
 
-    # First query mongo database if information already available
+
+def id_to_schedule(object_id, fetch=False):
+    """
+    Returns (status, schedule) of object_id from Mongo. Schedules are
+    prefetched at ingestion (prefetch_schedules), so the SNCF api is only
+    queried on a miss if fetch is True.
+    """
     result = request_mongo_schedule(object_id)
     if result:
-        status = True
-        print("Data available in Mongo")
-        return status, result["schedule"]
+        return True, result["schedule"]
+    if not fetch:
+        logger.debug("Schedule %s not available in Mongo" % object_id)
+        return False, {}
 
     # If not, query sncf api and save it in mongo
-    print("Not available in Mongo")
     try:
         schedule = request_sncf_api_schedule(object_id)
         save_mongo_schedule(object_id, schedule)
-        status = True
-    except:
+    except Exception:
         print("Cannot get data from SNCF and save it in Mongo")
-        schedule = {}
-    return status, schedule
+        return False, {}
+    return True, schedule
+
+
+# Schedules prefetch: parallel requests to SNCF api, and max number of
+# requests per second (shared by workers)
+SCHEDULE_PREFETCH_WORKERS = 8
+SCHEDULE_PREFETCH_RATE = 5
+# Schedules older than this (seconds) are fetched again by prefetch, before
+# they expire
+SCHEDULE_REFRESH_AGE = SCHEDULE_TTL_SECONDS // 2
+
+
+class RateLimiter:
+    """ Spaces calls of wait() by at least 1/rate seconds, across threads.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1. / rate
+        self._next = 0.
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def prefetch_schedules(object_ids, workers=SCHEDULE_PREFETCH_WORKERS,
+                       rate=SCHEDULE_PREFETCH_RATE):
+    """
+    Fetches from SNCF api and saves in Mongo schedules of object_ids
+    missing or older than SCHEDULE_REFRESH_AGE. Returns counts of warm,
+    fetched and failed schedules.
+    """
+    object_ids = set(object_ids)
+    warm = request_mongo_schedules(object_ids, max_age=SCHEDULE_REFRESH_AGE)
+    missing = sorted(object_ids - set(warm))
+    limiter = RateLimiter(rate)
+
+    def fetch(object_id):
+        limiter.wait()
+        try:
+            save_mongo_schedule(object_id, request_sncf_api_schedule(object_id))
+            return True
+        except Exception as e:
+            logger.warning("Cannot prefetch schedule %s: %s" % (object_id, e))
+            return False
 
+    fetched = 0
+    if missing:
+        with stage("schedule_prefetch"):
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                fetched = sum(executor.map(fetch, missing))
+    return {"warm": len(warm), "fetched": fetched,
+            "failed": len(missing) - fetched}
 
-def to_geosjon(coords_list, severity, display_informations, delay, cause, trip_id):
+
+def to_geosjon(coords_list, severity, display_informations, delay, cause, trip_id,
+               disruption_id=None):
 
     geoobject = {
         "type": "Feature",
         "properties": {
+            "disruption_id": disruption_id,
             "severity": severity,
             "delay": str(delay),
             "cause": cause,
@@ -92,32 +174,59 @@ def to_geosjon(coords_list, severity, display_informations, delay, cause, trip_i
     return geoobject
 
 
-def disruption_to_geojsons(disruption):
+def disruption_object_id(disruption):
     # A disruption always has only on impacted object/route
-    impacted_object = disruption["impacted_objects"][0]
-    impacted_object_id = impacted_object["pt_object"]["id"]
-    # Query schedules of the impacted objects: always one
-    status, schedule = id_to_schedule(impacted_object_id)
+    return disruption["impacted_objects"][0]["pt_object"]["id"]
+
+
+def disruption_coordinates(disruption):
+    """ Coordinates of disruption trip in trip geometries store (built from
+    GTFS), or None if trip is unknown.
+    """
+    pt_object = disruption["impacted_objects"][0]["pt_object"]
+    train_num = pt_object.get("trip", {}).get("name")
+    return get_trip_geometries().coordinates(pt_object["id"], train_num)
+
+
+def disruption_to_geojsons(disruption):
+    # Trip geometry from local store, no schedule needed
+    coordinates = disruption_coordinates(disruption)
+    if coordinates:
+        return geometry_to_geojson(disruption, coordinates)
+    # Else query schedules of the impacted objects (always one), only if warm
+    status, schedule = id_to_schedule(disruption_object_id(disruption))
     # If unable to get schedule, we don't show this disruption and return false
     if not status:
         return False
-    # Extract rows_list for given schedule
-    rows_list = schedule["table"]["rows"]
-    # Extract label from each schedule
-    display_informations = schedule["display_informations"]
-    # Extract coordonates
-    coordslist = list(map(lambda x: [x["stop_point"]["coord"]["lon"], x[
-        "stop_point"]["coord"]["lat"]], rows_list))
-    try:
-        coordslist = coordslist.remove(["0.0", "0.0"])
-        # Don't show if after removal there is not enough to draw a line
-        if not coordslist:
-            return False
-        elif len(coordslist) < 2:
-            return False
-    except ValueError:
-        # No zero coordonate
-        pass
+    return schedule_to_geojson(disruption, schedule)
+
+
+def schedule_coordinates(schedule):
+    """ Stops coordinates of schedule rows, zero coordinates removed.
+    """
+    coordslist = [[float(row["stop_point"]["coord"]["lon"]),
+                   float(row["stop_point"]["coord"]["lat"])]
+                  for row in schedule["table"]["rows"]]
+    return [coords for coords in coordslist if coords[0] and coords[1]]
+
+
+def schedule_to_geojson(disruption, schedule):
+    return disruption_geojson(disruption, schedule_coordinates(schedule),
+                              schedule["display_informations"])
+
+
+def geometry_to_geojson(disruption, coordinates):
+    pt_object = disruption["impacted_objects"][0]["pt_object"]
+    display_informations = {"label": pt_object.get("name", pt_object["id"])}
+    return disruption_geojson(disruption, coordinates, display_informations)
+
+
+def disruption_geojson(disruption, coordslist, display_informations):
+    impacted_object = disruption["impacted_objects"][0]
+    impacted_object_id = impacted_object["pt_object"]["id"]
+    # Don't show if there is not enough to draw a line
+    if len(coordslist) < 2:
+        return False
 
     # Compute max delay
     try:
@@ -134,40 +243,38 @@ def disruption_to_geojsons(disruption):
 
     # Create geojson objects
     geoJsonobject = to_geosjon(coordslist, disruption[
-        "severity"], display_informations, delay, cause, impacted_object_id)
+        "severity"], display_informations, delay, cause, impacted_object_id,
+        disruption.get("disruption_id"))
     return geoJsonobject
 
 
+def navitia_delay_minutes(amended_time, base_time):
+    """
+    Delay in minutes between two "HHMMSS" times of a same day, negative if
+    amended time is earlier. Differences over 12 hours are taken across
+    midnight ("000500" amended for "235500" base is 10 minutes late).
+    """
+    def to_seconds(string):
+        return int(string[0:2]) * 3600 + int(string[2:4]) * 60 + \
+            int(string[4:6])
+
+    diff = timedelta(
+        seconds=to_seconds(amended_time) - to_seconds(base_time))
+    if diff > timedelta(hours=12):
+        diff -= timedelta(days=1)
+    elif diff < timedelta(hours=-12):
+        diff += timedelta(days=1)
+    return diff.total_seconds() / 60
+
+
 def impacted_stops_to_max_delay(stop_list):
     """
     Computes delay for each impacted stop and returns maximum.
     """
-    def strings_to_time_diff(stringtuple):
-        """
-        Return time difference in minutes
-        """
-        #"amended_arrival_time": "093800"
-        # base_arrival_time": "092800",
-        # first, lets convert time
-        string1 = stringtuple[0]
-        string2 = stringtuple[1]
-        hour1 = int(string1[0:2])
-        minute1 = int(string1[2:4])
-        second1 = int(string1[4:6])
-        time1 = timedelta(hours=hour1, minutes=minute1, seconds=second1)
-        hour2 = int(string2[0:2])
-        minute2 = int(string2[2:4])
-        second2 = int(string2[4:6])
-        time2 = timedelta(hours=hour2, minutes=minute2, seconds=second2)
-        diff = time1 - time2
-        # return in minutes instead of seconds
-        diff = diff.seconds / 60
-        return diff
-    times_tuples = map(lambda x: (x["amended_arrival_time"], x[
-                       "base_arrival_time"]), stop_list)
-    time_diffs = list(map(strings_to_time_diff, times_tuples))
-    max_delay = max(time_diffs)
-    return max_delay
+    delays = [navitia_delay_minutes(stop["amended_arrival_time"],
+                                    stop["base_arrival_time"])
+              for stop in stop_list]
+    return max(delays, default=0)
 
 
 def geosjons_split_cancel_delay(geoobjects):
@@ -189,11 +296,141 @@ def geosjons_split_cancel_delay(geoobjects):
     return delayed, canceled
 
 
-def query_mongo_active_disruptions(limit):
+# Max number of active disruptions drawn on map
+ACTIVE_DISRUPTIONS_LIMIT = 300
+
+_disruptions_geojsons = None
+_disruptions_geojsons_lock = threading.Lock()
+
+
+def split_by_geometry(disruptions_list):
+    """ Returns geojsons of disruptions whose trip is in geometries store,
+    and list of other disruptions.
+    """
+    geoobjects = []
+    without_geometry = []
+    for disruption in disruptions_list:
+        coordinates = disruption_coordinates(disruption)
+        if coordinates:
+            geoobjects.append(geometry_to_geojson(disruption, coordinates))
+        else:
+            without_geometry.append(disruption)
+    return geoobjects, without_geometry
+
+
+def compute_disruptions_geojsons(limit=ACTIVE_DISRUPTIONS_LIMIT):
+    # Get active disruptions routes and convert it in geojson objects
+    # Trips geometries are local, missing ones are drawn from schedules
+    # prefetched at ingestion: one Mongo query, no api call
+    disruptions_list = list(query_mongo_active_disruptions(limit=limit))
+    allgeojsonobjects, without_geometry = split_by_geometry(disruptions_list)
+    schedules = request_mongo_schedules(
+        {disruption_object_id(disruption) for disruption in without_geometry})
+    for disruption in without_geometry:
+        schedule = schedules.get(disruption_object_id(disruption))
+        if schedule:
+            allgeojsonobjects.append(schedule_to_geojson(disruption, schedule))
+    # Split results in delayed or canceled trips
+    return geosjons_split_cancel_delay(allgeojsonobjects)
+
+
+def disruptions_geojsons_fresh(cached, max_age):
+    """ Whether cached geojsons are younger than max_age seconds, and built
+    from current disruptions version: changes ingested by another process
+    are picked up as soon as they are published.
+    """
+    return bool(cached) and \
+        (timezone.now() - cached[2]).total_seconds() < max_age and \
+        cached[3] == disruptions_version()
+
+
+def get_disruptions_geojsons(max_age=60):
+    """
+    Returns delayed and canceled geojson objects of active disruptions, the
+    time they were computed, and the disruptions version they were computed
+    from (to be used in ETags, rather than current version). They are
+    computed at most once every max_age seconds, and shared between views
+    (map and tiles).
+    """
+    global _disruptions_geojsons
+    cached = _disruptions_geojsons
+    if disruptions_geojsons_fresh(cached, max_age):
+        return cached
+    with _disruptions_geojsons_lock:
+        cached = _disruptions_geojsons
+        if disruptions_geojsons_fresh(cached, max_age):
+            return cached
+        # version read before computing: changes published meanwhile give
+        # a newer version, and a new computation
+        version = disruptions_version()
+        computed_at = timezone.now()
+        with stage("geojson"):
+            delayed, canceled = compute_disruptions_geojsons()
+        _disruptions_geojsons = (delayed, canceled, computed_at, version)
+    return _disruptions_geojsons
+
+
+@on_disruption_changes
+def update_disruptions_geojsons(changes):
+    """ Applies ingestion changes to cached geojsons: only new and updated
+    disruptions are converted again.
+    """
+    global _disruptions_geojsons
+    last_disruption_change.cache_clear()
+    with _disruptions_geojsons_lock:
+        cached = _disruptions_geojsons
+        if not cached:
+            return
+        version = disruptions_version()
+        # ids still active (ended application periods are dropped too)
+        active = {document["disruption_id"] for document in
+                  query_mongo_active_disruptions(
+                      limit=ACTIVE_DISRUPTIONS_LIMIT, ids_only=True)}
+        changed_ids = set(changes.new) | set(changes.updated)
+        kept = [geoobject for geoobject in cached[0] + cached[1]
+                if geoobject["properties"].get("disruption_id") in active and
+                geoobject["properties"].get("disruption_id") not in changed_ids]
+        collection = get_collection("disruptions")
+        changed = collection.find(
+            {"disruption_id": {"$in": list(changed_ids & active)}})
+        geoobjects = kept + [disruption_to_geojsons(disruption)
+                             for disruption in changed]
+        delayed, canceled = geosjons_split_cancel_delay(geoobjects)
+        _disruptions_geojsons = (delayed, canceled, timezone.now(), version)
+
+
+# Active disruptions also change when application periods end, which is
+# accounted for by buckets of this size (seconds) in disruptions version
+DISRUPTIONS_EXPIRY_BUCKET = 300
+
+
+@ttl_cache(10)
+def last_disruption_change():
+    """ Time of last ingestion run which changed disruptions.
+    """
+    collection = get_collection(CHANGES_COLLECTION)
+    last = collection.find_one(
+        {}, {"run_at": 1, "_id": 0}, sort=[("run_at", -1)])
+    return last["run_at"].isoformat() if last else None
+
+
+def disruptions_version():
+    """ Cheap version of active disruptions: last ingestion changes time,
+    and expiry bucket.
+    """
+    bucket = int(timezone.now().timestamp() // DISRUPTIONS_EXPIRY_BUCKET)
+    return "%s-%s" % (last_disruption_change(), bucket)
+
+
+def query_mongo_active_disruptions(limit, ids_only=False):
     collection = get_collection("disruptions")
     # Find disruptions still active
     today = datetime.now().strftime('%Y%m%dT%H%M%S')
-    findquery = {"application_periods.end": {"$gte": today}}
+    findquery = {"application_periods.end": {"$gte": today},
+                 "closed_at": {"$exists": False}}
+    if ids_only:
+        return list(collection.find(
+            findquery, {"disruption_id": 1, "_id": 0}).limit(limit))
     disruptions_list = collection.find(findquery).limit(limit)
     return disruptions_list
 
@@ -210,34 +447,120 @@ def query_mongo_near_stations(lat, lng, limit=3000, max_distance=12000000):
     return stop_points
 
 
+def query_mongo_all_stop_points():
+    # Used to build in-memory spatial index
+    collection = get_collection("stop_points")
+    return list(collection.find({}, {'_id': 0}))
+
+
 def insert_disruption_mongo(disruption):
     print("Saving disruption %s" % disruption["disruption_id"])
     collection = get_collection("disruptions")
 
     findquery = {"disruption_id": disruption["disruption_id"]}
-    collection.update(findquery, disruption, upsert=True)
+    document = dict(disruption, content_hash=disruption_hash(disruption))
+    collection.replace_one(findquery, document, upsert=True)
+
+
+def save_disruptions(disruptions_list, run_at=None, complete=True):
+    """
+    Writes only new or changed disruptions (by content hash), marks stored
+    disruptions missing from list as closed, and returns changes.
+
+    Disruptions are only closed if list is complete (all active disruptions
+    were fetched) and not empty: missing ones may just be on pages that
+    failed or were not asked.
+    """
+    run_at = run_at or datetime.utcnow()
+    collection = get_collection("disruptions")
+    ids = [disruption["disruption_id"] for disruption in disruptions_list]
+    stored = {
+        document["disruption_id"]: document
+        for document in collection.find(
+            {"$or": [{"closed_at": {"$exists": False}},
+                     {"disruption_id": {"$in": ids}}]},
+            {"disruption_id": 1, "content_hash": 1, "closed_at": 1, "_id": 0})
+    }
+
+    operations = []
+    new, updated, seen = [], [], set()
+    for disruption in disruptions_list:
+        disruption_id = disruption["disruption_id"]
+        if disruption_id in seen:
+            continue
+        seen.add(disruption_id)
+        content_hash = disruption_hash(disruption)
+        previous = stored.get(disruption_id)
+        if previous and previous.get("content_hash") == content_hash \
+                and "closed_at" not in previous:
+            continue
+        document = dict(disruption, content_hash=content_hash)
+        operations.append(ReplaceOne(
+            {"disruption_id": disruption_id}, document, upsert=True))
+        (updated if previous else new).append(disruption_id)
+
+    closed = []
+    if complete and seen:
+        closed = [disruption_id for disruption_id, document in stored.items()
+                  if disruption_id not in seen and "closed_at" not in document]
+    if closed:
+        operations.append(UpdateMany(
+            {"disruption_id": {"$in": closed}},
+            {"$set": {"closed_at": run_at}}))
+
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return DisruptionChanges(run_at, new, updated, closed)
+
+
+def fetch_complete(parsed):
+    """ Whether all disruptions announced by SNCF api were fetched: every
+    page answered and parsed, and as many disruptions as total_result.
+    """
+    disruptions = parsed.nested_items["disruptions"]
+    fetched = {disruption["disruption_id"] for disruption in disruptions}
+    return (
+        len(parsed.parsed) == len(parsed.results) and
+        not parsed.parsing_errors and
+        parsed.nbr_expected_items is not None and
+        len(fetched) >= parsed.nbr_expected_items
+    )
 
 
 def query_and_save_disruptions(today=True):
     # Update data from API and save it in mongo
     client = Client(core_url="https://api.sncf.com/v1/",
                     user=SNCF_API_USER, region="sncf")
-    response = client.explore("disruptions", multipage=True, page_limit=30,
-                              count_per_page=50, verbose=True)
+    with stage("sncf_api"):
+        response = client.explore("disruptions", multipage=True,
+                                  page_limit=30, count_per_page=50,
+                                  verbose=True)
     parsed = parser.RequestParser(response, "disruptions")
     print("Begin parsing")
     parsed.parse()
     disruptions_list = parsed.nested_items["disruptions"]
     print("Result parsed, begin saving in MongoDB")
 
-    # Filter only today disruptions
-    df = pd.DataFrame(disruptions_list)
-
-    # Initialize connection with MongoClient
-    # Save elements
-    pool = Pool(3)
-    pool.map(insert_disruption_mongo, disruptions_list)
-    pool.join()
+    # Save changed elements only, close missing ones if fetch is complete
+    complete = fetch_complete(parsed)
+    if not complete:
+        logger.warning(
+            "Incomplete disruptions fetch (%d of %s, %d of %d pages): no "
+            "disruption is closed." % (
+                len(disruptions_list), parsed.nbr_expected_items,
+                len(parsed.parsed), len(parsed.results)))
+    changes = save_disruptions(disruptions_list, complete=complete)
+    logger.info("Disruptions changes: %d new, %d updated, %d closed." % (
+        len(changes.new), len(changes.updated), len(changes.closed)))
+
+    # Prefetch schedules of active disruptions not in trip geometries store,
+    # so that map requests only read warm schedules; then publish changes
+    object_ids = {disruption_object_id(disruption) for disruption in
+                  query_mongo_active_disruptions(limit=ACTIVE_DISRUPTIONS_LIMIT)
+                  if not disruption_coordinates(disruption)}
+    logger.info("Schedules prefetch: %s" % prefetch_schedules(object_ids))
+    publish_changes(get_collection(CHANGES_COLLECTION), changes)
+    return changes
 
     # for disruption in disruptions_list:
     #    findquery = {"disruption_id": disruption["disruption_id"]}
@@ -0,0 +1,139 @@
+"""
+Async (motor) versions of maps Mongo queries.
+
+Used by async views (maps/views_async.py) served by the ASGI application:
+Mongo queries wait on the event loop instead of occupying a thread, and
+geojsons building (CPU bound) runs in the default executor so that it
+doesn't block the event loop.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from monitoring.utils_mongo import mongo_uri
+from . import utils
+from .indexes import SCHEDULE_TTL_SECONDS
+
+_motor_client = None
+
+
+def get_motor_client():
+    """ Motor client shared by event loop (holds its own connection pool).
+    """
+    global _motor_client
+    if _motor_client is None:
+        _motor_client = AsyncIOMotorClient(
+            mongo_uri(), serverSelectionTimeoutMS=15000)
+    return _motor_client
+
+
+def get_collection(collection):
+    return get_motor_client()[utils.MONGO_DB_NAME][collection]
+
+
+async def query_mongo_active_disruptions(limit):
+    collection = get_collection("disruptions")
+    # Find disruptions still active
+    today = datetime.now().strftime('%Y%m%dT%H%M%S')
+    findquery = {"application_periods.end": {"$gte": today},
+                 "closed_at": {"$exists": False}}
+    return await collection.find(findquery).limit(limit).to_list(limit)
+
+
+async def query_mongo_near_stations(lat, lng, limit=3000,
+                                    max_distance=12000000):
+    collection = get_collection("stop_points")
+    filter1 = {"geometry": {"$near": {"$geometry": {
+        "type": "Point", "coordinates": [float(lng), float(lat)]},
+        "$maxDistance": max_distance}}}
+    cursor = collection.find(filter1, {'_id': 0}).limit(limit)
+    return await cursor.to_list(limit)
+
+
+async def request_mongo_schedule(object_id):
+    collection = get_collection("route_schedules")
+    # search for information not expired yet (TTL monitor may be late)
+    update_time = datetime.utcnow() - \
+        timedelta(seconds=SCHEDULE_TTL_SECONDS)
+    findquery = {"object_id": object_id, "updated_time": {"$gte": update_time}}
+    return await collection.find_one(findquery)
+
+
+async def save_mongo_schedule(object_id, schedule):
+    # updated_time is a UTC datetime, so that TTL index expires schedules
+    collection = get_collection("route_schedules")
+    mongoobject = {"object_id": object_id,
+                   "schedule": schedule, "updated_time": datetime.utcnow()}
+    await collection.replace_one(
+        {"object_id": object_id}, mongoobject, upsert=True)
+
+
+async def request_mongo_schedules(object_ids):
+    collection = get_collection("route_schedules")
+    update_time = datetime.utcnow() - \
+        timedelta(seconds=SCHEDULE_TTL_SECONDS)
+    findquery = {"object_id": {"$in": list(object_ids)},
+                 "updated_time": {"$gte": update_time}}
+    return {result["object_id"]: result["schedule"]
+            async for result in collection.find(findquery)}
+
+
+def _split_with_schedules(allgeojsonobjects, without_geometry, schedules):
+    """ Adds geojsons of disruptions drawn from their schedule, returns
+    delayed and canceled geojsons.
+    """
+    for disruption in without_geometry:
+        schedule = schedules.get(utils.disruption_object_id(disruption))
+        if schedule:
+            allgeojsonobjects.append(
+                utils.schedule_to_geojson(disruption, schedule))
+    return utils.geosjons_split_cancel_delay(allgeojsonobjects)
+
+
+async def compute_disruptions_geojsons(limit=utils.ACTIVE_DISRUPTIONS_LIMIT):
+    """ Same as utils.compute_disruptions_geojsons: local trip geometries,
+    else schedules prefetched at ingestion, read in one query.
+    """
+    loop = asyncio.get_event_loop()
+    disruptions_list = await query_mongo_active_disruptions(limit=limit)
+    allgeojsonobjects, without_geometry = await loop.run_in_executor(
+        None, utils.split_by_geometry, disruptions_list)
+    schedules = await request_mongo_schedules(
+        {utils.disruption_object_id(disruption)
+         for disruption in without_geometry})
+    return await loop.run_in_executor(
+        None, _split_with_schedules, allgeojsonobjects, without_geometry,
+        schedules)
+
+
+_geojsons_lock = None
+
+
+async def get_disruptions_geojsons(max_age=60):
+    """ Same as utils.get_disruptions_geojsons, sharing its cache: computed
+    at most once every max_age seconds, or when disruptions version
+    changes.
+    """
+    global _geojsons_lock
+    if _geojsons_lock is None:
+        _geojsons_lock = asyncio.Lock()
+    loop = asyncio.get_event_loop()
+
+    async def fresh():
+        cached = utils._disruptions_geojsons
+        return cached and await loop.run_in_executor(
+            None, utils.disruptions_geojsons_fresh, cached, max_age)
+
+    if await fresh():
+        return utils._disruptions_geojsons
+    async with _geojsons_lock:
+        if await fresh():
+            return utils._disruptions_geojsons
+        version = await loop.run_in_executor(None, utils.disruptions_version)
+        computed_at = timezone.now()
+        delayed, canceled = await compute_disruptions_geojsons()
+        utils._disruptions_geojsons = (delayed, canceled, computed_at, version)
+    return utils._disruptions_geojsons
@@ -1,10 +1,16 @@
 from django.shortcuts import render
 from django.http import JsonResponse
-from multiprocessing import Pool
-from .utils import (
-    disruption_to_geojsons, geosjons_split_cancel_delay, query_mongo_active_disruptions,
-    query_mongo_near_stations, query_and_save_disruptions
-)
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
+from sncfweb.cache import content_etag
+from sncfweb.streaming import StreamingJSONResponse, STREAMING_MIN_ROWS
+from .utils import get_disruptions_geojsons, query_and_save_disruptions
+from .spatial_index import get_stop_points_index, MAX_FEATURES
+from .tiles import build_tile, tile_etag, tile_last_modified
+
+# Disruptions are refreshed every minute
+TILE_MAX_AGE = 60
 
 
 def sncf_fr_map(request):
@@ -14,34 +20,71 @@ def sncf_fr_map(request):
 
 
 def ajax_stop_points(request):
-    # Get the url get parameter of bounds, = "not found" if parameter does not
-    # exist
-    lat = request.GET.get('lat', 'not found')
-    lng = request.GET.get('lng', 'not found')
-    features = query_mongo_near_stations(
-        lat, lng, limit=10000, max_distance=12000000)
+    """
+    Serves stop points from in-memory spatial index, either:
+    - inside a bounding box: ?bbox=min_lng,min_lat,max_lng,max_lat
+    - nearest to a point: ?lat=&lng=&k= (k defaults to, and is at
+      most, MAX_FEATURES)
+    """
+    index = get_stop_points_index()
+    bbox = request.GET.get('bbox', None)
+    try:
+        if bbox:
+            min_lng, min_lat, max_lng, max_lat = map(float, bbox.split(","))
+            features = index.bbox(min_lng, min_lat, max_lng, max_lat,
+                                  limit=MAX_FEATURES)
+        else:
+            lat = float(request.GET['lat'])
+            lng = float(request.GET['lng'])
+            k = min(max(int(request.GET.get('k', MAX_FEATURES)), 1),
+                    MAX_FEATURES)
+            features = index.nearest(lat, lng, k=k, max_distance=12000000)
+    except (KeyError, ValueError):
+        return JsonResponse(
+            {"error": "Provide either bbox, or lat and lng parameters."},
+            status=400)
+    if len(features) >= STREAMING_MIN_ROWS:
+        return StreamingJSONResponse(request, features, key="stop_points")
     resultdict = {"stop_points": features}
     return JsonResponse(resultdict, safe=False)
 
 
 def ajax_disruptions(request):
     """
-    This view serves information to map.
+    This view serves information to map. Answers carry an ETag (version of
+    served geojsons), so that polls are answered 304 Not Modified while no
+    disruption was ingested.
     """
-    disruptions_list = query_mongo_active_disruptions(limit=300)
-    print("There are %d disruptions currently active." %
-          disruptions_list.count())
-
-    # Get active disruptions routes and convert it in geojson objects
-    pool = Pool(processes=30)
-    allgeojsonobjects = pool.map(disruption_to_geojsons, disruptions_list)
-    pool.close()
-    pool.join()
-
-    # Split results in delayed or canceled trips
-    delayed, canceled = geosjons_split_cancel_delay(allgeojsonobjects)
+    delayed, canceled, _, version = get_disruptions_geojsons()
+    etag = content_etag(request, version)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
     result = {"delayed": delayed, "canceled": canceled}
-    return JsonResponse(result, safe=False)
+    response = JsonResponse(result, safe=False)
+    response["ETag"] = quote_etag(etag)
+    return response
+
+
+def _tile_etag(request, z, x, y):
+    return tile_etag(int(z), int(x), int(y))
+
+
+def _tile_last_modified(request, z, x, y):
+    return tile_last_modified()
+
+
+@condition(etag_func=_tile_etag, last_modified_func=_tile_last_modified)
+def tile(request, z, x, y):
+    """
+    Serves stations and disruptions of one z/x/y tile, as geojson.
+    """
+    z, x, y = int(z), int(x), int(y)
+    if z > 20 or x >= 2 ** z or y >= 2 ** z:
+        return JsonResponse({"error": "Tile out of range."}, status=404)
+    response = JsonResponse(build_tile(z, x, y))
+    patch_cache_control(response, public=True, max_age=TILE_MAX_AGE)
+    return response
 
 
 def transilien_map(request):
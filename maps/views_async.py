@@ -0,0 +1,62 @@
+"""
+Async versions of maps ajax views, served by the ASGI application
+(sncfweb/asgi.py). They take and return Django requests and responses, like
+maps/views.py ones.
+"""
+
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from sncfweb.cache import content_etag
+from sncfweb.streaming import StreamingJSONResponse, STREAMING_MIN_ROWS
+from .spatial_index import get_stop_points_index, MAX_FEATURES
+from . import utils_async
+
+
+async def ajax_stop_points(request):
+    """
+    Same as views.ajax_stop_points. Nearest stop points are queried in Mongo
+    if in-memory index is empty.
+    """
+    index = get_stop_points_index()
+    bbox = request.GET.get('bbox', None)
+    try:
+        if bbox:
+            min_lng, min_lat, max_lng, max_lat = map(float, bbox.split(","))
+            features = index.bbox(min_lng, min_lat, max_lng, max_lat,
+                                  limit=MAX_FEATURES)
+        else:
+            lat = float(request.GET['lat'])
+            lng = float(request.GET['lng'])
+            k = min(max(int(request.GET.get('k', MAX_FEATURES)), 1),
+                    MAX_FEATURES)
+            if len(index):
+                features = index.nearest(lat, lng, k=k, max_distance=12000000)
+            else:
+                features = await utils_async.query_mongo_near_stations(
+                    lat, lng, limit=k)
+    except (KeyError, ValueError):
+        return JsonResponse(
+            {"error": "Provide either bbox, or lat and lng parameters."},
+            status=400)
+    if len(features) >= STREAMING_MIN_ROWS:
+        return StreamingJSONResponse(request, features, key="stop_points")
+    resultdict = {"stop_points": features}
+    return JsonResponse(resultdict, safe=False)
+
+
+async def ajax_disruptions(request):
+    """
+    Same as views.ajax_disruptions: Mongo queries wait on event loop.
+    """
+    delayed, canceled, _, version = \
+        await utils_async.get_disruptions_geojsons()
+    etag = content_etag(request, version)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    response = JsonResponse({"delayed": delayed, "canceled": canceled},
+                            safe=False)
+    response["ETag"] = quote_etag(etag)
+    return response
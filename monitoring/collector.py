@@ -0,0 +1,222 @@
+"""Module for background health collection
+
+A single collector process (`manage.py collect_health`) samples databases
+health every few seconds, and keeps the samples in a fixed size ring buffer
+per metric, so that trends can be shown without external tooling.
+
+After each collection, the history is published in the default cache, which
+is shared by all processes when a shared (L2) cache is configured: every
+web worker then serves the same, full history. Without shared cache, only
+processes running a collector have a history.
+"""
+
+import logging
+import threading
+import time
+from collections import deque, OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from pymongo.errors import OperationFailure
+
+from monitoring.utils_mongo import get_mongoclient
+from monitoring.utils_dynamo import dynamo_get_client, describe_table
+from sncfweb.settings.secrets import get_secret
+
+logger = logging.getLogger("django")
+
+MONGO_DB_NAME = get_secret("MONGO_DB_NAME")
+
+# Cache key of history published by the collector
+HISTORY_CACHE_KEY = "monitoring:history"
+
+# collection -> field holding its last update time, either a UTC datetime
+# or a local time string as '%Y%m%dT%H%M%S'
+INGESTION_FIELDS = OrderedDict([
+    ("route_schedules", "updated_time"),
+    ("disruptions", "updated_at"),
+])
+
+
+class MetricsHistory:
+    """ Fixed size ring buffer of (timestamp, value) samples per metric.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def add(self, metric, value, timestamp=None):
+        timestamp = timestamp or time.time()
+        with self._lock:
+            buffer = self._buffers.get(metric)
+            if buffer is None:
+                buffer = self._buffers[metric] = deque(maxlen=self.size)
+            buffer.append((timestamp, value))
+
+    def metrics(self):
+        return sorted(self._buffers.keys())
+
+    def get(self, metric, since=None):
+        with self._lock:
+            samples = list(self._buffers.get(metric, ()))
+        if since:
+            samples = [sample for sample in samples if sample[0] > since]
+        return samples
+
+    def to_dict(self):
+        with self._lock:
+            return {metric: list(buffer)
+                    for metric, buffer in self._buffers.items()}
+
+    @classmethod
+    def from_dict(cls, size, samples):
+        history = cls(size)
+        for metric, metric_samples in samples.items():
+            history._buffers[metric] = deque(metric_samples, maxlen=size)
+        return history
+
+
+def timed(function):
+    """ Returns (result, duration in milliseconds).
+    """
+    start = time.time()
+    result = function()
+    return result, (time.time() - start) * 1000.
+
+
+def ingestion_lag(collection, field):
+    """ Seconds since last update of collection, from its field containing
+    update time.
+    """
+    last = collection.find_one(
+        {field: {"$exists": True}}, {field: 1, "_id": 0},
+        sort=[(field, -1)])
+    if not last:
+        return None
+    updated = last[field]
+    if isinstance(updated, datetime):
+        return (datetime.utcnow() - updated).total_seconds()
+    updated = datetime.strptime(updated, '%Y%m%dT%H%M%S')
+    return (datetime.now() - updated).total_seconds()
+
+
+def sample_mongo():
+    client = get_mongoclient()
+    database = client[MONGO_DB_NAME]
+    _, ping = timed(lambda: client.admin.command("ping"))
+    samples = {"mongo.ping_ms": ping}
+
+    documents = 0
+    for collection_name in database.list_collection_names():
+        documents += database[collection_name].estimated_document_count()
+    samples["mongo.documents"] = documents
+
+    try:
+        connections = client.admin.command("serverStatus")\
+            .get("connections", {})
+    except OperationFailure as e:
+        # serverStatus needs clusterMonitor role, other samples don't
+        logger.warning("Mongo serverStatus not allowed: %s" % e)
+        connections = {}
+    samples["mongo.connections_current"] = connections.get("current")
+    samples["mongo.connections_available"] = connections.get("available")
+
+    for collection_name, field in INGESTION_FIELDS.items():
+        samples["mongo.%s.ingestion_lag_s" % collection_name] = \
+            ingestion_lag(database[collection_name], field)
+    return samples
+
+
+def sample_dynamo():
+    client = dynamo_get_client()
+    tables_names, ping = timed(lambda: client.list_tables()["TableNames"])
+    samples = {"dynamo.ping_ms": ping}
+    for table_name in tables_names:
+        samples["dynamo.%s.items" % table_name] = \
+            describe_table(table_name)["Table"]["ItemCount"]
+    return samples
+
+
+def sample_postgres():
+    def ping():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+    try:
+        _, ping_ms = timed(ping)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database()")
+            connections = cursor.fetchone()[0]
+    finally:
+        # Collector thread must not hold a connection between samples
+        connection.close()
+    return {"postgres.ping_ms": ping_ms,
+            "postgres.connections": connections}
+
+
+SAMPLERS = OrderedDict([
+    ("mongo", sample_mongo),
+    ("dynamo", sample_dynamo),
+    ("postgres", sample_postgres),
+])
+
+
+class HealthCollector:
+    """ Samples health metrics every interval, and publishes history. Only
+    one collector must run (`manage.py collect_health`), so that databases
+    are probed once per interval.
+
+    Each sampler also records an "<name>.up" metric, 1 if sampling succeeded
+    and 0 otherwise.
+    """
+
+    def __init__(self, history, interval):
+        self.history = history
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def collect(self):
+        timestamp = time.time()
+        for name, sampler in SAMPLERS.items():
+            try:
+                samples = sampler()
+                self.history.add("%s.up" % name, 1, timestamp)
+            except Exception as e:
+                logger.warning("Health sampling of %s failed: %s" % (name, e))
+                self.history.add("%s.up" % name, 0, timestamp)
+                continue
+            for metric, value in samples.items():
+                if value is not None:
+                    self.history.add(metric, value, timestamp)
+        try:
+            # kept as long as the history covers
+            cache.set(HISTORY_CACHE_KEY, self.history.to_dict(),
+                      self.interval * self.history.size)
+        except Exception as e:
+            logger.warning("Health history publication failed: %s" % e)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.collect()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+history = MetricsHistory(getattr(settings, "MONITORING_HISTORY_SIZE", 720))
+
+
+def published_history():
+    """ History published by the collector, else history of this process.
+    """
+    samples = cache.get(HISTORY_CACHE_KEY)
+    if samples is None:
+        return history
+    return MetricsHistory.from_dict(history.size, samples)
@@ -0,0 +1,199 @@
+"""Module for requests instrumentation
+
+Records, for each request, wall time and number/duration of calls per named
+stage (SQL queries, Mongo commands, DynamoDB realtime queries, serialization,
+SNCF api calls...).
+
+- code can be instrumented with `with stage("name"):` blocks.
+- Mongo commands and SQLAlchemy queries are recorded automatically, through
+  pymongo command listeners and SQLAlchemy engine events.
+
+Per request results are sent in Server-Timing headers by
+InstrumentationMiddleware, and aggregated in histograms exposed in
+Prometheus text format.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from pymongo import monitoring as mongo_monitoring
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histograms buckets upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+_local = threading.local()
+
+
+class RequestTimings:
+    """ Stages timings of one request: stage -> [calls, total seconds].
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.stages = OrderedDict()
+
+    def add(self, name, duration, calls=1):
+        entry = self.stages.setdefault(name, [0, 0.])
+        entry[0] += calls
+        entry[1] += duration
+
+    def server_timing(self, total):
+        """ Server-Timing header value, durations in milliseconds.
+        """
+        metrics = []
+        for name, (calls, duration) in self.stages.items():
+            metrics.append('%s;dur=%.1f;desc="%d calls"' % (
+                name, duration * 1000, calls))
+        metrics.append("total;dur=%.1f" % (total * 1000))
+        return ", ".join(metrics)
+
+
+def current_timings():
+    return getattr(_local, "timings", None)
+
+
+def start_request():
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def end_request():
+    timings = current_timings()
+    _local.timings = None
+    return timings
+
+
+def record(name, duration, calls=1):
+    """ Records a call in current request, if any.
+    """
+    timings = current_timings()
+    if timings is not None:
+        timings.add(name, duration, calls)
+
+
+@contextmanager
+def stage(name):
+    """ Times enclosed block as one call of stage name.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(name, time.time() - start)
+
+
+class Histogram:
+    """ Cumulative histogram, in Prometheus sense.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """ Aggregated requests and stages metrics, per view.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # view -> Histogram
+        self.stages = {}  # (view, stage) -> Histogram
+        self.stage_calls = {}  # (view, stage) -> int
+
+    def observe_request(self, view, total, timings):
+        with self._lock:
+            self.requests.setdefault(view, Histogram()).observe(total)
+            for name, (calls, duration) in timings.stages.items():
+                key = (view, name)
+                self.stages.setdefault(key, Histogram()).observe(duration)
+                self.stage_calls[key] = self.stage_calls.get(key, 0) + calls
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            lines += _histogram_lines(
+                "sncfweb_request_duration_seconds",
+                "Requests wall time, per view.",
+                [({"view": view}, histogram)
+                 for view, histogram in sorted(self.requests.items())])
+            lines += _histogram_lines(
+                "sncfweb_stage_duration_seconds",
+                "Time spent per request in each stage, per view.",
+                [({"view": view, "stage": name}, histogram)
+                 for (view, name), histogram in sorted(self.stages.items())])
+            lines.append(
+                "# HELP sncfweb_stage_calls_total Number of calls per stage.")
+            lines.append("# TYPE sncfweb_stage_calls_total counter")
+            for (view, name), calls in sorted(self.stage_calls.items()):
+                lines.append("sncfweb_stage_calls_total%s %d" % (
+                    _labels({"view": view, "stage": name}), calls))
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    return "{%s}" % ",".join(
+        '%s="%s"' % (key, str(value).replace('"', '\\"'))
+        for key, value in sorted(labels.items()))
+
+
+def _histogram_lines(name, help_text, labelled_histograms):
+    lines = ["# HELP %s %s" % (name, help_text), "# TYPE %s histogram" % name]
+    for labels, histogram in labelled_histograms:
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            bucket_labels = dict(labels, le=repr(bound))
+            lines.append("%s_bucket%s %d" % (
+                name, _labels(bucket_labels), count))
+        lines.append("%s_bucket%s %d" % (
+            name, _labels(dict(labels, le="+Inf")), histogram.count))
+        lines.append("%s_sum%s %f" % (name, _labels(labels), histogram.sum))
+        lines.append("%s_count%s %d" % (
+            name, _labels(labels), histogram.count))
+    return lines
+
+
+registry = MetricsRegistry()
+
+
+class MongoCommandTimer(mongo_monitoring.CommandListener):
+    """ Records each Mongo command as a call of "mongo" stage.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record("mongo", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        record("mongo", event.duration_micros / 1e6)
+
+
+# Must be registered before any MongoClient is created
+mongo_monitoring.register(MongoCommandTimer())
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault("query_start_time", []).append(time.time())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = conn.info["query_start_time"].pop()
+    record("sql", time.time() - start)
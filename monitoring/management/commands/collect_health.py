@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.collector import HealthCollector, history
+
+
+class Command(BaseCommand):
+    help = (
+        "Samples databases health every MONITORING_COLLECTOR_INTERVAL "
+        "seconds, and publishes history for /monitoring/history (run a "
+        "single instance).")
+
+    def handle(self, *args, **options):
+        interval = getattr(settings, "MONITORING_COLLECTOR_INTERVAL", None)
+        if not interval:
+            raise CommandError(
+                "Health collection is disabled "
+                "(MONITORING_COLLECTOR_INTERVAL).")
+        collector = HealthCollector(history, interval)
+        try:
+            collector.run()
+        except KeyboardInterrupt:
+            collector.stop()
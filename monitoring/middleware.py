@@ -0,0 +1,74 @@
+"""Monitoring middlewares
+"""
+
+import random
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from monitoring import instrumentation
+from monitoring.profiling import profile_call
+
+
+class InstrumentationMiddleware:
+    """
+    Times each request and its stages, sends them in Server-Timing header,
+    and aggregates them per view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = instrumentation.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            instrumentation.end_request()
+        total = time.time() - timings.start
+
+        resolver_match = getattr(request, "resolver_match", None)
+        view = resolver_match.view_name if resolver_match else "unresolved"
+        instrumentation.registry.observe_request(view, total, timings)
+        response["Server-Timing"] = timings.server_timing(total)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests on PROFILED_PATHS:
+    - on demand, for staff users, with ?_profile=1 (cProfile) or
+      ?_profile=sampling (collapsed stacks), or the same values in
+      X-Profile header: profile is returned instead of response.
+    - for a PROFILE_SAMPLE_RATE fraction of all requests: profile is only
+      stored, response is unchanged.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = getattr(settings, "PROFILED_PATHS", ("/api/", "/maps/"))
+        self.sample_rate = getattr(settings, "PROFILE_SAMPLE_RATE", 0)
+
+    def __call__(self, request):
+        if not request.path.startswith(self.paths):
+            return self.get_response(request)
+
+        asked = request.GET.get("_profile") or \
+            request.META.get("HTTP_X_PROFILE")
+        user = getattr(request, "user", None)
+        if asked and user is not None and user.is_staff:
+            mode = "sampling" if asked == "sampling" else "cprofile"
+            _, profile = profile_call(
+                lambda: self.get_response(request), request.path, mode)
+            return HttpResponse(
+                profile.collapsed or profile.stats,
+                content_type="text/plain")
+
+        if self.sample_rate and random.random() < self.sample_rate:
+            response, _ = profile_call(
+                lambda: self.get_response(request), request.path,
+                "sampling", sampled=True)
+            return response
+
+        return self.get_response(request)
@@ -0,0 +1,131 @@
+"""Module for requests profiling
+
+Two profilers are available:
+- cProfile: deterministic, gives top N functions by cumulative time.
+- a sampling profiler: a thread samples the request thread stack every few
+  milliseconds, and gives stacks counts in collapsed format ("a;b;c 12"
+  lines), which can be turned into flamegraphs by flamegraph.pl/speedscope.
+
+Profiles are kept in a bounded in-memory list, and optionally written in
+PROFILE_DIR.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import deque, Counter
+
+from django.conf import settings
+
+PROFILE_TOP_N = getattr(settings, "PROFILE_TOP_N", 40)
+PROFILE_SAMPLING_INTERVAL = getattr(
+    settings, "PROFILE_SAMPLING_INTERVAL", 0.005)
+PROFILE_DIR = getattr(settings, "PROFILE_DIR", None)
+
+profiles = deque(maxlen=getattr(settings, "PROFILE_HISTORY_SIZE", 50))
+
+
+class Profile:
+    """ Profile of one request.
+    """
+
+    def __init__(self, path, mode, sampled):
+        self.path = path
+        self.mode = mode
+        self.sampled = sampled
+        self.started_at = time.time()
+        self.duration = None
+        self.stats = None
+        self.collapsed = None
+
+    def summary(self):
+        return {
+            "path": self.path,
+            "mode": self.mode,
+            "sampled": self.sampled,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "stats": self.stats,
+            "collapsed": self.collapsed,
+        }
+
+    def save(self, directory):
+        name = "%d-%s" % (
+            self.started_at * 1000, self.path.strip("/").replace("/", "_"))
+        if self.stats:
+            with open(os.path.join(directory, name + ".txt"), "w") as f:
+                f.write(self.stats)
+        if self.collapsed:
+            with open(os.path.join(directory, name + ".collapsed"), "w") as f:
+                f.write(self.collapsed)
+
+
+class StackSampler(threading.Thread):
+    """ Samples stack of a thread at regular interval.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLING_INTERVAL):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (
+                    code.co_name, os.path.basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        return "\n".join(
+            "%s %d" % (stack, count)
+            for stack, count in self.stacks.most_common()) + "\n"
+
+
+def profile_call(function, path, mode="cprofile", sampled=False):
+    """ Runs function under profiler. Returns (function result, Profile).
+
+    mode is either "cprofile" or "sampling".
+    """
+    profile = Profile(path, mode, sampled)
+    if mode == "sampling":
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+        try:
+            result = function()
+        finally:
+            sampler.stop()
+        profile.collapsed = sampler.collapsed()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            result = function()
+        finally:
+            profiler.disable()
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream)\
+            .sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        profile.stats = stream.getvalue()
+    profile.duration = time.time() - profile.started_at
+
+    profiles.append(profile)
+    if PROFILE_DIR:
+        profile.save(PROFILE_DIR)
+    return result, profile
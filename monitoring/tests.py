@@ -1,3 +1,62 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from monitoring import collector
+from monitoring.collector import HealthCollector, MetricsHistory
+
+
+class MetricsHistoryTest(SimpleTestCase):
+
+    def test_ring_buffer(self):
+        history = MetricsHistory(3)
+        for timestamp in range(1, 6):
+            history.add("mongo.ping_ms", timestamp * 10., timestamp)
+        history.add("dynamo.ping_ms", 1., 5)
+        self.assertEqual(history.metrics(),
+                         ["dynamo.ping_ms", "mongo.ping_ms"])
+        self.assertEqual(history.get("mongo.ping_ms"),
+                         [(3, 30.), (4, 40.), (5, 50.)])
+        self.assertEqual(history.get("mongo.ping_ms", since=4), [(5, 50.)])
+        self.assertEqual(history.get("postgres.ping_ms"), [])
+
+    def test_dict_round_trip(self):
+        history = MetricsHistory(2)
+        history.add("mongo.up", 1, 1)
+        history.add("mongo.up", 0, 2)
+        restored = MetricsHistory.from_dict(2, history.to_dict())
+        self.assertEqual(restored.get("mongo.up"), [(1, 1), (2, 0)])
+        restored.add("mongo.up", 1, 3)
+        self.assertEqual(restored.get("mongo.up"), [(2, 0), (3, 1)])
+
+
+def failing_sampler():
+    raise RuntimeError("down")
+
+
+class HealthCollectorTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.delete(collector.HISTORY_CACHE_KEY)
+        self.addCleanup(cache.delete, collector.HISTORY_CACHE_KEY)
+
+    @mock.patch.object(collector, "SAMPLERS", {
+        "mongo": lambda: {"mongo.ping_ms": 2., "mongo.connections": None},
+        "dynamo": failing_sampler,
+    })
+    def test_collect_publishes_history(self):
+        history = MetricsHistory(10)
+        with self.assertLogs("django", "WARNING"):
+            HealthCollector(history, 5).collect()
+        self.assertEqual(history.metrics(),
+                         ["dynamo.up", "mongo.ping_ms", "mongo.up"])
+        self.assertEqual(history.get("dynamo.up")[0][1], 0)
+
+        published = collector.published_history()
+        self.assertIsNot(published, collector.history)
+        self.assertEqual(published.get("mongo.ping_ms"),
+                         history.get("mongo.ping_ms"))
+
+    def test_published_history_fallback(self):
+        self.assertIs(collector.published_history(), collector.history)
@@ -8,4 +8,8 @@ urlpatterns = [
         name='ajax_monitoring_mongo_db'),
     url(r'^dynamodbstatus$', views.ajax_monitoring_dynamo_db,
         name='ajax_monitoring_dynamo_db'),
+    url(r'^history$', views.ajax_monitoring_history,
+        name='ajax_monitoring_history'),
+    url(r'^metrics$', views.metrics, name='monitoring_metrics'),
+    url(r'^profiles$', views.ajax_profiles, name='ajax_monitoring_profiles'),
 ]
@@ -0,0 +1,65 @@
+"""Module with small caching helpers for monitoring probes
+"""
+
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+def ttl_cache(seconds):
+    """
+    Caches function result for given number of seconds (per arguments).
+    Concurrent calls on an expired entry wait for a single computation.
+    """
+    def decorator(function):
+        cache = {}
+        locks = {}
+        global_lock = threading.Lock()
+
+        @functools.wraps(function)
+        def wrapper(*args):
+            entry = cache.get(args)
+            if entry and time.time() - entry[0] < seconds:
+                return entry[1]
+            with global_lock:
+                lock = locks.setdefault(args, threading.Lock())
+            with lock:
+                entry = cache.get(args)
+                if entry and time.time() - entry[0] < seconds:
+                    return entry[1]
+                result = function(*args)
+                cache[args] = (time.time(), result)
+                return result
+
+        def clear():
+            cache.clear()
+
+        wrapper.cache_clear = clear
+        return wrapper
+    return decorator
+
+
+_probes_executor = ThreadPoolExecutor(max_workers=16)
+
+
+def run_probes(probes, timeout):
+    """
+    Runs probes in parallel. Probes is a dictionary of name: function.
+    Returns dictionary of name: (status, result), status being False with
+    an error message as result if probe failed or exceeded timeout (seconds).
+    """
+    futures = {
+        name: _probes_executor.submit(probe) for name, probe in probes.items()
+    }
+    deadline = time.time() + timeout
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = (
+                True, future.result(timeout=max(0, deadline - time.time())))
+        except TimeoutError:
+            results[name] = (False, "timeout after %s seconds" % timeout)
+        except Exception as e:
+            results[name] = (False, str(e))
+    return results
@@ -2,9 +2,12 @@
 """
 
 
+import functools
+
 import boto3
 
 from lib.api_etl.utils_secrets import get_secret
+from monitoring.utils_cache import ttl_cache, run_probes
 
 # Set as environment variable: boto takes it directly
 AWS_DEFAULT_REGION = get_secret("AWS_DEFAULT_REGION", env=True)
@@ -13,28 +16,52 @@ AWS_SECRET_ACCESS_KEY = get_secret("AWS_SECRET_ACCESS_KEY", env=True)
 
 dynamodb = boto3.resource('dynamodb')
 
+# Monitoring results are shared between requests for a few seconds
+MONITORING_CACHE_SECONDS = 10
+PROBE_TIMEOUT = 2
+
+
+_client = None
+
 
 def dynamo_get_client():
     """
-    Return Dynamo client (credentials already set up)
+    Return Dynamo client (credentials already set up), shared by whole
+    process (boto3 clients are thread-safe).
     """
-    return boto3.client("dynamodb")
+    global _client
+    if _client is None:
+        _client = boto3.client("dynamodb")
+    return _client
 
 
-def check_dynamo_connection():
+# ItemCount is only updated by AWS every six hours or so: no need to describe
+# tables at each call.
+@ttl_cache(300)
+def describe_table(table_name):
+    return dynamo_get_client().describe_table(TableName=table_name)
+
+
+@ttl_cache(MONITORING_CACHE_SECONDS)
+def check_dynamo_connection(timeout=PROBE_TIMEOUT):
     status = False
     try:
         client = dynamo_get_client()
         tables_names = client.list_tables()["TableNames"]
 
+        probes = {
+            table_name: functools.partial(describe_table, table_name)
+            for table_name in tables_names
+        }
         tables_stats = []
         tables_desc = {}
-        for table_name in tables_names:
-            table_desc = client.describe_table(TableName=table_name)
+        for table_name, (table_status, table_desc) in sorted(
+                run_probes(probes, timeout).items()):
             tables_desc[table_name] = table_desc
             table_stat = {
                 "table": table_name,
                 "count": table_desc["Table"]["ItemCount"]
+                if table_status else None
             }
             tables_stats.append(table_stat)
 
@@ -45,5 +72,5 @@ def check_dynamo_connection():
         status = True
     except Exception as e:
         # Status stays False
-        add_info = e
+        add_info = str(e)
     return status, add_info
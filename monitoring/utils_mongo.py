@@ -1,9 +1,12 @@
 """Module for specific mongo monitoring functions
 """
 
+import functools
+import threading
+
 from pymongo import MongoClient
-import pymongo
 from sncfweb.settings.secrets import get_secret
+from monitoring.utils_cache import ttl_cache, run_probes
 
 try:
     # Python 3.x
@@ -17,12 +20,15 @@ MONGO_USER = get_secret("MONGO_USER")
 MONGO_HOST = get_secret("MONGO_HOST")
 MONGO_PASSWORD = get_secret("MONGO_PASSWORD")
 
+# Monitoring results are shared between requests for a few seconds
+MONITORING_CACHE_SECONDS = 10
+PROBE_TIMEOUT_MS = 2000
 
-def connect_mongoclient(
+
+def mongo_uri(
     host=MONGO_HOST, user=MONGO_USER, password=MONGO_PASSWORD,
-    port=None, database=None, max_delay=15000
+    port=None, database=None
 ):
-    # Build URI
     uri = "mongodb://"
     if user and password:
         uri += "%s:%s@" % (quote_plus(user), quote_plus(password))
@@ -31,18 +37,93 @@ def connect_mongoclient(
         uri += ":" + str(port)
     if database:
         uri += "/%s" % quote_plus(database)
+    return uri
+
+
+def connect_mongoclient(
+    host=MONGO_HOST, user=MONGO_USER, password=MONGO_PASSWORD,
+    port=None, database=None, max_delay=15000
+):
+    uri = mongo_uri(host, user, password, port, database)
     client = MongoClient(uri, serverSelectionTimeoutMS=max_delay)
     return client
 
 
-def check_mongo_connection(max_delay=500):
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_mongoclient():
+    """
+    Returns MongoClient shared by whole process (MongoClient is thread-safe
+    and holds its own connection pool).
+    """
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = connect_mongoclient()
+    return _shared_client
+
+
+def get_database_stats(client, database_name, max_time_ms=PROBE_TIMEOUT_MS):
+    """
+    Returns stats of one database, using dbStats and collections metadata
+    counts: no collection is scanned.
+    """
+    database = client[database_name]
+    db_stats = database.command("dbStats", maxTimeMS=max_time_ms)
+    database_result = []
+    for collection_name in database.list_collection_names():
+        database_result.append(
+            {
+                "collection": collection_name,
+                "count": database[collection_name].estimated_document_count(
+                    maxTimeMS=max_time_ms)
+            })
+    return {
+        "database": database_name,
+        "collections": database_result,
+        "stats": {
+            key: db_stats.get(key) for key in
+            ("objects", "dataSize", "storageSize", "indexes", "indexSize")
+        }
+    }
+
+
+def get_databases_stats(client, timeout=PROBE_TIMEOUT_MS / 1000.):
+    """
+    Probes all databases in parallel, each with a timeout.
+    """
+    database_names = client.list_database_names()
+    probes = {
+        database_name: functools.partial(
+            get_database_stats, client, database_name)
+        for database_name in database_names
+    }
+    result = []
+    for database_name, (status, stats) in sorted(
+            run_probes(probes, timeout).items()):
+        if not status:
+            stats = {"database": database_name,
+                     "collections": [], "error": stats}
+        result.append(stats)
+    return result
+
+
+@ttl_cache(MONITORING_CACHE_SECONDS)
+def check_mongo_connection(max_delay=PROBE_TIMEOUT_MS):
 
     status = False
-    client = connect_mongoclient(max_delay=max_delay)
-    try:
-        server_info = client.server_info()
-        database_names = client.database_names()
-        # print(server_info)
+    client = get_mongoclient()
+    # Shared client waits longer for server selection: probe under timeout
+    probes = run_probes({
+        "server_info": client.server_info,
+        "database_names": client.list_database_names,
+    }, max_delay / 1000.)
+    server_status, server_info = probes["server_info"]
+    names_status, database_names = probes["database_names"]
+    if server_status and names_status:
         status = True
         add_info = {
             "server_info": server_info,
@@ -50,29 +131,8 @@ def check_mongo_connection(max_delay=500):
             "databases_stats": get_databases_stats(client)
         }
         print("MongoDB connection OK")
-    except pymongo.errors.ServerSelectionTimeoutError as err:
+    else:
         # Status stays False
         add_info = None
-        print(err)
+        print(server_info if not server_status else database_names)
     return status, add_info
-
-
-def get_databases_stats(client):
-    result = []
-    database_names = client.database_names()
-    for database_name in database_names:
-        database_result = []
-        collection_names = client[database_name].collection_names()
-        for collection_name in collection_names:
-            database_result.append(
-                {
-                    "collection": collection_name,
-                    "count": client[database_name][collection_name].count()
-                })
-        added_object = {
-            "database": database_name,
-            "collections": database_result
-        }
-        result.append(added_object)
-
-    return result
@@ -1,10 +1,14 @@
 """Monitoring views.
 """
 
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
 from monitoring.utils_mongo import check_mongo_connection
 from monitoring.utils_dynamo import check_dynamo_connection
-from django.http import JsonResponse
+from monitoring.collector import published_history
+from monitoring.instrumentation import registry
+from monitoring.profiling import profiles
+from django.http import JsonResponse, HttpResponse
 
 
 def index(request):
@@ -22,3 +26,39 @@ def ajax_monitoring_dynamo_db(request):
     status, add_info = check_dynamo_connection()
     response = {"status": status, "add_info": add_info or ""}
     return JsonResponse(response)
+
+
+def ajax_monitoring_history(request):
+    """
+    Serves collected health samples, as [timestamp, value] lists.
+    - metric: metric name, can be repeated, default all metrics
+    - since: unix timestamp, only samples after it are returned
+    """
+    history = published_history()
+    metrics = request.GET.getlist('metric') or history.metrics()
+    try:
+        since = float(request.GET.get('since', 0))
+    except ValueError:
+        since = 0
+    response = {
+        "metrics": {metric: history.get(metric, since) for metric in metrics}
+    }
+    return JsonResponse(response)
+
+
+def metrics(request):
+    """
+    Requests and stages timings, in Prometheus text format.
+    """
+    return HttpResponse(registry.prometheus_text(),
+                        content_type="text/plain; version=0.0.4")
+
+
+@staff_member_required
+def ajax_profiles(request):
+    """
+    Last stored requests profiles, most recent first.
+    """
+    response = {"profiles": [profile.summary() for profile in
+                             reversed(profiles)]}
+    return JsonResponse(response)
@@ -0,0 +1,238 @@
+"""
+Columnar archive of realtime departures.
+
+Realtime departures are only kept for live use in DynamoDB. A daily
+compaction (`manage.py compact_realtime`) joins the scheduled stoptimes of a
+day with their realtime departures (batched DynamoDB reads, line by line,
+as for exports), and writes stoptimes observed in realtime to one parquet
+file per day:
+
+    <REALTIME_ARCHIVE_DIR>/day=yyyymmdd/realtime.parquet
+
+Columns are typed (ARCHIVE_SCHEMA), rows are sorted by station then
+scheduled time, and written by row groups of ARCHIVE_ROW_GROUP_SIZE rows:
+row groups statistics let station filters skip most of a file.
+
+`read_archive` reads a range of days (day partitions outside of range are
+not opened) with station and line filters pushed down to parquet, and
+`read_feature_matrix` builds training features (project_api/feature_matrix)
+from archived days, as they would have been seen online at cut-off times.
+"""
+
+import logging
+import os
+import re
+import shutil
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from project_api.export import iter_row_batches
+from project_api.feature_matrix import (
+    build_feature_matrix, gtfs_time_to_seconds, INPUT_COLUMNS
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger("django")
+
+ARCHIVE_DIR = getattr(
+    settings, "REALTIME_ARCHIVE_DIR",
+    os.path.join(settings.BASE_DIR, "data", "realtime_archive"))
+ARCHIVE_FILE = "realtime.parquet"
+ARCHIVE_ROW_GROUP_SIZE = 16384
+
+# Training features are built as of cut-off times every N seconds of day
+FEATURE_CUTOFF_SECONDS = 1800
+
+# column -> numpy dtype (object for strings)
+ARCHIVE_SCHEMA = OrderedDict([
+    ("station", np.int32),
+    ("route_short_name", object),
+    ("train_num", object),
+    ("trip_id", object),
+    ("stop_sequence", np.int16),
+    ("scheduled_seconds", np.int32),
+    ("expected_seconds", np.int32),
+    ("delay_seconds", np.int32),
+    ("data_freshness", object),
+])
+
+
+def day_path(day, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, "day=%s" % day, ARCHIVE_FILE)
+
+
+def _station(stop_id):
+    """ UIC7 code of GTFS stop id, -1 if it has none.
+    """
+    match = re.search(r"(\d{7,8})$", stop_id or "")
+    return int(match.group(1)[:7]) if match else -1
+
+
+def rows_to_frame(line, rows):
+    """ Typed archive frame of result rows observed in realtime.
+    """
+    columns = {name: [] for name in ARCHIVE_SCHEMA}
+    expected = []
+    departure = []
+    for row in rows:
+        realtime = getattr(row, "RealTime", None)
+        if realtime is None or not getattr(
+                realtime, "expected_passage_time", None):
+            continue
+        stoptime = row.StopTime
+        columns["station"].append(_station(stoptime.stop_id))
+        columns["route_short_name"].append(line)
+        columns["train_num"].append(getattr(realtime, "train_num", None))
+        columns["trip_id"].append(stoptime.trip_id)
+        columns["stop_sequence"].append(stoptime.stop_sequence)
+        columns["data_freshness"].append(
+            getattr(realtime, "data_freshness", None))
+        departure.append(stoptime.departure_time)
+        expected.append(realtime.expected_passage_time)
+
+    frame = pd.DataFrame({
+        name: columns[name] for name in ARCHIVE_SCHEMA
+        if name not in ("scheduled_seconds", "expected_seconds",
+                        "delay_seconds")})
+    frame["scheduled_seconds"] = gtfs_time_to_seconds(pd.Series(departure))
+    frame["expected_seconds"] = gtfs_time_to_seconds(pd.Series(expected))
+    # expected times are times of day: delays are wrapped around midnight
+    delay = (frame.expected_seconds - frame.scheduled_seconds % 86400 +
+             43200) % 86400 - 43200
+    frame["delay_seconds"] = delay
+    frame["stop_sequence"] = pd.to_numeric(
+        frame["stop_sequence"], errors="coerce")
+    frame = frame.dropna(subset=["scheduled_seconds", "expected_seconds",
+                                 "stop_sequence"])
+    return frame.astype(
+        {name: dtype for name, dtype in ARCHIVE_SCHEMA.items()
+         if dtype is not object})[list(ARCHIVE_SCHEMA.keys())]
+
+
+def compact_day(day, archive_dir=ARCHIVE_DIR):
+    """
+    Writes realtime observations of day in archive (replacing previous
+    archive of day). Returns number of rows written.
+    """
+    frames = [rows_to_frame(line, rows)
+              for line, rows in iter_row_batches(day, realtime=True)]
+    frame = pd.concat(frames, ignore_index=True) if frames else \
+        rows_to_frame(None, [])
+    frame = frame.sort_values(["station", "scheduled_seconds"], kind="mergesort")
+
+    path = day_path(day, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written aside then renamed, so that readers never see a partial file
+    tmp_path = path + ".tmp"
+    table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+    pyarrow.parquet.write_table(
+        table, tmp_path, row_group_size=ARCHIVE_ROW_GROUP_SIZE,
+        compression="snappy")
+    shutil.move(tmp_path, path)
+    return len(frame)
+
+
+def archived_days(start_day, end_day, archive_dir=ARCHIVE_DIR):
+    """ Archived days between start_day and end_day (yyyymmdd, included).
+    """
+    start = datetime.strptime(start_day, "%Y%m%d")
+    end = datetime.strptime(end_day, "%Y%m%d")
+    days = []
+    while start <= end:
+        day = start.strftime("%Y%m%d")
+        if os.path.exists(day_path(day, archive_dir)):
+            days.append(day)
+        start += timedelta(days=1)
+    return days
+
+
+def read_archive(start_day, end_day, stations=None, lines=None,
+                 columns=None, archive_dir=ARCHIVE_DIR):
+    """
+    Archived realtime observations of days between start_day and end_day
+    (included), optionally only of stations (UIC7 codes) and lines, as a
+    frame with a day column. Only asked columns are read.
+    """
+    filters = []
+    if stations:
+        filters.append(("station", "in", [int(s) for s in stations]))
+    if lines:
+        filters.append(("route_short_name", "in", list(lines)))
+    frames = []
+    for day in archived_days(start_day, end_day, archive_dir):
+        table = pyarrow.parquet.read_table(
+            day_path(day, archive_dir), columns=columns,
+            filters=filters or None)
+        frame = table.to_pandas()
+        frame.insert(0, "day", day)
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=["day"] + list(columns or ARCHIVE_SCHEMA))
+    return pd.concat(frames, ignore_index=True)
+
+
+def archive_to_stoptimes_frame(frame, cutoff):
+    """ Stoptimes frame (feature_matrix INPUT_COLUMNS) of archive frame, as
+    seen at cutoff (seconds of GTFS day): only stoptimes passed at cutoff
+    are observed in realtime, later ones have no delay.
+    """
+    passed = (frame.scheduled_seconds + frame.delay_seconds) <= cutoff
+    stoptimes = pd.DataFrame({
+        "trip_id": frame.trip_id,
+        # unknown stations (-1) must not be aggregated as one station
+        "station_id": frame.station.where(frame.station >= 0),
+        "stop_sequence": frame.stop_sequence,
+        "scheduled_seconds": frame.scheduled_seconds,
+        "observed_delay": frame.delay_seconds.astype(np.float64)
+        .where(passed),
+        "passed_realtime": passed,
+    })
+    return stoptimes[INPUT_COLUMNS]
+
+
+def feature_cutoffs(frame, interval=FEATURE_CUTOFF_SECONDS):
+    """ Cut-off times (seconds of GTFS day) covering passages of frame.
+    """
+    passages = frame.scheduled_seconds + frame.delay_seconds
+    if not len(passages):
+        return []
+    start = int(passages.min()) // interval * interval + interval
+    return list(range(start, int(passages.max()) + interval, interval))
+
+
+def read_feature_matrix(start_day, end_day, stations=None, lines=None,
+                        interval=FEATURE_CUTOFF_SECONDS,
+                        archive_dir=ARCHIVE_DIR):
+    """
+    Training examples of archived days: for each cut-off time (every
+    interval seconds), features of stoptimes to predict (not passed yet, of
+    trips having a passed stop) computed from stoptimes passed at cut-off
+    only, with day, cutoff and observed delay (target) columns. Aggregates
+    are per day.
+    """
+    archive = read_archive(start_day, end_day, stations, lines,
+                           archive_dir=archive_dir)
+    matrices = []
+    for day, frame in archive.groupby("day", sort=True):
+        for cutoff in feature_cutoffs(frame, interval):
+            features = build_feature_matrix(
+                archive_to_stoptimes_frame(frame, cutoff))
+            features = features[features.to_predict]
+            if not len(features):
+                continue
+            features.insert(0, "day", day)
+            features.insert(1, "cutoff", cutoff)
+            features["observed_delay"] = frame.delay_seconds[features.index]
+            matrices.append(features)
+    if not matrices:
+        return pd.DataFrame()
+    return pd.concat(matrices, ignore_index=True)
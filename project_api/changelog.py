@@ -0,0 +1,107 @@
+"""
+Change log of realtime state of active trips and stoptimes.
+
+Each time realtime information is refreshed (prediction snapshots refresh),
+trips and stoptimes whose realtime state or prediction changed are recorded
+in the change_log Mongo collection, along with trips that are not active
+anymore. The collection is capped (CHANGELOG_SIZE entries, see
+maps/indexes.py), so that it stays bounded without any cleanup, and is
+shared by all processes.
+
+Polling clients pass the version they last received (since=<version>), and
+only get rows that changed after it: cost of a poll depends on the change
+rate, not on the size of the table. A version is the sequence number of the
+last entry; versions older than the oldest kept entry, or newer than the
+last one (log was reset), can't be answered with changes and require a full
+reload.
+
+Entries are numbered by their single writer, the snapshots refresher
+(`manage.py refresh_snapshots`), and inserted in order: readers never see an
+entry before the ones preceding it.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+
+from maps.indexes import CAPPED_COLLECTIONS, ensure_capped_collection
+from maps.utils import get_collection
+
+TRIP = "trip"
+STOPTIME = "stoptime"
+
+CHANGELOG_COLLECTION = "change_log"
+
+
+class ChangeLog:
+    """ Log of (version, kind, key, row, tags) changes, row being None for
+    deletions, and tags being used to filter changes.
+    """
+
+    def __init__(self, collection_name=CHANGELOG_COLLECTION):
+        self.collection_name = collection_name
+        self._ensured = False
+
+    @property
+    def collection(self):
+        collection = get_collection(self.collection_name)
+        if not self._ensured:
+            ensure_capped_collection(
+                collection.database, self.collection_name,
+                *CAPPED_COLLECTIONS[self.collection_name])
+            self._ensured = True
+        return collection
+
+    def _last_seq(self, direction=DESCENDING):
+        entry = self.collection.find_one(
+            {}, {"seq": 1, "_id": 0}, sort=[("seq", direction)])
+        return entry["seq"] if entry else None
+
+    @property
+    def version(self):
+        return str(self._last_seq() or 0)
+
+    def record(self, day, changes):
+        """ Appends changes of day, an iterable of (kind, key, row, tags).
+        """
+        seq = self._last_seq() or 0
+        entries = []
+        for kind, key, row, tags in changes:
+            seq += 1
+            entries.append({"seq": seq, "day": day, "kind": kind, "key": key,
+                            "row": row, "tags": tags})
+        if entries:
+            self.collection.insert_many(entries, ordered=True)
+
+    def since(self, version, kind, **filters):
+        """ Returns (current version, OrderedDict of key: row) of last changes
+        of kind after version, matching filters on tags. Returns None if
+        version is not covered by log.
+        """
+        try:
+            since = int(version)
+        except (TypeError, ValueError):
+            return None
+        current = self._last_seq() or 0
+        oldest = self._last_seq(ASCENDING)
+        if since > current or (oldest is not None and since < oldest - 1):
+            return None
+
+        query = {"seq": {"$gt": since, "$lte": current}, "kind": kind}
+        for name, value in filters.items():
+            if value:
+                query["tags.%s" % name] = value
+        changes = OrderedDict()
+        for entry in self.collection.find(query).sort("seq", ASCENDING):
+            # only last state of each row matters
+            changes.pop(entry["key"], None)
+            changes[entry["key"]] = entry["row"]
+        return str(current), changes
+
+
+def today():
+    return datetime.now().strftime("%Y%m%d")
+
+
+changelog = ChangeLog()
@@ -0,0 +1,260 @@
+"""
+Bulk export of all scheduled stoptimes of a day.
+
+Trips of the day are listed once (by line, routes without short name last),
+then stoptimes are queried trip by trip, joined with realtime information by
+batches of about EXPORT_BATCH_SIZE rows of consecutive trips of a line,
+flattened and encoded (ndjson, csv or parquet) batch after batch: memory is
+bounded by a batch, whatever the size of the day or of its lines.
+
+Predictions are read from prediction snapshots (trips active at export
+time), they are empty for other trips.
+"""
+
+import csv
+import io
+from collections import OrderedDict
+
+from lib.api_etl.querier_schedule import DBQuerier
+from lib.api_etl.querier_realtime import ResultsSet
+
+from project_api.snapshots import get_snapshot_store, stoptime_key
+from sncfweb.streaming import dumps
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = 1000
+# Trips of a day, and stoptimes of a trip, are queried with these limits: a
+# query reaching them would be truncated, which is raised as an error
+TRIPS_QUERY_LIMIT = 10 ** 6
+TRIP_QUERY_LIMIT = 10 ** 4
+
+SCHEDULE_COLUMNS = [
+    "trip_id", "route_short_name", "stop_sequence", "stop_id", "stop_name",
+    "arrival_time", "departure_time",
+]
+REALTIME_COLUMNS = [
+    "expected_passage_time", "data_freshness", "delay", "passed_realtime",
+]
+PREDICTION_COLUMNS = ["to_predict", "prediction"]
+
+FORMATS = OrderedDict([
+    ("ndjson", "application/x-ndjson"),
+    ("csv", "text/csv"),
+    ("parquet", "application/octet-stream"),
+])
+
+
+def export_columns(realtime=False, prediction=False):
+    columns = list(SCHEDULE_COLUMNS)
+    if realtime:
+        columns += REALTIME_COLUMNS
+    if prediction:
+        columns += PREDICTION_COLUMNS
+    return columns
+
+
+def _checked(rows, what, limit):
+    if len(rows) >= limit:
+        raise RuntimeError(
+            "%s reach query limit (%d rows), they would be truncated."
+            % (what, limit))
+    return rows
+
+
+def day_trips(querier, day):
+    """ Ids of trips of day by line, as OrderedDict line: sorted trip ids,
+    lines sorted, trips of routes without short name last with line None.
+    """
+    trips = _checked(querier.trips(
+        active_at_time=False, on_day=day, level=3, limit=TRIPS_QUERY_LIMIT,
+        on_route_short_name=None), "Trips of %s" % day, TRIPS_QUERY_LIMIT)
+    lines = {}
+    for row in trips:
+        line = getattr(getattr(row, "Route", None), "route_short_name", None)
+        lines.setdefault(line or None, set()).add(row.Trip.trip_id)
+    return OrderedDict(
+        (line, sorted(lines[line]))
+        for line in sorted(lines, key=lambda line: (line is None, line or "")))
+
+
+def iter_line_rows(querier, day):
+    """ Yields (line, rows) of all stoptimes of day, line by line, rows
+    being stoptimes of consecutive whole trips of line, about
+    EXPORT_BATCH_SIZE rows at a time.
+    """
+    for line, trip_ids in day_trips(querier, day).items():
+        rows = []
+        for trip_id in trip_ids:
+            rows.extend(_checked(querier.stoptimes(
+                trip_active_at_time=False, on_day=day, level=3,
+                limit=TRIP_QUERY_LIMIT, uic_filter=None,
+                trip_id_filter=trip_id, on_route_short_name=None),
+                "Stoptimes of trip %s" % trip_id, TRIP_QUERY_LIMIT))
+            if len(rows) >= EXPORT_BATCH_SIZE:
+                yield line, rows
+                rows = []
+        if rows:
+            yield line, rows
+
+
+def _attr(obj, name):
+    value = getattr(obj, name, None) if obj is not None else None
+    return None if value is None else str(value)
+
+
+def _predictions(trip_id):
+    store = get_snapshot_store()
+    snapshot = store.get(trip_id) if store else None
+    if not snapshot:
+        return {}
+    return {stoptime_key(prediction): prediction
+            for prediction in snapshot.predictions}
+
+
+def flatten(row, line, realtime=False, prediction=False, predictions=None):
+    """ Flat record of a stoptime result row.
+    """
+    record = OrderedDict([
+        ("trip_id", row.StopTime.trip_id),
+        ("route_short_name", line),
+        ("stop_sequence", _attr(row.StopTime, "stop_sequence")),
+        ("stop_id", _attr(row.StopTime, "stop_id")),
+        ("stop_name", _attr(getattr(row, "Stop", None), "stop_name")),
+        ("arrival_time", _attr(row.StopTime, "arrival_time")),
+        ("departure_time", _attr(row.StopTime, "departure_time")),
+    ])
+    if realtime:
+        rt = getattr(row, "RealTime", None)
+        state = getattr(row, "StopTimeState", None)
+        record["expected_passage_time"] = _attr(rt, "expected_passage_time")
+        record["data_freshness"] = _attr(rt, "data_freshness")
+        record["delay"] = _attr(state, "delay")
+        record["passed_realtime"] = _attr(state, "passed_realtime")
+    if prediction:
+        key = "%s:%s" % (record["trip_id"], record["stop_sequence"])
+        predicted = (predictions or {}).get(key, {})
+        record["to_predict"] = predicted.get("to_predict")
+        record["prediction"] = predicted.get("prediction")
+    return record
+
+
+def iter_row_batches(day, realtime=False):
+    """ Yields (line, rows) of stoptimes of day, line by line and by batches
+    of EXPORT_BATCH_SIZE, joined with realtime information if realtime.
+    """
+    for line, rows in iter_line_rows(DBQuerier(), day):
+        for start in range(0, len(rows), EXPORT_BATCH_SIZE):
+            batch = rows[start:start + EXPORT_BATCH_SIZE]
+            if realtime:
+                results_set = ResultsSet(batch, scheduled_day=day)
+                results_set.batch_realtime_query(scheduled_day=day)
+                results_set.compute_stoptimes_states()
+                batch = results_set.results
+            yield line, batch
+        # free rows before querying next trips
+        del rows
+
+
+def iter_record_batches(day, realtime=False, prediction=False):
+    """ Yields lists of flat records of stoptimes of day, line by line and
+    by batches of EXPORT_BATCH_SIZE.
+    """
+    current_line = None
+    for line, batch in iter_row_batches(day, realtime):
+        if line != current_line:
+            # predictions of previous line are not needed anymore
+            current_line = line
+            predictions = {}
+            predicted_trips = set()
+        if prediction:
+            for trip_id in {row.StopTime.trip_id for row in batch}:
+                if trip_id not in predicted_trips:
+                    predicted_trips.add(trip_id)
+                    predictions.update(_predictions(trip_id))
+        yield [flatten(row, line, realtime, prediction, predictions)
+               for row in batch]
+
+
+def encode_ndjson(batches, columns):
+    for records in batches:
+        if records:
+            yield b"\n".join(dumps(record) for record in records) + b"\n"
+
+
+def encode_csv(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for records in batches:
+        for record in records:
+            writer.writerow([record[column] for column in columns])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """ Write-only file collecting written bytes until they are taken.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def encode_parquet(batches, columns):
+    """ One parquet row group per batch.
+    """
+    schema = pyarrow.schema(
+        [pyarrow.field(column, pyarrow.string()) for column in columns])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for records in batches:
+        if not records:
+            continue
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array([record[column] for record in records],
+                           type=pyarrow.string())
+             for column in columns],
+            schema=schema)
+        writer.write_table(table)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+ENCODERS = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+    "parquet": encode_parquet,
+}
+
+
+def export_stoptimes(day, export_format, realtime=False, prediction=False):
+    """ Yields encoded chunks of export of stoptimes of day.
+    """
+    columns = export_columns(realtime, prediction)
+    batches = iter_record_batches(day, realtime, prediction)
+    return ENCODERS[export_format](batches, columns)
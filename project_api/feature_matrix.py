@@ -0,0 +1,195 @@
+"""
+Columnar feature builder.
+
+StopTimeFeatureVector computes features one stoptime at a time. This module
+computes the same kind of features for a whole set of stoptimes at once, as a
+typed pandas frame following a fixed schema (FEATURE_SCHEMA): per-trip and
+per-station aggregates are computed once with groupby operations, and
+broadcasted to all rows. Station delay means only use stoptimes observed
+before each row, so that a row's own delay never leaks into its features.
+
+Input is a "stoptimes frame", one row per stoptime, with columns listed in
+INPUT_COLUMNS. It can be obtained from ResultsSet results with
+`results_to_frame`, or read from any columnar source for offline training,
+so that training extracts and online prediction share the same feature path.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+INPUT_COLUMNS = [
+    "trip_id",
+    "station_id",
+    "stop_sequence",
+    "scheduled_seconds",
+    "observed_delay",
+    "passed_realtime",
+]
+
+FEATURE_SCHEMA = OrderedDict([
+    ("stop_sequence", np.int16),
+    ("scheduled_seconds", np.int32),
+    ("scheduled_hour", np.int8),
+    ("trip_nb_stops", np.int16),
+    ("trip_last_observed_sequence", np.int16),
+    ("trip_last_observed_delay", np.float32),
+    ("sequence_diff", np.int16),
+    ("scheduled_time_from_last_observed", np.float32),
+    ("station_nb_stoptimes", np.int32),
+    ("station_mean_observed_delay", np.float32),
+    ("passed_realtime", np.bool_),
+    ("to_predict", np.bool_),
+])
+
+# Integer features can't hold NaN: their missing values are filled with
+# INTEGER_FILL_VALUE, which is also a valid value of some of them (a
+# sequence_diff of -1), so each of them has a "<name>_missing" indicator.
+INTEGER_FILL_VALUE = -1
+INTEGER_FEATURES = [name for name, dtype in FEATURE_SCHEMA.items()
+                    if np.issubdtype(dtype, np.integer)]
+FEATURE_SCHEMA.update(
+    ("%s_missing" % name, np.bool_) for name in INTEGER_FEATURES)
+
+
+def gtfs_time_to_seconds(series):
+    """ Converts a series of "HH:MM:SS" strings (hours can exceed 24 in
+    GTFS) into seconds after midnight, NaN if not parsable.
+    """
+    parts = series.astype(str).str.split(":", expand=True)
+    if parts.shape[1] != 3:
+        return pd.Series(np.nan, index=series.index)
+    parts = parts.apply(pd.to_numeric, errors="coerce")
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def results_to_frame(results):
+    """ Extracts stoptimes frame from ResultsSet results (objects having
+    StopTime, Stop, and optionally StopTimeState attributes).
+
+    This is the only step reading python objects: it gathers raw columns in
+    one pass, all computations happen afterwards on columns.
+    """
+    columns = {
+        "trip_id": [], "station_id": [], "stop_sequence": [],
+        "departure_time": [], "observed_delay": [], "passed_realtime": [],
+    }
+    for result in results:
+        stoptime = result.StopTime
+        state = getattr(result, "StopTimeState", None)
+        columns["trip_id"].append(stoptime.trip_id)
+        columns["station_id"].append(result.Stop.stop_id)
+        columns["stop_sequence"].append(stoptime.stop_sequence)
+        columns["departure_time"].append(stoptime.departure_time)
+        columns["observed_delay"].append(
+            getattr(state, "delay", None) if state else None)
+        # states may hold "True"/"False" strings
+        columns["passed_realtime"].append(
+            str(getattr(state, "passed_realtime", None)) == "True")
+
+    frame = pd.DataFrame(columns)
+    frame["stop_sequence"] = pd.to_numeric(
+        frame["stop_sequence"], errors="coerce")
+    frame["scheduled_seconds"] = gtfs_time_to_seconds(frame["departure_time"])
+    frame["observed_delay"] = pd.to_numeric(
+        frame["observed_delay"], errors="coerce")
+    return frame[INPUT_COLUMNS]
+
+
+def _trip_aggregates(frame):
+    """ Per-trip aggregates, indexed by trip_id: number of stops, and last
+    stop observed in realtime (sequence, delay, scheduled time).
+    """
+    aggregates = pd.DataFrame(
+        {"trip_nb_stops": frame.groupby("trip_id").size()})
+
+    observed = frame[frame.passed_realtime & frame.observed_delay.notnull()]
+    if len(observed):
+        last_idx = observed.groupby("trip_id").stop_sequence.idxmax()
+        last = observed.loc[last_idx.values].set_index("trip_id")
+        aggregates["trip_last_observed_sequence"] = last.stop_sequence
+        aggregates["trip_last_observed_delay"] = last.observed_delay
+        aggregates["last_observed_scheduled_seconds"] = last.scheduled_seconds
+    else:
+        aggregates["trip_last_observed_sequence"] = np.nan
+        aggregates["trip_last_observed_delay"] = np.nan
+        aggregates["last_observed_scheduled_seconds"] = np.nan
+    return aggregates
+
+
+def _station_aggregates(frame):
+    """ Per-station aggregates, with same index as frame: number of
+    stoptimes of station, and mean delay of stoptimes of station observed in
+    realtime and scheduled strictly before the row (never the row itself,
+    nor stoptimes not passed yet when the row is predicted).
+    """
+    observed = frame.passed_realtime.fillna(False).astype(bool) & \
+        frame.observed_delay.notnull()
+    by_time = pd.DataFrame({
+        "station_id": frame.station_id,
+        "scheduled_seconds": frame.scheduled_seconds,
+        "delay_sum": frame.observed_delay.where(observed, 0.),
+        "count": observed.astype(np.int64),
+    }).groupby(["station_id", "scheduled_seconds"]).sum()
+    # cumulated over earlier scheduled times of same station
+    earlier = by_time.groupby(level=0).cumsum() - by_time
+    earlier = earlier.reindex(pd.MultiIndex.from_arrays(
+        [frame.station_id.values, frame.scheduled_seconds.values]))
+    count = earlier["count"].values
+    mean = earlier["delay_sum"].values / np.where(count > 0, count, np.nan)
+
+    sizes = frame.groupby("station_id").size()
+    return pd.DataFrame({
+        "station_nb_stoptimes": sizes.reindex(frame.station_id.values).values,
+        "station_mean_observed_delay": mean,
+    }, index=frame.index)
+
+
+def build_feature_matrix(frame):
+    """ Builds typed feature frame, following FEATURE_SCHEMA, from a
+    stoptimes frame. Result has same index as input frame.
+
+    Missing values are NaN for float features; for integer features they
+    are INTEGER_FILL_VALUE, flagged in "<name>_missing" columns.
+    """
+    trips = _trip_aggregates(frame).reindex(frame.trip_id.values)
+    trips.index = frame.index
+    stations = _station_aggregates(frame)
+
+    features = pd.DataFrame(index=frame.index)
+    features["stop_sequence"] = frame.stop_sequence
+    features["scheduled_seconds"] = frame.scheduled_seconds
+    features["scheduled_hour"] = (frame.scheduled_seconds // 3600) % 24
+    features["trip_nb_stops"] = trips.trip_nb_stops
+    features["trip_last_observed_sequence"] = \
+        trips.trip_last_observed_sequence
+    features["trip_last_observed_delay"] = trips.trip_last_observed_delay
+    features["sequence_diff"] = \
+        frame.stop_sequence - trips.trip_last_observed_sequence
+    features["scheduled_time_from_last_observed"] = \
+        frame.scheduled_seconds - trips.last_observed_scheduled_seconds
+    features["station_nb_stoptimes"] = stations.station_nb_stoptimes
+    features["station_mean_observed_delay"] = \
+        stations.station_mean_observed_delay
+    features["passed_realtime"] = frame.passed_realtime.fillna(False)
+    features["to_predict"] = (
+        ~features.passed_realtime &
+        trips.trip_last_observed_sequence.notnull().values
+    )
+
+    for name in INTEGER_FEATURES:
+        features["%s_missing" % name] = features[name].isnull()
+    for name, dtype in FEATURE_SCHEMA.items():
+        column = features[name]
+        if np.issubdtype(dtype, np.integer):
+            column = column.fillna(INTEGER_FILL_VALUE)
+        features[name] = column.astype(dtype)
+    return features[list(FEATURE_SCHEMA.keys())]
+
+
+def results_to_feature_matrix(results):
+    """ Shortcut from ResultsSet results to typed feature frame.
+    """
+    return build_feature_matrix(results_to_frame(results))
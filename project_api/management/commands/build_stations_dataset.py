@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from project_api.stations_dataset import (
+    build_stations_table, save_stations_table, STATIONS_CSV, STATIONS_TABLE
+)
+
+
+class Command(BaseCommand):
+    help = "Builds compact stations table from Transilien stations CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--csv", default=STATIONS_CSV)
+        parser.add_argument("--output", default=STATIONS_TABLE)
+
+    def handle(self, *args, **options):
+        table = build_stations_table(options["csv"])
+        save_stations_table(table, options["output"])
+        self.stdout.write(
+            "Saved %d stations (%d bytes) in %s."
+            % (len(table), table.nbytes, options["output"]))
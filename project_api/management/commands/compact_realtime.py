@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from project_api import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes realtime departures of a day (yesterday by default) in "
+        "columnar realtime archive.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--day", default=None, help="yyyymmdd")
+        parser.add_argument("--archive-dir", default=archive.ARCHIVE_DIR)
+
+    def handle(self, *args, **options):
+        if archive.pyarrow is None:
+            raise CommandError("Realtime archive needs pyarrow.")
+        day = options["day"] or \
+            (datetime.now() - timedelta(days=1)).strftime("%Y%m%d")
+        try:
+            datetime.strptime(day, "%Y%m%d")
+        except ValueError:
+            raise CommandError("day must be yyyymmdd.")
+        rows = archive.compact_day(day, options["archive_dir"])
+        self.stdout.write("Archived %d realtime departures of %s in %s." % (
+            rows, day, archive.day_path(day, options["archive_dir"])))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from project_api.snapshots import SnapshotRefresher, store
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes prediction snapshots of active trips every "
+        "PREDICTION_SNAPSHOT_INTERVAL seconds (run a single instance).")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Refresh once and exit.")
+
+    def handle(self, *args, **options):
+        interval = getattr(settings, "PREDICTION_SNAPSHOT_INTERVAL", None)
+        if not interval:
+            raise CommandError(
+                "Prediction snapshots are disabled "
+                "(PREDICTION_SNAPSHOT_INTERVAL).")
+        refresher = SnapshotRefresher(store, interval)
+        if options["once"]:
+            refresher.refresh()
+            self.stdout.write("Refreshed %d trips snapshots." % store.count())
+            return
+        try:
+            refresher.run()
+        except KeyboardInterrupt:
+            refresher.stop()
@@ -0,0 +1,168 @@
+"""
+Push of realtime updates to subscribed clients.
+
+Clients subscribe to a trip (trip_id) or a station (uic code) through the
+server-sent events endpoint of the ASGI application (sncfweb/asgi.py). A
+single fan-out loop computes realtime state once per watched key every
+REALTIME_PUSH_INTERVAL seconds, whatever the number of clients watching it,
+and broadcasts changed rows to them.
+
+Messages have the same shape as delta answers of the api (since=<version>):
+{"key", "version", "delta", "results", "deleted"}, a client first receiving
+the whole current state (delta false), then changes only.
+"""
+
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+
+from lib.api_etl.querier_schedule import DBQuerier
+from lib.api_etl.querier_realtime import ResultsSet
+
+from project_api.serializers import NestedSerializer
+from project_api.snapshots import (
+    get_snapshot_store, compute_trip_snapshot, stoptime_key, REALTIME_FIELDS
+)
+
+logger = logging.getLogger("django")
+
+TRIP = "trip"
+STATION = "station"
+
+
+def trip_rows(trip_id):
+    """ Predictions of trip, from snapshot store if present.
+    """
+    store = get_snapshot_store()
+    snapshot = store.get(trip_id) if store else None
+    if not snapshot:
+        snapshot = compute_trip_snapshot(trip_id)
+    return snapshot.predictions
+
+
+def station_rows(uic_code):
+    """ Stoptimes of trips active now passing at station, with realtime.
+    """
+    querier = DBQuerier()
+    result = querier.stoptimes(
+        trip_active_at_time=True, on_day=True, level=3, limit=10000,
+        uic_filter=uic_code, trip_id_filter=False, on_route_short_name=None)
+    results_set = ResultsSet(result)
+    results_set.batch_realtime_query()
+    results_set.compute_stoptimes_states()
+    return NestedSerializer(results_set.results, many=True).data
+
+
+COMPUTERS = {
+    TRIP: trip_rows,
+    STATION: station_rows,
+}
+
+
+def _state(row):
+    return json.dumps([row.get(field) for field in REALTIME_FIELDS],
+                      sort_keys=True)
+
+
+class KeyState:
+    """ Last computed rows of a watched key, and its subscribers queues.
+    """
+
+    def __init__(self):
+        self.rows = None
+        self.states = {}
+        self.version = 0
+        self.queues = set()
+
+    def update(self, rows):
+        """ Replaces rows, returns (changed rows, deleted keys).
+        """
+        rows = OrderedDict((stoptime_key(row), row) for row in rows)
+        states = {key: _state(row) for key, row in rows.items()}
+        changed = [row for key, row in rows.items()
+                   if self.states.get(key) != states[key]]
+        deleted = [key for key in self.states if key not in rows]
+        self.rows, self.states = rows, states
+        if changed or deleted:
+            self.version += 1
+        return changed, deleted
+
+
+class Broadcaster:
+    """ Subscriptions per key, and fan-out loop computing each watched key
+    once per cycle.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.keys = {}
+        self._task = None
+
+    def subscribe(self, kind, value):
+        """ Returns queue receiving messages of (kind, value) key.
+        """
+        key = (kind, value)
+        key_state = self.keys.setdefault(key, KeyState())
+        queue = asyncio.Queue()
+        key_state.queues.add(queue)
+        if key_state.rows is not None:
+            queue.put_nowait(self._message(
+                key, key_state, list(key_state.rows.values()), [], False))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+        else:
+            # first subscriber of a key shouldn't wait for next cycle
+            asyncio.ensure_future(self.refresh(key))
+        return queue
+
+    def unsubscribe(self, kind, value, queue):
+        key = (kind, value)
+        key_state = self.keys.get(key)
+        if key_state is None:
+            return
+        key_state.queues.discard(queue)
+        if not key_state.queues:
+            del self.keys[key]
+
+    @staticmethod
+    def _message(key, key_state, results, deleted, delta):
+        return {
+            "key": "%s:%s" % key,
+            "version": key_state.version,
+            "delta": delta,
+            "results": results,
+            "deleted": deleted,
+        }
+
+    async def refresh(self, key):
+        kind, value = key
+        loop = asyncio.get_event_loop()
+        try:
+            rows = await loop.run_in_executor(None, COMPUTERS[kind], value)
+        except Exception as e:
+            logger.warning("Push refresh failed for %s %s: %s"
+                           % (kind, value, e))
+            return
+        key_state = self.keys.get(key)
+        if key_state is None:
+            return
+        first = key_state.rows is None
+        changed, deleted = key_state.update(rows)
+        if not (first or changed or deleted):
+            return
+        message = self._message(key, key_state, changed, deleted, not first)
+        for queue in key_state.queues:
+            queue.put_nowait(message)
+
+    async def run(self):
+        """ Fan-out loop, stopping when no key is watched anymore.
+        """
+        while self.keys:
+            await asyncio.gather(*[self.refresh(key) for key in list(self.keys)])
+            await asyncio.sleep(self.interval)
+
+
+broadcaster = Broadcaster(getattr(settings, "REALTIME_PUSH_INTERVAL", 15))
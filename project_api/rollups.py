@@ -0,0 +1,314 @@
+"""
+Delay analytics rollups.
+
+Delay observations (one per stop of a delayed or canceled trip) are rolled
+up at ingestion time, per day and hour, by line and by station, in Mongo
+delay_rollups documents: observations count, delays sum, max, cancellations
+count, and a histogram of delays by minute (for percentiles). Stats api
+views then read at most 24 documents per line or station.
+
+Observations come from:
+- ingested disruptions (change feed, maps/changes.py): impacted stops delays
+  and canceled stops; disruptions carry no line, so they feed station
+  rollups only;
+- realtime departures of active trips (prediction snapshots refresher):
+  delay of each stop passed in realtime.
+
+Observations of each source (disruption, or trip stop) are kept a day in
+delay_observations, so that an updated source replaces its previous
+contribution instead of being counted twice. Max delays can't be
+retracted: they are max of all observed delays.
+
+Several processes may record the same changes (every worker listens to
+disruptions changes): observations documents carry a hash of their
+content, and are only replaced if they still have the hash that was read.
+Only the process whose replacement succeeded rolls up the difference.
+
+The disruptions changes listener is registered when this module is imported
+(by api views and prediction snapshots).
+"""
+
+import hashlib
+import json
+import logging
+import re
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from maps.changes import on_disruption_changes
+from maps.utils import get_collection, navitia_delay_minutes
+from project_api.changelog import STOPTIME
+
+logger = logging.getLogger("django")
+
+# Indexes (and TTL of observations) are in maps/indexes.py
+ROLLUPS_COLLECTION = "delay_rollups"
+OBSERVATIONS_COLLECTION = "delay_observations"
+
+LINE = "line"
+STATION = "station"
+DIMENSIONS = (LINE, STATION)
+
+# Histogram buckets are delay minutes, from 0 (early or on time) to
+# HISTOGRAM_MAX_MINUTES (and more)
+HISTOGRAM_MAX_MINUTES = 120
+
+
+def uic_code(stop_id):
+    """ UIC7 code of a GTFS or SNCF api stop id ("StopPoint:DUA8727103",
+    "stop_point:OCE:SP:Train-87271031"), or None.
+    """
+    match = re.search(r"(\d{7,8})$", stop_id or "")
+    return match.group(1)[:7] if match else None
+
+
+def observation(day, hour, line=None, station=None, delay=None,
+                canceled=False):
+    return {"day": day, "hour": int(hour) % 24, "line": line,
+            "station": station, "delay": delay, "canceled": canceled}
+
+
+def disruption_observations(disruption):
+    """ One observation per impacted stop of disruption.
+    """
+    impacted_object = disruption["impacted_objects"][0]
+    trip_canceled = disruption["severity"]["name"] == "trip canceled"
+    try:
+        day = disruption["application_periods"][0]["begin"][:8]
+    except (KeyError, IndexError):
+        day = datetime.now().strftime("%Y%m%d")
+    observations = []
+    for stop in impacted_object.get("impacted_stops", []):
+        base_time = stop.get("base_arrival_time") or \
+            stop.get("base_departure_time")
+        if not base_time:
+            continue
+        canceled = trip_canceled or stop.get("stop_time_effect") == "deleted"
+        delay = None
+        if not canceled and stop.get("amended_arrival_time"):
+            delay = navitia_delay_minutes(
+                stop["amended_arrival_time"], stop["base_arrival_time"])
+        station = uic_code(stop.get("stop_point", {}).get("id"))
+        observations.append(observation(
+            day, base_time[:2], station=station, delay=delay,
+            canceled=canceled))
+    return observations
+
+
+def stoptime_observation(day, prediction, line):
+    """ Observation of a stoptime prediction row passed in realtime, else
+    None.
+    """
+    state = prediction.get("StopTimeState") or {}
+    if str(state.get("passed_realtime")) != "True" or \
+            state.get("delay") in (None, ""):
+        return None
+    stoptime = prediction["StopTime"]
+    return observation(
+        day, stoptime["departure_time"][:2], line=line,
+        station=uic_code(stoptime.get("stop_id")),
+        delay=float(state["delay"]) / 60.)
+
+
+def rollup_id(day, dimension, key, hour):
+    return "%s:%s:%s:%02d" % (day, dimension, key, hour)
+
+
+def _add_increments(updates, observations, sign):
+    """ Adds to updates (rollup id -> update document) increments of
+    observations, with sign 1 or -1.
+    """
+    for obs in observations:
+        for dimension in DIMENSIONS:
+            key = obs.get(dimension)
+            if key is None:
+                continue
+            _id = rollup_id(obs["day"], dimension, key, obs["hour"])
+            update = updates.setdefault(_id, {
+                "$setOnInsert": {"day": obs["day"], "dimension": dimension,
+                                 "key": key, "hour": obs["hour"]},
+                "$inc": {},
+            })
+            inc = update["$inc"]
+            if obs["canceled"]:
+                inc["canceled"] = inc.get("canceled", 0) + sign
+            if obs["delay"] is None:
+                continue
+            bucket = "histogram.%d" % min(
+                HISTOGRAM_MAX_MINUTES, max(0, int(obs["delay"])))
+            inc["count"] = inc.get("count", 0) + sign
+            inc["delay_sum"] = inc.get("delay_sum", 0.) + sign * obs["delay"]
+            inc[bucket] = inc.get(bucket, 0) + sign
+            if sign > 0:
+                update.setdefault("$max", {})
+                update["$max"]["max_delay"] = max(
+                    update["$max"].get("max_delay", obs["delay"]),
+                    obs["delay"])
+
+
+def observations_hash(observations):
+    return hashlib.md5(json.dumps(
+        observations, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def claim_sources(collection, sources, previous, now):
+    """
+    Replaces observations documents of sources whose observations changed,
+    only if they still have the hash that was read (missing documents are
+    inserted, unless inserted meanwhile). Returns sources replaced by this
+    call.
+    """
+    operations = []
+    claimed = []
+    for source, observations in sources.items():
+        content_hash = observations_hash(observations)
+        previous_hash = previous.get(source, {}).get("hash")
+        if content_hash == previous_hash:
+            continue
+        # a mismatching hash makes the upsert insert a duplicate _id, which
+        # fails
+        operations.append(UpdateOne(
+            {"_id": source, "hash": previous_hash},
+            {"$set": {"observations": observations, "hash": content_hash,
+                      "updated_at": now}},
+            upsert=True))
+        claimed.append(source)
+    if not operations:
+        return []
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        failed = {error["index"] for error in e.details["writeErrors"]}
+        if any(error.get("code") != 11000
+               for error in e.details["writeErrors"]):
+            logger.warning("Delay observations update failed: %s" % e)
+        claimed = [source for index, source in enumerate(claimed)
+                   if index not in failed]
+    return claimed
+
+
+def record_observations(sources, now=None):
+    """
+    Rolls up observations of sources (source key -> list of observations),
+    replacing previous observations of same sources. Sources updated
+    concurrently by another process are left to it. Returns number of
+    rollups updated.
+    """
+    if not sources:
+        return 0
+    now = now or datetime.utcnow()
+    observations_collection = get_collection(OBSERVATIONS_COLLECTION)
+    previous = {
+        document["_id"]: document
+        for document in observations_collection.find(
+            {"_id": {"$in": list(sources)}})
+    }
+    claimed = claim_sources(observations_collection, sources, previous, now)
+    updates = OrderedDict()
+    for source in claimed:
+        if source in previous:
+            _add_increments(updates, previous[source]["observations"], -1)
+        _add_increments(updates, sources[source], 1)
+
+    operations = []
+    for _id, update in updates.items():
+        update["$inc"] = {field: value for field, value
+                          in update["$inc"].items() if value}
+        if not update["$inc"]:
+            del update["$inc"]
+        if len(update) > 1:
+            operations.append(UpdateOne({"_id": _id}, update, upsert=True))
+    if operations:
+        get_collection(ROLLUPS_COLLECTION).bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+@on_disruption_changes
+def record_disruptions_changes(changes):
+    """ Rolls up observations of new and updated disruptions.
+    """
+    ids = changes.new + changes.updated
+    if not ids:
+        return
+    collection = get_collection("disruptions")
+    sources = {
+        "disruption:%s" % disruption["disruption_id"]:
+            disruption_observations(disruption)
+        for disruption in collection.find({"disruption_id": {"$in": ids}})
+    }
+    record_observations(sources)
+
+
+def record_realtime_changes(day, changes):
+    """ Rolls up stoptimes of change log entries (from prediction snapshots)
+    passed in realtime.
+    """
+    sources = {}
+    for kind, key, value, tags in changes:
+        if kind != STOPTIME or value is None:
+            continue
+        obs = stoptime_observation(day, value, tags.get("route"))
+        if obs is not None:
+            sources["stoptime:%s:%s" % (day, key)] = [obs]
+    return record_observations(sources)
+
+
+def percentile(histogram, count, q):
+    """ Minute bucket of q-th percentile (0 < q <= 1) of histogram.
+    """
+    if count <= 0:
+        return None
+    threshold = q * count
+    cumulated = 0
+    for bucket in sorted(histogram, key=int):
+        cumulated += histogram[bucket]
+        if cumulated >= threshold:
+            return int(bucket)
+    return HISTOGRAM_MAX_MINUTES
+
+
+def _stats(documents):
+    count = sum(document.get("count", 0) for document in documents)
+    delay_sum = sum(document.get("delay_sum", 0.) for document in documents)
+    histogram = {}
+    for document in documents:
+        for bucket, value in document.get("histogram", {}).items():
+            histogram[bucket] = histogram.get(bucket, 0) + value
+    max_delays = [document["max_delay"] for document in documents
+                  if document.get("max_delay") is not None]
+    return OrderedDict([
+        ("count", count),
+        ("mean_delay", round(delay_sum / count, 2) if count else None),
+        ("p95_delay", percentile(histogram, count, 0.95)),
+        ("max_delay", round(max(max_delays), 2) if max_delays else None),
+        ("canceled", sum(document.get("canceled", 0)
+                         for document in documents)),
+    ])
+
+
+def rollup_stats(dimension, day, key=None, by_hour=False):
+    """
+    Stats of day by key of dimension (line or station), as list of
+    dictionaries, optionally by hour.
+    """
+    query = {"day": day, "dimension": dimension}
+    if key is not None:
+        query["key"] = key
+    groups = OrderedDict()
+    for document in get_collection(ROLLUPS_COLLECTION).find(query).sort(
+            [("key", 1), ("hour", 1)]):
+        group = (document["key"], document["hour"]) if by_hour \
+            else (document["key"],)
+        groups.setdefault(group, []).append(document)
+
+    results = []
+    for group, documents in groups.items():
+        result = OrderedDict([(dimension, group[0])])
+        if by_hour:
+            result["hour"] = group[1]
+        result.update(_stats(documents))
+        results.append(result)
+    return results
@@ -19,6 +19,7 @@ from lib.api_etl.data_models import (
 from lib.api_etl.querier_realtime import StopTimeState
 from lib.api_etl.feature_vector import StopTimeFeatureVector
 
+
 def ModelToSerializerFactory(class_name, ExtractedClass):
     """ Transforms a model class in a corresponding Serializer class
     """
@@ -35,6 +36,7 @@ def ModelToSerializerFactory(class_name, ExtractedClass):
     newclass = type(class_name, (BaseClass,), class_body)
     return newclass
 
+
 # Declaring my new serializers
 # Calendar, CalendarDate, Trip, StopTime, Stop, Agency, Route, RealTimeDeparture
 
@@ -51,6 +53,36 @@ StopTimeStateSerializer = ModelToSerializerFactory("StopTimeStateSerializer", St
 StopTimeFeatureVectorSerializer = ModelToSerializerFactory("StopTimeFeatureVectorSerializer", StopTimeFeatureVector)
 
 
+class StationSerializer(serializers.Serializer):
+    """ Station from stations dataset (Transilien stations CSV).
+    """
+    uic8 = serializers.CharField(max_length=8)
+    uic7 = serializers.CharField(max_length=7)
+    label = serializers.CharField(max_length=300)
+    stop_label = serializers.CharField(max_length=300)
+    stif_label = serializers.CharField(max_length=300)
+    sms_label = serializers.CharField(max_length=300)
+    station_name = serializers.CharField(max_length=300)
+    address = serializers.CharField(max_length=300)
+    insee_code = serializers.CharField(max_length=5)
+    city = serializers.CharField(max_length=300)
+    lat = serializers.FloatField()
+    lon = serializers.FloatField()
+    x_lambert = serializers.FloatField()
+    y_lambert = serializers.FloatField()
+    zone = serializers.IntegerField(allow_null=True)
+    non_sncf = serializers.BooleanField()
+
+
+class StationSearchSerializer(serializers.Serializer):
+    uic8 = serializers.CharField(max_length=8)
+    uic7 = serializers.CharField(max_length=7)
+    label = serializers.CharField(max_length=300)
+    station_name = serializers.CharField(max_length=300)
+    city = serializers.CharField(max_length=300)
+    score = serializers.FloatField()
+
+
 class NestedSerializer(serializers.Serializer):
     Calendar = CalendarSerializer(required=False)
     CalendarDate = CalendarDateSerializer(required=False)
@@ -75,4 +107,4 @@ class StopTimePredictorSerializer(serializers.Serializer):
     scheduled_day = serializers.CharField(max_length=300, required=False)
     next_stop_passed_realtime = serializers.CharField(max_length=300, required=False)
     to_predict = serializers.CharField(max_length=300, required=False)
-    prediction = serializers.CharField(max_length=300, required=False)
\ No newline at end of file
+    prediction = serializers.CharField(max_length=300, required=False)
@@ -0,0 +1,306 @@
+"""
+Precomputed trip predictions.
+
+Predictions only change when new realtime data arrives, so instead of
+running TripPredictor inline for each api call, a single refresher process
+recomputes predictions for all currently active trips every
+PREDICTION_SNAPSHOT_INTERVAL seconds, and stores their serialized form in
+the prediction_snapshots Mongo collection, keyed by trip_id:
+```
+python manage.py refresh_snapshots
+```
+Api views (in every worker) only read this store, by trip_id, along with the
+snapshot age; they never compute snapshots in background themselves.
+
+Each refresh also feeds the change log (project_api/changelog.py) with trips
+and stoptimes whose realtime state or prediction changed, and delay rollups
+(project_api/rollups.py) with changed stoptimes passed in realtime.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from pymongo import ReplaceOne
+
+from lib.api_etl.querier_schedule import DBQuerier
+from lib.api_etl.builder_feature_vector import TripPredictor
+
+from project_api.serializers import (
+    NestedSerializer, StopTimePredictorSerializer
+)
+from maps.utils import get_collection
+from project_api.changelog import changelog, today, TRIP, STOPTIME
+from project_api.rollups import record_realtime_changes
+
+logger = logging.getLogger("django")
+
+SNAPSHOTS_COLLECTION = "prediction_snapshots"
+# _id of the document describing last refresh (time, version), stored along
+# trips snapshots
+REFRESH_ID = "_refresh"
+
+
+class PredictionSnapshot:
+    """ Serialized predictions of one trip, computed at a given time.
+    """
+    __slots__ = ("trip_id", "computed_at", "predictions", "trip")
+
+    def __init__(self, trip_id, computed_at, predictions, trip=None):
+        self.trip_id = trip_id
+        self.computed_at = computed_at
+        self.predictions = predictions
+        # serialized trip row (Trip and Route), as in /api/trips/
+        self.trip = trip
+
+    def age(self, now=None):
+        """ Age of snapshot in seconds.
+        """
+        return (now or time.time()) - self.computed_at
+
+    def to_document(self):
+        return {"_id": self.trip_id, "computed_at": self.computed_at,
+                "predictions": self.predictions, "trip": self.trip}
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(document["_id"], document["computed_at"],
+                   document["predictions"], trip=document.get("trip"))
+
+
+class PredictionSnapshotStore:
+    """ Keyed store of trip predictions snapshots, shared by all processes
+    through Mongo.
+
+    Trips snapshots are written first, then the refresh document (time and
+    version): a version is only published once its snapshots are stored.
+    Readers may see snapshots of a refresh in progress, which are only
+    newer.
+    """
+
+    def __init__(self, collection_name=SNAPSHOTS_COLLECTION):
+        self.collection_name = collection_name
+
+    @property
+    def collection(self):
+        return get_collection(self.collection_name)
+
+    def _refresh(self):
+        return self.collection.find_one({"_id": REFRESH_ID}) or {}
+
+    @property
+    def refreshed_at(self):
+        return self._refresh().get("refreshed_at")
+
+    @property
+    def version(self):
+        """ Digest of realtime content, None until first refresh.
+        """
+        return self._refresh().get("version")
+
+    def get(self, trip_id):
+        if trip_id == REFRESH_ID:
+            return None
+        document = self.collection.find_one({"_id": trip_id})
+        if document is None:
+            return None
+        return PredictionSnapshot.from_document(document)
+
+    def replace(self, snapshots, refreshed_at):
+        """ Stores snapshots, and removes snapshots of trips not active
+        anymore. Called by the refresher only.
+        """
+        operations = [
+            ReplaceOne({"_id": trip_id}, snapshot.to_document(), upsert=True)
+            for trip_id, snapshot in snapshots.items()]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        self.collection.delete_many(
+            {"_id": {"$nin": list(snapshots.keys()) + [REFRESH_ID]}})
+        self.collection.replace_one(
+            {"_id": REFRESH_ID},
+            {"_id": REFRESH_ID, "refreshed_at": refreshed_at,
+             "version": snapshots_version(snapshots)},
+            upsert=True)
+
+    def trip_ids(self):
+        return [document["_id"] for document in self.collection.find(
+            {"_id": {"$ne": REFRESH_ID}}, {"_id": 1})]
+
+    def snapshots(self):
+        return {document["_id"]: PredictionSnapshot.from_document(document)
+                for document in self.collection.find(
+                    {"_id": {"$ne": REFRESH_ID}})}
+
+    def count(self):
+        return self.collection.count_documents({"_id": {"$ne": REFRESH_ID}})
+
+
+def active_trips():
+    """ Returns trips active now, as serialized rows (Trip and Route), by
+    trip_id.
+    """
+    querier = DBQuerier()
+    trips = querier.trips(
+        active_at_time=True, on_day=True, level=3, limit=10000)
+    return {row["Trip"]["trip_id"]: row
+            for row in NestedSerializer(trips, many=True).data}
+
+
+def compute_trip_snapshot(trip_id, trip=None):
+    """ Runs TripPredictor on one trip and serializes its predictions.
+    """
+    trip_predictor = TripPredictor(trip_id=trip_id)
+    predictors = list(trip_predictor._stoptime_predictors.values())
+    predictions = StopTimePredictorSerializer(predictors, many=True).data
+    return PredictionSnapshot(trip_id, time.time(), predictions, trip=trip)
+
+
+# Fields of prediction rows holding realtime state and prediction
+REALTIME_FIELDS = ("RealTime", "StopTimeState", "to_predict", "prediction")
+
+
+def stoptime_key(prediction):
+    return "%s:%s" % (prediction["StopTime"]["trip_id"],
+                      prediction["StopTime"]["stop_sequence"])
+
+
+# Fields of stoptimes rows of full /api/stoptimes/ answers
+NESTED_FIELDS = list(NestedSerializer().fields.keys())
+STOPTIME_FIELDS = ("StopTime", "Stop", "RealTime", "StopTimeState")
+
+
+def nested_stoptime_row(prediction, trip=None):
+    """ Stoptime row shaped as in full /api/stoptimes/ answers
+    (NestedSerializer): trip fields (Trip, Route...) of serialized trip row,
+    and stoptime fields of prediction row.
+    """
+    fields = {name: value for name, value in (trip or {}).items()
+              if name not in STOPTIME_FIELDS}
+    fields.update((name, prediction[name]) for name in STOPTIME_FIELDS
+                  if prediction.get(name) is not None)
+    return OrderedDict((name, fields[name]) for name in NESTED_FIELDS
+                       if name in fields)
+
+
+def _realtime_state(prediction):
+    return json.dumps([prediction.get(field) for field in REALTIME_FIELDS],
+                      sort_keys=True)
+
+
+def snapshots_version(snapshots):
+    """ Digest of active trips and of realtime state of their stoptimes:
+    same content gives same version, in every process.
+    """
+    digest = hashlib.md5()
+    for trip_id in sorted(snapshots):
+        digest.update(trip_id.encode("utf-8"))
+        for prediction in snapshots[trip_id].predictions:
+            digest.update(_realtime_state(prediction).encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def snapshots_changes(old, new):
+    """ Changes between two snapshots dictionaries, as change log entries:
+    stoptimes whose realtime state changed (rows shaped as in
+    /api/stoptimes/), trips having such stoptimes or newly active, and
+    deletions of trips not active anymore.
+    """
+    changes = []
+    for trip_id, snapshot in new.items():
+        route = ((snapshot.trip or {}).get("Route") or {})\
+            .get("route_short_name")
+        tags = {"trip_id": trip_id, "route": route}
+        previous = old.get(trip_id)
+        previous_states = {}
+        if previous:
+            previous_states = {
+                stoptime_key(prediction): _realtime_state(prediction)
+                for prediction in previous.predictions}
+        changed = previous is None
+        for prediction in snapshot.predictions:
+            key = stoptime_key(prediction)
+            if previous_states.get(key) != _realtime_state(prediction):
+                changes.append((STOPTIME, key, nested_stoptime_row(
+                    prediction, snapshot.trip), tags))
+                changed = True
+        if changed and snapshot.trip:
+            changes.append((TRIP, trip_id, snapshot.trip, tags))
+
+    for trip_id, snapshot in old.items():
+        if trip_id in new:
+            continue
+        route = ((snapshot.trip or {}).get("Route") or {})\
+            .get("route_short_name")
+        tags = {"trip_id": trip_id, "route": route}
+        changes.append((TRIP, trip_id, None, tags))
+        for prediction in snapshot.predictions:
+            changes.append((STOPTIME, stoptime_key(prediction), None, tags))
+    return changes
+
+
+class SnapshotRefresher:
+    """ Refreshes the snapshot store every interval. Only one refresher must
+    run (`manage.py refresh_snapshots`): it is the single writer of the
+    store, of the change log, and of realtime delay rollups.
+    """
+
+    def __init__(self, store, interval):
+        self.store = store
+        self.interval = interval
+        self._stop_event = threading.Event()
+        # last stored snapshots, to compute changes of next refresh
+        self._snapshots = None
+
+    def refresh(self):
+        started_at = time.time()
+        if self._snapshots is None:
+            self._snapshots = self.store.snapshots()
+        snapshots = {}
+        for trip_id, trip in active_trips().items():
+            try:
+                snapshots[trip_id] = compute_trip_snapshot(trip_id, trip)
+            except Exception as e:
+                logger.warning(
+                    "Prediction snapshot failed for trip %s: %s" % (trip_id, e))
+        changes = snapshots_changes(self._snapshots, snapshots)
+        self.store.replace(snapshots, refreshed_at=started_at)
+        self._snapshots = snapshots
+        changelog.record(today(), changes)
+        try:
+            record_realtime_changes(today(), changes)
+        except Exception as e:
+            logger.warning("Delay rollups update failed: %s" % e)
+        logger.info(
+            "Prediction snapshots refreshed for %d trips in %.1f seconds."
+            % (len(snapshots), time.time() - started_at))
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error("Prediction snapshots refresh failed: %s" % e)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+store = PredictionSnapshotStore()
+
+
+def get_snapshot_store():
+    """ Returns snapshot store, filled by `manage.py refresh_snapshots`.
+
+    Returns None if snapshots are disabled (PREDICTION_SNAPSHOT_INTERVAL set
+    to None), in which case predictions must be computed inline. Trips
+    missing from store (refresher not running yet) are computed inline too.
+    """
+    if not getattr(settings, "PREDICTION_SNAPSHOT_INTERVAL", None):
+        return None
+    return store
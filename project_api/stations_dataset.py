@@ -0,0 +1,259 @@
+"""
+Compact station table, built from Transilien stations CSV.
+
+The CSV (data/sncf-gares-et-arrets-transilien-ile-de-france.csv) is the
+reference for Île-de-France stations. `build_stations_table` turns it into a
+numpy structured array (typed columns for codes, coordinates and zone, fixed
+size utf-8 bytes for labels), saved as .npy so that it can be loaded with
+mmap at startup.
+
+StationsDataset then adds hash indexes on UIC7 and UIC8 codes, and prefix
+and trigram indexes on normalized names, used for station search.
+"""
+
+import bisect
+import itertools
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger("django")
+
+STATIONS_CSV = os.path.join(
+    settings.BASE_DIR, "data", "sncf-gares-et-arrets-transilien-ile-de-france.csv")
+STATIONS_TABLE = os.path.join(settings.BASE_DIR, "data", "stations.npy")
+
+# column name in table -> column name in CSV
+LABEL_COLUMNS = [
+    ("stop_label", "Libelle point d'arret"),
+    ("label", "Libelle"),
+    ("stif_label", "Libelle STIF (info voyageurs)"),
+    ("sms_label", "Libelle SMS gare"),
+    ("station_name", "Nom Gare"),
+    ("address", "Adresse"),
+    ("insee_code", "Code INSEE commune"),
+    ("city", "Commune"),
+]
+
+# labels used for name search
+NAME_COLUMNS = ["label", "stif_label", "station_name", "city"]
+
+NO_ZONE = -1
+
+
+def normalize_name(name):
+    """ Lowercase, accents stripped, non alphanumeric characters replaced by
+    single spaces: "Gare de l'Est" -> "gare de l est".
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", name.lower()).strip()
+
+
+def trigrams(name):
+    """ Set of trigrams of normalized name, padded with spaces so that
+    words beginnings weigh more: "gagny" -> {"  g", " ga", "gag", ...}.
+    """
+    padded = "  %s " % name
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _bytes_length(series):
+    return max(1, series.map(lambda x: len(x.encode("utf-8"))).max())
+
+
+def build_stations_table(csv_path=STATIONS_CSV):
+    """ Reads stations CSV and returns numpy structured array.
+    """
+    df = pd.read_csv(csv_path, sep=";", dtype=str).fillna("")
+    coords = df["Coord GPS (WGS84)"].str.split(",", expand=True)
+
+    dtype = [
+        ("uic8", np.int32),
+        ("uic7", np.int32),
+        ("lat", np.float32),
+        ("lon", np.float32),
+        ("x_lambert", np.float32),
+        ("y_lambert", np.float32),
+        ("zone", np.int8),
+        ("non_sncf", np.bool_),
+    ]
+    for name, column in LABEL_COLUMNS:
+        dtype.append((name, "S%d" % _bytes_length(df[column])))
+
+    table = np.zeros(len(df), dtype=dtype)
+    table["uic8"] = df["Code UIC"].astype(int)
+    table["uic7"] = df["uic7"].astype(int)
+    table["lat"] = pd.to_numeric(coords[0], errors="coerce")
+    table["lon"] = pd.to_numeric(coords[1], errors="coerce")
+    table["x_lambert"] = pd.to_numeric(
+        df["X (Lambert II etendu)"], errors="coerce")
+    table["y_lambert"] = pd.to_numeric(
+        df["Y (Lambert II etendu)"], errors="coerce")
+    table["zone"] = pd.to_numeric(df["Zone Navigo"], errors="coerce")\
+        .fillna(NO_ZONE).astype(int)
+    table["non_sncf"] = pd.to_numeric(
+        df["Gare non SNCF"], errors="coerce").fillna(0).astype(bool)
+    for name, column in LABEL_COLUMNS:
+        table[name] = df[column].map(lambda x: x.encode("utf-8"))
+    return table
+
+
+def save_stations_table(table, path=STATIONS_TABLE):
+    np.save(path, table, allow_pickle=False)
+
+
+def load_stations_table(path=STATIONS_TABLE):
+    """ Loads table with mmap if it was built, else builds it from CSV.
+    """
+    if os.path.exists(path):
+        return np.load(path, mmap_mode="r", allow_pickle=False)
+    logger.warning(
+        "%s not found, building stations table from CSV: run "
+        "'manage.py build_stations_dataset' to build it once." % path)
+    return build_stations_table()
+
+
+class StationsDataset:
+    """ Stations table, with indexes on UIC codes and names.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.uic8_index = {int(uic): row for row, uic in
+                           enumerate(table["uic8"])}
+        self.uic7_index = {int(uic): row for row, uic in
+                           enumerate(table["uic7"])}
+
+        # sorted list of (normalized name, row), for prefix search
+        names = set()
+        for column in NAME_COLUMNS:
+            for row, name in enumerate(table[column]):
+                name = normalize_name(name.decode("utf-8"))
+                if name:
+                    names.add((name, row))
+        self.names = sorted(names)
+        self.names_keys = [name for name, _ in self.names]
+
+        # trigram -> set of indexes in self.names
+        self.trigrams_index = {}
+        self.names_trigrams_count = []
+        for i, (name, _) in enumerate(self.names):
+            name_trigrams = trigrams(name)
+            self.names_trigrams_count.append(len(name_trigrams))
+            for trigram in name_trigrams:
+                self.trigrams_index.setdefault(trigram, set()).add(i)
+
+    def __len__(self):
+        return len(self.table)
+
+    def row(self, uic_code):
+        """ Returns row number of station from 7 or 8 digits UIC code, or
+        None if unknown.
+        """
+        try:
+            code = int(uic_code)
+        except (TypeError, ValueError):
+            return None
+        if len(str(uic_code)) == 8:
+            return self.uic8_index.get(code)
+        if len(str(uic_code)) == 7:
+            return self.uic7_index.get(code)
+        return None
+
+    def is_known(self, uic_code):
+        return self.row(uic_code) is not None
+
+    def record(self, row):
+        """ Station as dictionary.
+        """
+        entry = self.table[row]
+        record = {
+            "uic8": str(entry["uic8"]),
+            "uic7": str(entry["uic7"]),
+            "lat": float(entry["lat"]),
+            "lon": float(entry["lon"]),
+            "x_lambert": float(entry["x_lambert"]),
+            "y_lambert": float(entry["y_lambert"]),
+            "zone": int(entry["zone"]) if entry["zone"] != NO_ZONE else None,
+            "non_sncf": bool(entry["non_sncf"]),
+        }
+        for name, _ in LABEL_COLUMNS:
+            record[name] = entry[name].decode("utf-8")
+        return record
+
+    def get(self, uic_code):
+        row = self.row(uic_code)
+        return self.record(row) if row is not None else None
+
+    def prefix_rows(self, prefix, limit=None):
+        """ Rows of stations having a name starting with prefix, in name
+        order, without duplicates.
+        """
+        prefix = normalize_name(prefix)
+        rows = []
+        if not prefix:
+            return rows
+        seen = set()
+        start = bisect.bisect_left(self.names_keys, prefix)
+        for name, row in itertools.islice(self.names, start, None):
+            if not name.startswith(prefix):
+                break
+            if row not in seen:
+                seen.add(row)
+                rows.append(row)
+                if limit and len(rows) >= limit:
+                    break
+        return rows
+
+    def search(self, query, limit=10, min_similarity=0.3):
+        """ Returns list of (row, score) of stations best matching query,
+        best first.
+
+        Names starting with query score 1. Other names are scored with
+        trigram similarity (Jaccard index) to query, to tolerate typos.
+        """
+        query = normalize_name(query)
+        if not query:
+            return []
+        scores = {}
+        for row in self.prefix_rows(query, limit=limit):
+            scores[row] = 1.
+
+        if len(scores) < limit:
+            query_trigrams = trigrams(query)
+            shared_counts = {}
+            for trigram in query_trigrams:
+                for i in self.trigrams_index.get(trigram, ()):
+                    shared_counts[i] = shared_counts.get(i, 0) + 1
+            for i, shared in shared_counts.items():
+                similarity = shared / float(
+                    len(query_trigrams) + self.names_trigrams_count[i] - shared)
+                row = self.names[i][1]
+                if similarity >= min_similarity and \
+                        similarity > scores.get(row, 0):
+                    scores[row] = similarity
+
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        return ranked[:limit]
+
+
+_dataset = None
+_dataset_lock = threading.Lock()
+
+
+def get_stations_dataset():
+    """ Returns stations dataset, loaded on first call.
+    """
+    global _dataset
+    if _dataset is None:
+        with _dataset_lock:
+            if _dataset is None:
+                _dataset = StationsDataset(load_stations_table())
+    return _dataset
@@ -1,3 +1,343 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from project_api import export, rollups
+from project_api.changelog import STOPTIME, TRIP, ChangeLog
+from project_api.feature_matrix import FEATURE_SCHEMA, build_feature_matrix
+from project_api.stations_dataset import StationsDataset, build_stations_table
+from sncfweb.streaming import dumps, iter_json
+
+STATIONS_CSV_HEADER = (
+    "Code UIC;uic7;Libelle point d'arret;Libelle;"
+    "Libelle STIF (info voyageurs);Libelle SMS gare;Nom Gare;Adresse;"
+    "Code INSEE commune;Commune;X (Lambert II etendu);Y (Lambert II etendu);"
+    "Coord GPS (WGS84);Zone Navigo;Gare non SNCF")
+STATIONS_CSV_ROWS = [
+    "87271031;8727103;GAGNY;GAGNY;GAGNY;Gagny;Gagny;;93032;Gagny;"
+    "613000.0;2430000.0;48.8834, 2.5345;3.0;0.0",
+    "87113001;8711300;PARIS EST;PARIS EST;PARIS-EST;Paris Est;"
+    "Gare de l'Est;;75110;Paris;601000.0;2431000.0;48.8768, 2.3592;1.0;0.0",
+    "87271023;8727102;LE RAINCY;LE RAINCY VILLEMOMBLE MONTFERMEIL;"
+    "LE RAINCY;Le Raincy;Le Raincy;;93062;Le Raincy;"
+    "611000.0;2431000.0;48.8993, 2.5167;;0.0",
+]
+
+
+class RollupsTest(SimpleTestCase):
+
+    def test_add_increments(self):
+        observations = [
+            rollups.observation("20170101", 8, line="C", station="8727103",
+                                delay=5.5),
+            rollups.observation("20170101", 8, line="C", station="8727103",
+                                delay=-2.),
+            rollups.observation("20170101", 32, station="8727103",
+                                canceled=True),
+        ]
+        updates = {}
+        rollups._add_increments(updates, observations, 1)
+        self.assertEqual(sorted(updates), [
+            "20170101:line:C:08", "20170101:station:8727103:08"])
+        line = updates["20170101:line:C:08"]
+        self.assertEqual(line["$inc"], {
+            "count": 2, "delay_sum": 3.5, "histogram.5": 1,
+            "histogram.0": 1})
+        self.assertEqual(line["$max"], {"max_delay": 5.5})
+        station = updates["20170101:station:8727103:08"]
+        self.assertEqual(station["$inc"]["canceled"], 1)
+        self.assertEqual(station["$inc"]["count"], 2)
+
+        # retracted observations are subtracted, max delays are kept
+        rollups._add_increments(updates, observations[:1], -1)
+        self.assertEqual(line["$inc"], {
+            "count": 1, "delay_sum": -2., "histogram.5": 0,
+            "histogram.0": 1})
+        self.assertEqual(line["$max"], {"max_delay": 5.5})
+
+    def test_percentile(self):
+        histogram = {"0": 5, "10": 1, "3": 4}
+        self.assertEqual(rollups.percentile(histogram, 10, 0.5), 0)
+        self.assertEqual(rollups.percentile(histogram, 10, 0.9), 3)
+        self.assertEqual(rollups.percentile(histogram, 10, 0.95), 10)
+        self.assertEqual(rollups.percentile(histogram, 20, 0.95),
+                         rollups.HISTOGRAM_MAX_MINUTES)
+        self.assertIsNone(rollups.percentile({}, 0, 0.95))
+
+
+class StationsDatasetTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("\n".join([STATIONS_CSV_HEADER] + STATIONS_CSV_ROWS))
+        try:
+            cls.dataset = StationsDataset(build_stations_table(path))
+        finally:
+            os.remove(path)
+
+    def names(self, results):
+        return [self.dataset.record(row)["station_name"]
+                for row, _ in results]
+
+    def test_get(self):
+        self.assertEqual(self.dataset.get("87271031")["city"], "Gagny")
+        self.assertEqual(self.dataset.get("8727103")["uic8"], "87271031")
+        self.assertIsNone(self.dataset.get("8727104"))
+        self.assertIsNone(self.dataset.get("12"))
+        self.assertIsNone(self.dataset.get("8727102")["zone"])
+
+    def test_search_prefix(self):
+        results = self.dataset.search("gare de l'est")
+        self.assertEqual(self.names(results), ["Gare de l'Est"])
+        self.assertEqual(results[0][1], 1.)
+        # accents and case don't matter
+        self.assertEqual(self.names(self.dataset.search("PARÎS")),
+                         ["Gare de l'Est"])
+
+    def test_search_typo(self):
+        results = self.dataset.search("gagni")
+        self.assertEqual(self.names(results), ["Gagny"])
+        self.assertLess(results[0][1], 1.)
+
+    def test_search_limit(self):
+        self.assertEqual(len(self.dataset.search("le", limit=1)), 1)
+        self.assertEqual(self.dataset.search(""), [])
+        self.assertEqual(self.dataset.search("zzzzzz"), [])
+
+
+class FeatureMatrixTest(SimpleTestCase):
+
+    def setUp(self):
+        # trip_id, station, sequence, scheduled time, delay, passed
+        rows = [
+            ("T1", "A", 1, 8 * 3600, 60., True),
+            ("T1", "B", 2, 8 * 3600 + 600, 120., True),
+            ("T1", "C", 3, 8 * 3600 + 1200, None, False),
+            ("T2", "A", 1, 9 * 3600, 300., True),
+            ("T2", "B", 2, 9 * 3600 + 600, None, False),
+            ("T3", "C", 1, 10 * 3600, None, False),
+        ]
+        self.frame = pd.DataFrame(rows, columns=[
+            "trip_id", "station_id", "stop_sequence", "scheduled_seconds",
+            "observed_delay", "passed_realtime"])
+        self.features = build_feature_matrix(self.frame)
+
+    def test_schema(self):
+        self.assertEqual(list(self.features.columns), list(FEATURE_SCHEMA))
+        for name, dtype in FEATURE_SCHEMA.items():
+            self.assertEqual(self.features[name].dtype, dtype, name)
+        self.assertEqual(len(build_feature_matrix(self.frame.iloc[:0])), 0)
+
+    def test_trip_features(self):
+        features = self.features
+        self.assertEqual(features.trip_nb_stops.tolist(), [3, 3, 3, 2, 2, 1])
+        self.assertEqual(features.trip_last_observed_sequence[2], 2)
+        self.assertEqual(features.trip_last_observed_delay[2], 120.)
+        self.assertEqual(features.scheduled_time_from_last_observed[2], 600.)
+        self.assertEqual(features.sequence_diff.tolist()[:3], [-1, 0, 1])
+        self.assertEqual(features.to_predict.tolist(),
+                         [False, False, True, False, True, False])
+
+    def test_missing_integer_features(self):
+        # -1 is both a real sequence_diff and the fill value of missing ones
+        features = self.features
+        self.assertEqual(features.sequence_diff[0], -1)
+        self.assertFalse(features.sequence_diff_missing[0])
+        self.assertEqual(features.sequence_diff[5], -1)
+        self.assertTrue(features.sequence_diff_missing[5])
+        self.assertTrue(features.trip_last_observed_sequence_missing[5])
+        self.assertTrue(np.isnan(features.trip_last_observed_delay[5]))
+
+    def test_station_mean_leaves_row_out(self):
+        # regression: a row's own delay was part of its station mean
+        features = self.features
+        self.assertEqual(features.station_nb_stoptimes.tolist(),
+                         [2, 2, 2, 2, 2, 2])
+        self.assertTrue(np.isnan(features.station_mean_observed_delay[0]))
+        self.assertEqual(features.station_mean_observed_delay[3], 60.)
+        self.assertEqual(features.station_mean_observed_delay[4], 120.)
+        # stoptimes not passed don't count
+        self.assertTrue(np.isnan(features.station_mean_observed_delay[5]))
+
+
+class StreamingJSONTest(SimpleTestCase):
+
+    def test_iter_json(self):
+        chunks = list(iter_json({"count": 5, "next": None}, "results",
+                                range(5), encode_row=lambda x: {"n": x},
+                                batch_size=2))
+        # head, 3 batches, end
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b"".join(chunks).decode("utf-8")), {
+            "count": 5, "next": None,
+            "results": [{"n": n} for n in range(5)]})
+
+    def test_iter_json_empty(self):
+        self.assertEqual(
+            json.loads(b"".join(iter_json({}, "results", [])).decode("utf-8")),
+            {"results": []})
+
+    def test_dumps_like_drf(self):
+        when = datetime(2017, 1, 1, 8, 0, 0, 123456, tzinfo=timezone.utc)
+        self.assertEqual(json.loads(dumps({"at": when}).decode("utf-8")),
+                         {"at": JSONEncoder().default(when)})
+
+
+class FakeCursor(list):
+
+    def sort(self, key, direction):
+        return FakeCursor(sorted(self, key=lambda entry: entry[key],
+                                 reverse=direction < 0))
+
+
+class FakeCollection:
+    """ Just what ChangeLog needs from a Mongo collection.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def insert_many(self, entries, ordered=True):
+        self.entries.extend(dict(entry) for entry in entries)
+
+    def find_one(self, query, projection=None, sort=None):
+        entries = self.find(query).sort(*sort[0])
+        return entries[0] if entries else None
+
+    def find(self, query):
+        def matches(entry):
+            for name, value in query.items():
+                if name == "seq":
+                    if not value["$gt"] < entry["seq"] <= value["$lte"]:
+                        return False
+                elif name.startswith("tags."):
+                    if entry["tags"].get(name[5:]) != value:
+                        return False
+                elif entry[name] != value:
+                    return False
+            return True
+        return FakeCursor(filter(matches, self.entries))
+
+
+class ChangeLogTest(SimpleTestCase):
+
+    def setUp(self):
+        self.log = ChangeLog()
+        patcher = mock.patch.object(ChangeLog, "collection", FakeCollection())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_since(self):
+        self.assertEqual(self.log.version, "0")
+        self.log.record("20170101", [
+            (TRIP, "T1", {"delay": 1}, {"line": "C"}),
+            (TRIP, "T2", {"delay": 2}, {"line": "D"}),
+        ])
+        version = self.log.version
+        self.assertEqual(version, "2")
+        self.log.record("20170101", [
+            (TRIP, "T1", {"delay": 3}, {"line": "C"}),
+            (STOPTIME, "T1:1", {"delay": 3}, {"line": "C"}),
+            (TRIP, "T3", None, {"line": "C"}),
+            (TRIP, "T1", {"delay": 4}, {"line": "C"}),
+        ])
+        current, changes = self.log.since(version, TRIP)
+        self.assertEqual(current, "6")
+        # last state of each key, in order of last change
+        self.assertEqual(list(changes.items()),
+                         [("T3", None), ("T1", {"delay": 4})])
+        self.assertEqual(self.log.since("0", TRIP)[1]["T2"], {"delay": 2})
+        self.assertEqual(self.log.since("6", TRIP), ("6", {}))
+
+    def test_since_filters(self):
+        self.log.record("20170101", [
+            (TRIP, "T1", {"delay": 1}, {"line": "C"}),
+            (TRIP, "T2", {"delay": 2}, {"line": "D"}),
+        ])
+        self.assertEqual(list(self.log.since("0", TRIP, line="D")[1]),
+                         ["T2"])
+        self.assertEqual(len(self.log.since("0", TRIP, line=None)[1]), 2)
+        self.assertEqual(self.log.since("0", STOPTIME)[1], {})
+
+    def test_since_not_covered(self):
+        ChangeLog.collection.insert_many([
+            {"seq": seq, "day": "20170101", "kind": TRIP, "key": "T1",
+             "row": {}, "tags": {}} for seq in range(5, 8)])
+        self.assertIsNotNone(self.log.since("4", TRIP))
+        # entries after version were dropped from capped collection
+        self.assertIsNone(self.log.since("3", TRIP))
+        # log was reset
+        self.assertIsNone(self.log.since("8", TRIP))
+        self.assertIsNone(self.log.since("abc", TRIP))
+        self.assertIsNone(self.log.since(None, TRIP))
+
+
+class FakeQuerier:
+    """ Trips and stoptimes of a day, as DBQuerier result rows.
+    """
+
+    def __init__(self, trips):
+        # trip_id: (route_short_name, number of stops)
+        self.trips_stops = trips
+
+    def trips(self, **kwargs):
+        return [SimpleNamespace(Trip=SimpleNamespace(trip_id=trip_id),
+                                Route=SimpleNamespace(route_short_name=line))
+                for trip_id, (line, _) in self.trips_stops.items()]
+
+    def stoptimes(self, trip_id_filter=None, **kwargs):
+        _, nb_stops = self.trips_stops[trip_id_filter]
+        return [SimpleNamespace(StopTime=SimpleNamespace(
+            trip_id=trip_id_filter, stop_sequence=sequence))
+            for sequence in range(nb_stops)]
+
+
+class ExportTest(SimpleTestCase):
+
+    def test_plain_views_without_format_suffix(self):
+        # regression: format suffix patterns passed a format argument plain
+        # views don't accept (TypeError)
+        match = resolve("/api/export/stoptimes")
+        self.assertEqual(match.url_name, "api_export_stoptimes")
+        self.assertEqual(match.kwargs, {})
+        self.assertEqual(resolve("/api/stats/lines/").kwargs, {})
+        with self.assertRaises(Resolver404):
+            resolve("/api/export/stoptimes.json")
+
+    def test_day_trips(self):
+        querier = FakeQuerier({"T3": ("D", 1), "T1": ("C", 1),
+                               "T4": (None, 1), "T2": ("C", 1)})
+        self.assertEqual(list(export.day_trips(querier, "20170101").items()),
+                         [("C", ["T1", "T2"]), ("D", ["T3"]), (None, ["T4"])])
+
+    @mock.patch.object(export, "EXPORT_BATCH_SIZE", 5)
+    def test_iter_line_rows(self):
+        querier = FakeQuerier({"T1": ("C", 3), "T2": ("C", 3),
+                               "T3": ("C", 2), "T4": ("D", 2)})
+        batches = [
+            (line, [(row.StopTime.trip_id, row.StopTime.stop_sequence)
+                    for row in rows])
+            for line, rows in export.iter_line_rows(querier, "20170101")]
+        # whole trips in each batch, batches never mix lines
+        self.assertEqual([(line, len(rows)) for line, rows in batches],
+                         [("C", 6), ("C", 2), ("D", 2)])
+        self.assertEqual(batches[1][1], [("T3", 0), ("T3", 1)])
+
+    @mock.patch.object(export, "TRIP_QUERY_LIMIT", 3)
+    def test_iter_line_rows_limit(self):
+        querier = FakeQuerier({"T1": ("C", 3)})
+        with self.assertRaises(RuntimeError):
+            list(export.iter_line_rows(querier, "20170101"))
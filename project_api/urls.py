@@ -7,9 +7,17 @@ urlpatterns = [
     url(r'^services/$', views.Services.as_view(), name='api_service'),
     url(r'^routes/$', views.Routes.as_view(), name='api_route'),
     url(r'^stations/$', views.Stations.as_view(), name='api_station'),
+    url(r'^stations/search/?$', views.StationSearch.as_view(), name='api_station_search'),
     url(r'^trips/$', views.Trips.as_view(), name='api_trip'),
     url(r'^stoptimes/$', views.StopTimes.as_view(), name='api_stoptime'),
     url(r'^trip-prediction/$', views.TripPrediction.as_view(), name='api_trip_prediction'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
+
+# Plain django views, without format suffixes (export has a format parameter)
+urlpatterns += [
+    url(r'^export/stoptimes/?$', views.export_stoptimes, name='api_export_stoptimes'),
+    url(r'^stats/lines/?$', views.stats_lines, name='api_stats_lines'),
+    url(r'^stats/stations/?$', views.stats_stations, name='api_stats_stations'),
+]
@@ -0,0 +1,61 @@
+"""
+Cheap content versions of api answers, used as ETags by polling endpoints.
+
+- schedule version: changes when a new schedule feed is loaded, or when day
+  changes (active services change).
+- realtime version: digest of realtime states of active trips, computed by
+  the prediction snapshots refresher (project_api/snapshots.py) from last
+  ingested realtime departures (time buckets without snapshots). Answers
+  including realtime, or trips active "now", only change when it changes.
+
+Computing versions does not run the query and serialization pipeline, so
+that unchanged answers are answered 304 Not Modified at almost no cost.
+"""
+
+import hashlib
+import json
+import time
+from datetime import datetime
+
+from lib.api_etl.querier_schedule import DBQuerier
+
+from monitoring.utils_cache import ttl_cache
+from project_api.serializers import CalendarSerializer
+from project_api.snapshots import get_snapshot_store
+
+# Without snapshots, realtime content is versioned by time buckets of N
+# seconds: polls within a bucket can be answered 304, answers are at most
+# that old
+REALTIME_BUCKET_SECONDS = 30
+
+
+@ttl_cache(300)
+def schedule_version(day):
+    """ Hash of services active on day (yyyymmdd): a new feed changes
+    services, or their validity periods.
+    """
+    services = DBQuerier().services(on_day=day, level=1)
+    payload = json.dumps(
+        CalendarSerializer(services, many=True).data, sort_keys=True)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def realtime_version():
+    """ Version of realtime content of last snapshots refresh. Without
+    snapshots (disabled, or not refreshed yet), version of today's schedule
+    and of current time bucket (REALTIME_BUCKET_SECONDS).
+    """
+    store = get_snapshot_store()
+    version = store.version if store is not None else None
+    if version is not None:
+        return version
+    return "%s-%d" % (schedule_version(schedule_day(True)),
+                      time.time() // REALTIME_BUCKET_SECONDS)
+
+
+def schedule_day(on_day):
+    """ Day (yyyymmdd) of on_day parameter, True meaning today.
+    """
+    if on_day is True or not on_day:
+        return datetime.now().strftime("%Y%m%d")
+    return on_day
@@ -2,11 +2,18 @@
 """
 
 import logging
+from collections import OrderedDict
 from datetime import datetime
 from distutils.util import strtobool
 
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 
 from lib.api_etl.querier_schedule import DBQuerier
 from lib.api_etl.querier_realtime import ResultsSet
@@ -15,8 +22,22 @@ from lib.api_etl.builder_feature_vector import TripPredictor, StopTimePredictor
 from project_api.serializers import (
     NestedSerializer, CalendarSerializer, CalendarDateSerializer,
     TripSerializer, StopTimeSerializer, StopSerializer, AgencySerializer,
-    RouteSerializer, AgencySerializer, RealTimeDepartureSerializer, StopTimePredictorSerializer
+    RouteSerializer, AgencySerializer, RealTimeDepartureSerializer, StopTimePredictorSerializer,
+    StationSerializer, StationSearchSerializer
 )
+from project_api.stations_dataset import get_stations_dataset
+from project_api.snapshots import get_snapshot_store
+from project_api.changelog import changelog, today, TRIP, STOPTIME
+from project_api.versions import (
+    schedule_version, realtime_version, schedule_day
+)
+from monitoring.instrumentation import stage
+from sncfweb.cache import cache_policy_ttl, content_etag
+from sncfweb.streaming import (
+    StreamingJSONResponse, STREAMING_MIN_ROWS, accepted_encoding, compress
+)
+from project_api import export
+from project_api import rollups
 
 logger = logging.getLogger("django")
 
@@ -51,9 +72,17 @@ def extract_int(request, name, default=10000):
 
 
 def extract_uic_code(request, name):
+    """ Extract uic code from get parameters, None if not provided. Raises
+    ValidationError (400 answer) if it is not a known station 7 or 8 digits
+    code, rather than ignoring the filter.
+    """
     uic_code = request.query_params.get(name, None)
-    if uic_code and (not((len(uic_code) == 7) or (len(uic_code) == 8))):
-        uic_code = None
+    if not uic_code:
+        return None
+    if len(uic_code) not in (7, 8) or \
+            not get_stations_dataset().is_known(uic_code):
+        raise ValidationError(
+            {name: "Unknown station 7 or 8 digits uic code."})
     return uic_code
 
 
@@ -87,12 +116,205 @@ def extract_at_date(request, name, regex, default=True):
         return default
 
 
+def trips_etag(request, *args, **kwargs):
+    """ Trips answer only changes with schedule, and with time if trips
+    active now are requested.
+    """
+    on_day = extract_at_date(request, "on_day", "%Y%m%d", True)
+    active_at_time = extract_at_date(
+        request, "active_at_time", "%H:%M:%S", True)
+    versions = [schedule_version(schedule_day(on_day))]
+    if active_at_time is True:
+        versions.append(realtime_version())
+    return content_etag(request, *versions)
+
+
+def stoptimes_etag(request, *args, **kwargs):
+    """ Stoptimes answer changes with schedule, and with realtime content if
+    realtime information or trips active now are requested.
+    """
+    on_day = extract_at_date(request, "on_day", "%Y%m%d", True)
+    active_at_time = extract_at_date(
+        request, "active_at_time", "%H:%M:%S", True)
+    realtime = any(extract_bool(request, name, None)
+                   for name in ("realtime", "realtime_only", "prediction"))
+    versions = [schedule_version(schedule_day(on_day))]
+    if realtime or active_at_time is True:
+        versions.append(realtime_version())
+    return content_etag(request, *versions)
+
+
+class InstrumentedListMixin:
+    """ Times queryset computation and serialization as separate stages.
+
+    Large json pages are streamed: rows are serialized and encoded by
+    batches while the response is sent. Pages of paths with a cache policy
+    are not streamed, so that they can be cached (ViewCacheMiddleware skips
+    streaming responses). Views can add keys to paginated answers through
+    extra_payload.
+    """
+    extra_payload = None
+
+    def list(self, request, *args, **kwargs):
+        with stage("queryset"):
+            queryset = self.filter_queryset(self.get_queryset())
+
+        with stage("serialization"):
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                if len(page) >= STREAMING_MIN_ROWS and \
+                        request.accepted_renderer.format == "json" and \
+                        not cache_policy_ttl(request.path):
+                    return self.streaming_response(page)
+                serializer = self.get_serializer(page, many=True)
+                response = self.get_paginated_response(serializer.data)
+                response.data.update(self.extra_payload or {})
+                return response
+
+            serializer = self.get_serializer(queryset, many=True)
+            return Response(serializer.data)
+
+    def streaming_response(self, page):
+        head = OrderedDict([
+            ("count", self.paginator.count),
+            ("next", self.paginator.get_next_link()),
+            ("previous", self.paginator.get_previous_link()),
+        ])
+        head.update(self.extra_payload or {})
+        # one serializer instance for all rows
+        serializer = self.get_serializer()
+        return StreamingJSONResponse(
+            self.request, page, head=head,
+            encode_row=serializer.to_representation)
+
+
+class DeltaListMixin:
+    """ With since=<version> parameter, answers only rows changed since that
+    version, and keys of deleted rows (see project_api/changelog.py). Full
+    answers carry current version, to be used in next poll.
+
+    Views tell with change_filters which requests the change log covers
+    (None if not covered), and how to filter changes.
+    """
+    change_kind = None
+
+    def change_filters(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        filters = None
+        if get_snapshot_store() is not None:
+            filters = self.change_filters()
+        since = request.query_params.get('since', None)
+        if since and filters is not None:
+            delta = changelog.since(since, self.change_kind, **filters)
+            if delta is not None:
+                version, changes = delta
+                return Response({
+                    "version": version,
+                    "delta": True,
+                    "results": [
+                        row for row in changes.values() if row is not None],
+                    "deleted": [
+                        key for key, row in changes.items() if row is None],
+                })
+        if filters is not None:
+            self.extra_payload = {"version": changelog.version}
+        return super().list(request, *args, **kwargs)
+
+
 def index(request):
     context = {}
     return render(request, 'project_api/index.html', context)
 
 
-class Services(generics.ListCreateAPIView):
+def _stats_view(request, dimension, key_param):
+    """
+    Delay stats of a day by line or station, from precomputed rollups.
+    - on_day: yyyymmdd, default today
+    - <key_param>: only this line or station
+    - by_hour: bool, default False, one result per hour
+    """
+    on_day = schedule_day(request.GET.get('on_day', None))
+    try:
+        datetime.strptime(on_day, "%Y%m%d")
+        by_hour = bool(strtobool(request.GET.get('by_hour', 'false')))
+    except ValueError:
+        return JsonResponse(
+            {"error": "on_day must be yyyymmdd, by_hour a boolean."},
+            status=400)
+    key = request.GET.get(key_param, None)
+    if key and dimension == rollups.STATION:
+        key = rollups.uic_code(key)
+        if key is None:
+            return JsonResponse(
+                {"error": "%s must be a 7 or 8 digits uic code." % key_param},
+                status=400)
+    with stage("stats"):
+        results = rollups.rollup_stats(
+            dimension, on_day, key=key, by_hour=by_hour)
+    return JsonResponse({"on_day": on_day, "results": results})
+
+
+def stats_lines(request):
+    """ Delay stats by line (?line=C to filter).
+    """
+    return _stats_view(request, rollups.LINE, "line")
+
+
+def stats_stations(request):
+    """ Delay stats by station, keyed by UIC7 code (?uic=8727103 to filter).
+    """
+    return _stats_view(request, rollups.STATION, "uic")
+
+
+def export_stoptimes(request):
+    """
+    Streams all scheduled stoptimes of a day.
+    - on_day: yyyymmdd, required
+    - format: ndjson (default), csv or parquet
+    - realtime: bool, default False, adds realtime columns
+    - prediction: bool, default False, adds prediction columns
+    """
+    on_day = request.GET.get('on_day', '')
+    export_format = request.GET.get('format', 'ndjson')
+    try:
+        datetime.strptime(on_day, "%Y%m%d")
+    except ValueError:
+        return JsonResponse({"error": "on_day must be yyyymmdd."}, status=400)
+    if export_format not in export.FORMATS:
+        return JsonResponse(
+            {"error": "format must be one of %s." % ", ".join(export.FORMATS)},
+            status=400)
+    if export_format == "parquet" and export.pyarrow is None:
+        return JsonResponse(
+            {"error": "parquet export needs pyarrow."}, status=400)
+
+    def flag(name):
+        try:
+            return bool(strtobool(request.GET.get(name, 'false')))
+        except ValueError:
+            return False
+
+    chunks = export.export_stoptimes(
+        on_day, export_format, realtime=flag('realtime'),
+        prediction=flag('prediction'))
+    # parquet is already compressed
+    encoding = accepted_encoding(request) if export_format != "parquet" \
+        else None
+    if encoding:
+        chunks = compress(chunks, encoding)
+    response = StreamingHttpResponse(
+        chunks, content_type=export.FORMATS[export_format])
+    if encoding:
+        response["Content-Encoding"] = encoding
+    patch_vary_headers(response, ("Accept-Encoding",))
+    response["Content-Disposition"] = \
+        'attachment; filename="stoptimes_%s.%s"' % (on_day, export_format)
+    return response
+
+
+class Services(InstrumentedListMixin, generics.ListCreateAPIView):
     """
     Return Calendar objects.
     """
@@ -118,7 +340,7 @@ class Services(generics.ListCreateAPIView):
         return results
 
 
-class Routes(generics.ListCreateAPIView):
+class Routes(InstrumentedListMixin, generics.ListCreateAPIView):
     """
     Return routes objects.
     """
@@ -139,18 +361,29 @@ class Routes(generics.ListCreateAPIView):
         return results
 
 
-class Stations(generics.ListCreateAPIView):
+class Stations(InstrumentedListMixin, generics.ListCreateAPIView):
     """
     Return stations objects.
+    - uic_code: 7 or 8 digits code, if provided station is served from
+      stations dataset, without database query.
+    - level: int, default 1
+    - on_route_short_name: default None
     """
 
     def get_serializer_class(self):
+        if self.request.query_params.get('uic_code', None):
+            return StationSerializer
         return StopSerializer
 
     def get_queryset(self):
         """ Queryset provider
         """
         # ARGS PARSING
+        if self.request.query_params.get('uic_code', None):
+            uic_code = extract_uic_code(self.request, 'uic_code')
+            station = get_stations_dataset().get(uic_code)
+            return [station] if station else []
+
         level = extract_level(self.request)
         on_route_short_name = self.request.query_params\
             .get('on_route_short_name', None)
@@ -168,7 +401,36 @@ class Stations(generics.ListCreateAPIView):
         return results
 
 
-class Trips(generics.ListCreateAPIView):
+class StationSearch(InstrumentedListMixin, generics.ListAPIView):
+    """
+    Return stations matching searched name, best matches first.
+    Search is accent and case insensitive, and tolerates typos.
+    - q: searched name
+    - limit: int, default 10, between 1 and SEARCH_MAX_LIMIT
+    """
+    serializer_class = StationSearchSerializer
+    pagination_class = None
+
+    SEARCH_MAX_LIMIT = 50
+
+    def get_queryset(self):
+        """ Queryset provider
+        """
+        query = self.request.query_params.get('q', '')
+        limit = min(max(extract_int(self.request, 'limit', 10), 1),
+                    self.SEARCH_MAX_LIMIT)
+        dataset = get_stations_dataset()
+        results = []
+        for row, score in dataset.search(query, limit=limit):
+            station = dataset.record(row)
+            station["score"] = round(score, 3)
+            results.append(station)
+        return results
+
+
+@method_decorator(condition(etag_func=trips_etag), name="get")
+class Trips(DeltaListMixin, InstrumentedListMixin,
+            generics.ListCreateAPIView):
     """
     Return trips objects.
     - active_at_time: hh:mm:ss or boolean, default True (active now)
@@ -176,8 +438,15 @@ class Trips(generics.ListCreateAPIView):
     - level: int, default 2
     - limit: int, default 10000
     - get_trip: default None (to filter one Trip): not implemented yet
+    - since: version, to get only trips changed since then (level 3 trips
+      active now only), and trip_ids of trips not active anymore
+
+    Answers carry an ETag: polls with a matching If-None-Match header are
+    answered 304 Not Modified without querying.
     """
 
+    change_kind = TRIP
+
     def get_serializer_class(self):
         level = extract_level(self.request)
         if level == 1:
@@ -185,6 +454,16 @@ class Trips(generics.ListCreateAPIView):
         else:
             return NestedSerializer
 
+    def change_filters(self):
+        active_at_time = extract_at_date(
+            self.request, "active_at_time", "%H:%M:%S", True)
+        on_day = extract_at_date(self.request, "on_day", "%Y%m%d", True)
+        if extract_level(self.request) != 3 or active_at_time is not True \
+                or on_day is not True:
+            return None
+        return {"route": self.request.query_params
+                .get('on_route_short_name', None)}
+
     def get_queryset(self):
         """ Queryset provider
         """
@@ -222,7 +501,9 @@ class Trips(generics.ListCreateAPIView):
         return results
 
 
-class StopTimes(generics.ListCreateAPIView):
+@method_decorator(condition(etag_func=stoptimes_etag), name="get")
+class StopTimes(DeltaListMixin, InstrumentedListMixin,
+                generics.ListCreateAPIView):
     """
     Return stoptimes objects.
     - active_at_time: hh:mm:ss or boolean, default True (active now)
@@ -233,8 +514,17 @@ class StopTimes(generics.ListCreateAPIView):
     - trip_id_filter: default None
     - realtime: bool, default False
     - realtime_only: bool, default False
+    - since: version, to get only stoptimes whose realtime state or
+      prediction changed since then, and keys (trip_id:stop_sequence) of
+      deleted stoptimes; only for level 3 realtime queries of trips active
+      now
+
+    Answers carry an ETag: polls with a matching If-None-Match header are
+    answered 304 Not Modified without querying.
     """
 
+    change_kind = STOPTIME
+
     def get_serializer_class(self):
         realtime = extract_bool(self.request, "realtime", None)
         realtime_only = extract_bool(self.request, "realtime_only", None)
@@ -246,6 +536,26 @@ class StopTimes(generics.ListCreateAPIView):
         else:
             return NestedSerializer
 
+    def change_filters(self):
+        # change log covers stoptimes of trips active now, with or without
+        # realtime information
+        realtime = any(extract_bool(self.request, name, None)
+                       for name in ("realtime", "prediction"))
+        realtime_only = extract_bool(self.request, "realtime_only", None)
+        active_at_time = extract_at_date(
+            self.request, "active_at_time", "%H:%M:%S", True)
+        on_day = extract_at_date(self.request, "on_day", "%Y%m%d", True)
+        if not realtime or realtime_only or active_at_time is not True or \
+                extract_level(self.request) < 3 or \
+                self.request.query_params.get('uic_code', None) or \
+                on_day not in (True, False, today()):
+            return None
+        return {
+            "trip_id": self.request.query_params.get('trip_id_filter', None),
+            "route": self.request.query_params
+            .get('on_route_short_name', None),
+        }
+
     def get_queryset(self):
         """ Queryset provider
         """
@@ -310,9 +620,10 @@ class StopTimes(generics.ListCreateAPIView):
                 result, scheduled_day=on_day
                 if on_day is not True else None
             )
-            result_serializer.batch_realtime_query(
-                scheduled_day=on_day if on_day is not True else None
-            )
+            with stage("dynamo"):
+                result_serializer.batch_realtime_query(
+                    scheduled_day=on_day if on_day is not True else None
+                )
             result_serializer.compute_stoptimes_states()
 
             response = result_serializer.results
@@ -326,7 +637,7 @@ class StopTimes(generics.ListCreateAPIView):
             return result
 
 
-class TripPrediction(generics.ListCreateAPIView):
+class TripPrediction(InstrumentedListMixin, generics.ListCreateAPIView):
     """
     Return stoptimes predictions
 
@@ -334,11 +645,33 @@ class TripPrediction(generics.ListCreateAPIView):
 
     Example: /api/trip-prediction/?trip_id=DUASN145833F05002-1_408310
         (works if trip_id is present in base and is running on that day)
+
+    Predictions of active trips are read from the snapshot store (refreshed
+    by `manage.py refresh_snapshots`), and response tells snapshot age in seconds. Trips not in
+    store are computed inline.
     """
 
     def get_serializer_class(self):
         return StopTimePredictorSerializer
 
+    def list(self, request, *args, **kwargs):
+        trip_id = self.request.query_params.get('trip_id', None)
+        store = get_snapshot_store()
+        snapshot = store.get(trip_id) if (store and trip_id) else None
+        if not snapshot:
+            return super().list(request, *args, **kwargs)
+
+        # Predictions are already serialized
+        snapshot_age = round(snapshot.age(), 1)
+        page = self.paginate_queryset(snapshot.predictions)
+        if page is not None:
+            response = self.get_paginated_response(page)
+            response.data["snapshot_age"] = snapshot_age
+        else:
+            response = Response(snapshot.predictions)
+        response["X-Snapshot-Age"] = snapshot_age
+        return response
+
     def get_queryset(self):
         """ Queryset provider
         """
@@ -350,5 +683,6 @@ class TripPrediction(generics.ListCreateAPIView):
             return []
 
         # PERFORM QUERY
-        trip_predictor = TripPredictor(trip_id=trip_id)
-        return list(trip_predictor._stoptime_predictors.values())
\ No newline at end of file
+        with stage("prediction"):
+            trip_predictor = TripPredictor(trip_id=trip_id)
+        return list(trip_predictor._stoptime_predictors.values())
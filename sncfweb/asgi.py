@@ -0,0 +1,160 @@
+"""
+ASGI config for sncfweb project.
+
+Serves realtime push (server-sent events) natively on /stream/, async maps
+views (maps/views_async.py), and delegates every other request to the
+Django WSGI application:
+
+    uvicorn sncfweb.asgi:application --port 8080
+
+Push endpoint:
+- /stream/?trip_id=<trip_id>: predictions of a trip
+- /stream/?uic_code=<uic>: stoptimes of active trips at a station
+"""
+
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from django.http import HttpRequest, QueryDict
+
+from sncfweb.wsgi import application as wsgi_application
+
+# Imported after Django setup (done by WSGI application)
+from project_api.push import broadcaster, TRIP, STATION  # noqa: E402
+from project_api.stations_dataset import get_stations_dataset  # noqa: E402
+from maps import views_async  # noqa: E402
+
+# Comment sent when nothing happened, so that proxies keep connection open
+KEEPALIVE_SECONDS = 15
+
+django_application = WsgiToAsgi(wsgi_application)
+
+ASYNC_VIEWS = {
+    "/maps/stop_points": views_async.ajax_stop_points,
+    "/maps/disruptions": views_async.ajax_disruptions,
+}
+
+
+def django_request(scope):
+    """ Django request of an ASGI http scope (without body).
+    """
+    request = HttpRequest()
+    request.method = scope["method"]
+    request.path = request.path_info = scope["path"]
+    query_string = scope.get("query_string", b"").decode("latin-1")
+    request.GET = QueryDict(query_string)
+    request.META = {
+        "REQUEST_METHOD": scope["method"],
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": query_string,
+    }
+    for name, value in scope.get("headers", []):
+        key = "HTTP_" + name.decode("latin-1").upper().replace("-", "_")
+        request.META[key] = value.decode("latin-1")
+    return request
+
+
+async def send_response(send, response):
+    """ Sends a Django response.
+    """
+    headers = [(name.encode("latin-1"), value.encode("latin-1"))
+               for name, value in response.items()]
+    await send({"type": "http.response.start",
+                "status": response.status_code, "headers": headers})
+    if response.streaming:
+        for chunk in response.streaming_content:
+            await send({"type": "http.response.body", "body": chunk,
+                        "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    else:
+        await send({"type": "http.response.body", "body": response.content})
+
+
+async def send_json(send, status, payload):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body",
+                "body": json.dumps(payload).encode("utf-8")})
+
+
+def stream_subscription(query_string):
+    """ Returns (kind, value) subscribed key, or None.
+    """
+    params = parse_qs(query_string.decode("latin-1"))
+    trip_id = params.get("trip_id", [None])[0]
+    if trip_id:
+        return TRIP, trip_id
+    uic_code = params.get("uic_code", [None])[0]
+    if uic_code and get_stations_dataset().is_known(uic_code):
+        return STATION, uic_code
+    return None
+
+
+async def wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def stream(scope, receive, send):
+    """ Server-sent events stream of updates of one trip or station.
+    """
+    subscription = stream_subscription(scope.get("query_string", b""))
+    if subscription is None:
+        await send_json(send, 400, {
+            "error": "Provide either trip_id, or a known uic_code."})
+        return
+
+    queue = broadcaster.subscribe(*subscription)
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream"),
+        (b"cache-control", b"no-cache"),
+        (b"x-accel-buffering", b"no"),
+    ]})
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        while True:
+            message = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                [message, disconnected], timeout=KEEPALIVE_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                message.cancel()
+                break
+            if message in done:
+                body = "event: update\ndata: %s\n\n" % json.dumps(
+                    message.result())
+            else:
+                message.cancel()
+                body = ": keepalive\n\n"
+            await send({"type": "http.response.body",
+                        "body": body.encode("utf-8"), "more_body": True})
+    finally:
+        disconnected.cancel()
+        broadcaster.unsubscribe(*subscription, queue)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+    elif scope["type"] == "http" and scope["path"].rstrip("/") == "/stream":
+        await stream(scope, receive, send)
+    elif scope["type"] == "http" and scope["path"] in ASYNC_VIEWS and \
+            scope["method"] in ("GET", "HEAD"):
+        view = ASYNC_VIEWS[scope["path"]]
+        await send_response(send, await view(django_request(scope)))
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,237 @@
+"""
+Tiered, view-aware cache.
+
+- TieredCache: cache backend with a local memory L1 in front of an optional
+  shared L2 (any other configured cache alias, e.g. memcached).
+- ViewCacheMiddleware: caches GET responses with a TTL chosen per path
+  (CACHE_POLICIES setting), keys normalized over query parameters, and
+  protection against cache stampedes: one recomputation per key at a time.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import unquote_etag
+
+
+class TieredCache(BaseCache):
+    """ Local memory L1 cache in front of an optional shared L2 cache.
+
+    OPTIONS:
+    - L2: alias of shared cache in CACHES, or None for local cache only.
+    - L1_MAX_ENTRIES: max number of entries kept in local memory.
+    """
+
+    def __init__(self, location, params):
+        options = params.get("OPTIONS", {})
+        self.l2_alias = options.get("L2")
+        l1_params = {
+            "TIMEOUT": params.get("TIMEOUT", 300),
+            "OPTIONS": {"MAX_ENTRIES": options.get("L1_MAX_ENTRIES", 1000)},
+        }
+        params = dict(params, OPTIONS={})
+        super().__init__(params)
+        self.l1 = LocMemCache(location or "tiered-l1", l1_params)
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias] if self.l2_alias else None
+
+    def get(self, key, default=None, version=None):
+        value = self.l1.get(key, default, version=version)
+        if value is not default or self.l2 is None:
+            return value
+        entry = self.l2.get(key, version=version)
+        if entry is None:
+            return default
+        # L2 entries hold their expiry, so that L1 doesn't outlive them
+        value, expires_at = entry
+        remaining = expires_at - time.time() if expires_at else None
+        if remaining is None or remaining > 0:
+            self.l1.set(key, value, remaining, version=version)
+            return value
+        return default
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l1.set(key, value, timeout, version=version)
+        if self.l2 is not None:
+            timeout = self.get_backend_timeout(timeout)
+            expires_at = time.time() + timeout if timeout else None
+            self.l2.set(key, (value, expires_at), timeout, version=version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.l2 is not None:
+            timeout = self.get_backend_timeout(timeout)
+            expires_at = time.time() + timeout if timeout else None
+            return self.l2.add(key, (value, expires_at), timeout,
+                               version=version)
+        return self.l1.add(key, value, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.l1.delete(key, version=version)
+        if self.l2 is not None:
+            self.l2.delete(key, version=version)
+
+    def clear(self):
+        self.l1.clear()
+        if self.l2 is not None:
+            self.l2.clear()
+
+
+def normalized_cache_key(request, prefix="view"):
+    """ Cache key of request: same key whatever query parameters order,
+    empty parameters and internal parameters (starting with "_") ignored.
+    """
+    params = sorted(
+        (key, value)
+        for key in request.GET.keys() if not key.startswith("_")
+        for value in request.GET.getlist(key) if value != ""
+    )
+    # json api and browsable api answers differ
+    accept = "html" if "text/html" in request.META.get("HTTP_ACCEPT", "") \
+        else "json"
+    raw = "%s?%s#%s" % (request.path, urlencode(params), accept)
+    return "%s:%s" % (prefix, hashlib.md5(raw.encode("utf-8")).hexdigest())
+
+
+def content_etag(request, *versions):
+    """ ETag of an answer, from request normalized parameters and versions
+    of the content it is built from.
+    """
+    raw = "%s|%s" % (normalized_cache_key(request, prefix="etag"),
+                     "|".join(str(version) for version in versions))
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+def cache_policy_ttl(path, policies=None):
+    """ TTL of first CACHE_POLICIES pattern matching path, None if path is
+    not cached.
+    """
+    if policies is None:
+        policies = getattr(settings, "CACHE_POLICIES", [])
+    for pattern, ttl in policies:
+        if re.match(pattern, path):
+            return ttl
+    return None
+
+
+class ViewCacheMiddleware:
+    """
+    Caches GET responses, with TTL from first matching CACHE_POLICIES
+    pattern (None or 0 meaning no caching).
+
+    When an entry is missing, only one request per key recomputes it: other
+    requests of the same process wait for it, and requests of other processes
+    wait for it as long as a lock in shared cache is held.
+
+    Requests of authenticated users are not cached, nor responses that read
+    the session or use the CSRF cookie: their content depends on the user.
+    """
+
+    LOCK_TIMEOUT = 30
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cache = caches[getattr(settings, "CACHE_MIDDLEWARE_ALIAS",
+                                    "default")]
+        self.policies = [
+            (re.compile(pattern), ttl)
+            for pattern, ttl in getattr(settings, "CACHE_POLICIES", [])
+        ]
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def ttl(self, path):
+        return cache_policy_ttl(path, self.policies)
+
+    def __call__(self, request):
+        ttl = self.ttl(request.path)
+        if request.method not in ("GET", "HEAD") or not ttl or \
+                "_profile" in request.GET or self._authenticated(request):
+            return self.get_response(request)
+
+        key = normalized_cache_key(request)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return self._hit(request, cached, ttl)
+
+        with self._local_lock(key):
+            cached = self.cache.get(key)
+            locked = False
+            if cached is None:
+                cached, locked = self._wait_other_process(key)
+            if cached is not None:
+                return self._hit(request, cached, ttl)
+            try:
+                response = self.get_response(request)
+                if self._cacheable(request, response):
+                    self.cache.set(key, response, ttl)
+            finally:
+                # lock of another process is left to expire
+                if locked:
+                    self.cache.delete(key + ":lock")
+        patch_cache_control(response, max_age=ttl)
+        response["X-Cache"] = "MISS"
+        return response
+
+    def _local_lock(self, key):
+        with self._locks_lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+                if len(self._locks) > 10000:
+                    # forget locks of other keys, they are cheap to recreate
+                    self._locks = {key: lock}
+        return lock
+
+    def _wait_other_process(self, key):
+        """ Takes shared lock on key, or waits for value computed by process
+        holding it. Returns (cached value if it appeared meanwhile, whether
+        lock was taken).
+        """
+        deadline = time.time() + self.LOCK_TIMEOUT
+        while not self.cache.add(key + ":lock", 1, self.LOCK_TIMEOUT):
+            if time.time() > deadline:
+                return None, False
+            time.sleep(self.POLL_INTERVAL)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, False
+        return None, True
+
+    @staticmethod
+    def _authenticated(request):
+        user = getattr(request, "user", None)
+        return user is not None and bool(user.is_authenticated)
+
+    @staticmethod
+    def _cacheable(request, response):
+        session = getattr(request, "session", None)
+        return (
+            not (session is not None and session.accessed) and
+            not request.META.get("CSRF_COOKIE_USED") and
+            response.status_code == 200 and
+            not response.streaming and
+            not response.cookies and
+            "cookie" not in response.get("Vary", "").lower()
+        )
+
+    @staticmethod
+    def _hit(request, response, ttl):
+        if response.has_header("ETag"):
+            # client may already have this content
+            response = get_conditional_response(
+                request, etag=unquote_etag(response["ETag"]),
+                response=response)
+        patch_cache_control(response, max_age=ttl)
+        response["X-Cache"] = "HIT"
+        return response
@@ -27,20 +27,22 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'maps',
     'monitoring',
+    'project_api',
     'rest_framework',
     'djangobower',
 ]
 
 MIDDLEWARE = [
-    'django.middleware.cache.UpdateCacheMiddleware',
+    'monitoring.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'monitoring.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
+    'sncfweb.cache.ViewCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'sncfweb.urls'
@@ -191,14 +193,73 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20
 }
 
+# Local memory cache (L1) of each process, in front of a shared cache (L2)
+# if CACHE_L2_BACKEND is set (for instance
+# django.core.cache.backends.memcached.PyLibMCCache with CACHE_L2_LOCATION).
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
-        'LOCATION': 'cache_table',
-    }
+        'BACKEND': 'sncfweb.cache.TieredCache',
+        'LOCATION': 'sncfweb-l1',
+        'OPTIONS': {
+            'L2': 'shared' if get_secret("CACHE_L2_BACKEND") else None,
+            'L1_MAX_ENTRIES': 5000,
+        },
+    },
 }
+if get_secret("CACHE_L2_BACKEND"):
+    CACHES['shared'] = {
+        'BACKEND': get_secret("CACHE_L2_BACKEND"),
+        'LOCATION': get_secret("CACHE_L2_LOCATION"),
+    }
+
+# Responses cache TTL in seconds, per path: first matching pattern wins,
+# None means not cached.
+CACHE_POLICIES = [
+    (r'^/admin/', None),
+    (r'^/monitoring/', None),
+    (r'^/maps/update_disruptions', None),
+    # schedules
+    (r'^/api/(services|routes|stations)/', 3600),
+    (r'^/maps/stop_points', 3600),
+    (r'^/api/trips/', 30),
+    # realtime
+    (r'^/api/(stoptimes|trip-prediction)/', 5),
+    (r'^/maps/(disruptions|tiles/)', 30),
+    (r'^/api/stats/', 30),
+    # pages
+    (r'^/(api/|board/|maps/|documentation/)?$', 300),
+    (r'^/(board|maps|documentation)/', 300),
+]
 
-CACHE_MIDDLEWARE_SECONDS = 60
+# Daily realtime departures archive (manage.py compact_realtime)
+REALTIME_ARCHIVE_DIR = path.join(BASE_DIR, "data", "realtime_archive")
+
+# Trip predictions are recomputed every N seconds by a single
+# `manage.py refresh_snapshots` process, set to None to compute them inline
+# at each api call.
+PREDICTION_SNAPSHOT_INTERVAL = 60
+
+# Realtime state of trips and stations watched by push clients (ASGI
+# /stream/ endpoint) is recomputed every N seconds.
+REALTIME_PUSH_INTERVAL = 15
+
+# Max number of changes of trips and stoptimes kept for delta updates
+# (since=<version> api parameter).
+CHANGELOG_SIZE = 50000
+
+# Databases health is sampled every N seconds (None to disable) by a single
+# `manage.py collect_health` process, last samples are kept for
+# /monitoring/history (720 samples: 6 hours every 30 seconds).
+MONITORING_COLLECTOR_INTERVAL = 30
+MONITORING_HISTORY_SIZE = 720
+
+# Profiling: staff users can profile a request with ?_profile=1 (cProfile) or
+# ?_profile=sampling (flamegraph collapsed stacks). A fraction of requests can
+# also be profiled with the sampling profiler, profiles are then stored in
+# memory (/monitoring/profiles) and in PROFILE_DIR if set.
+PROFILED_PATHS = ("/api/", "/maps/")
+PROFILE_SAMPLE_RATE = 0
+PROFILE_DIR = os.environ.get('PROFILE_DIR', None)
 
 
 # STATIC FILES
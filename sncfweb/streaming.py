@@ -0,0 +1,120 @@
+"""
+Streaming JSON responses.
+
+Large lists are encoded incrementally, by batches of rows, with a fast JSON
+encoder (orjson if installed, stdlib json otherwise), and sent as a chunked
+response compressed on the fly (brotli if installed and accepted, else
+gzip). The whole body never sits in memory, and first bytes are sent as
+soon as the first batch is encoded.
+
+Values the fast encoders don't support (decimals, dates...) are encoded as
+by DRF JSON renderer.
+"""
+
+import itertools
+import json
+import zlib
+
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Rows encoded per chunk
+STREAMING_BATCH_SIZE = 200
+# Lists shorter than this are not worth streaming (and stay cacheable)
+STREAMING_MIN_ROWS = 200
+
+
+_drf_encoder = JSONEncoder()
+
+
+def dumps(obj):
+    """ Encodes obj as JSON bytes.
+    """
+    if orjson is not None:
+        # datetimes formatted as DRF does
+        return orjson.dumps(obj, default=_drf_encoder.default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(obj, separators=(",", ":"),
+                      cls=JSONEncoder).encode("utf-8")
+
+
+def iter_json(head, key, rows, encode_row=None,
+              batch_size=STREAMING_BATCH_SIZE):
+    """ Yields JSON of head dictionary with rows list under key, by chunks
+    of batch_size rows. encode_row converts a row to a JSON-serializable
+    object (identity by default).
+    """
+    head_bytes = dumps(head)
+    if head:
+        yield head_bytes[:-1] + b',' + dumps(key) + b':['
+    else:
+        yield b'{' + dumps(key) + b':['
+    batch = []
+    first = True
+    for row in rows:
+        batch.append(dumps(encode_row(row) if encode_row else row))
+        if len(batch) >= batch_size:
+            yield (b'' if first else b',') + b','.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield (b'' if first else b',') + b','.join(batch)
+    yield b']}'
+
+
+def accepted_encoding(request):
+    accept = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    if brotli is not None and "br" in accept:
+        return "br"
+    if "gzip" in accept:
+        return "gzip"
+    return None
+
+
+def compress(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """ Chunked JSON response of head dictionary, with rows under key.
+    """
+
+    def __init__(self, request, rows, head=None, key="results",
+                 encode_row=None, status=200):
+        chunks = iter_json(head or {}, key, rows, encode_row)
+        # head and first batch are encoded before headers are sent: an
+        # error there is raised from the view (error answer), instead of a
+        # truncated body with status 200
+        chunks = itertools.chain(list(itertools.islice(chunks, 2)), chunks)
+        encoding = accepted_encoding(request)
+        if encoding:
+            chunks = compress(chunks, encoding)
+        super().__init__(chunks, content_type="application/json",
+                         status=status)
+        if encoding:
+            self["Content-Encoding"] = encoding
+        patch_vary_headers(self, ("Accept-Encoding",))
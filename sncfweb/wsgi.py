@@ -14,3 +14,16 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sncfweb.settings.prod")
 
 application = get_wsgi_application()
+
+# Build in-memory indexes at startup rather than on first request
+from maps.spatial_index import get_stop_points_index  # noqa: E402
+from project_api.stations_dataset import get_stations_dataset  # noqa: E402
+from maps.geometries import get_trip_geometries  # noqa: E402
+get_stop_points_index()
+get_stations_dataset()
+get_trip_geometries()
+
+# Warn about missing Mongo indexes (created by manage.py mongo_indexes)
+from maps.indexes import check_mongo_indexes  # noqa: E402
+from maps.utils import get_collection  # noqa: E402
+check_mongo_indexes(get_collection("route_schedules").database)